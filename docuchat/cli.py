@@ -0,0 +1,179 @@
+"""DocuChat command-line interface.
+
+    docuchat ingest <dir> --out <kb_dir>    # bulk, resumable, incremental
+    docuchat ingest <dir> --out <kb_dir> --shards 4 [--shard 2]
+    docuchat serve --port 8501              # warmed-up app + /ready endpoint
+    docuchat embed-server --socket /run/docuchat/embed.sock   # one model for all replicas
+"""
+
+import argparse
+import os
+import sys
+
+
+def _cmd_ingest(args: argparse.Namespace) -> int:
+    from docuchat.core.embeddings import EmbeddingPool, create_embeddings
+    from docuchat.core.ingest import ingest_directory
+
+    if not os.path.isdir(args.directory):
+        print(f"error: not a directory: {args.directory}", file=sys.stderr)
+        return 2
+
+    if args.shard is not None and not 0 <= args.shard < args.shards:
+        print("error: --shard needs --shards and must be below it", file=sys.stderr)
+        return 2
+    if args.shards and args.snapshot:
+        print("error: --snapshot cannot be combined with --shards", file=sys.stderr)
+        return 2
+    if args.shards:
+        from docuchat.core.sharding import shard_count, shard_directory
+
+        existing = shard_count(args.out) if os.path.isdir(args.out) else 0
+        if existing and existing != args.shards:
+            print(
+                f"error: {args.out} has {existing} shards; re-ingest into a new directory "
+                f"to change the shard count",
+                file=sys.stderr,
+            )
+            return 2
+
+    embeddings = EmbeddingPool(args.embed_workers) if args.embed_workers else create_embeddings()
+    try:
+        if args.shards:
+            shards = [args.shard] if args.shard is not None else range(args.shards)
+            for shard in shards:
+                stats = ingest_directory(
+                    args.directory,
+                    shard_directory(args.out, shard, args.shards),
+                    embeddings,
+                    workers=args.workers,
+                    batch_files=args.batch_files,
+                    progress=not args.quiet,
+                    shard=(shard, args.shards),
+                )
+                _print_stats(stats, shard_directory(args.out, shard, args.shards))
+            return 0
+
+        stats = ingest_directory(
+            args.directory,
+            args.out,
+            embeddings,
+            workers=args.workers,
+            batch_files=args.batch_files,
+            progress=not args.quiet,
+        )
+        if args.snapshot:
+            from docuchat.core.ingest import KnowledgeBase
+            from docuchat.core.snapshot import export_snapshot
+
+            kb = KnowledgeBase(args.out, embeddings)
+            if kb.store is not None:
+                export_snapshot(kb.store, args.snapshot, float16=args.float16)
+    finally:
+        if isinstance(embeddings, EmbeddingPool):
+            embeddings.close()
+
+    _print_stats(stats, args.out)
+    return 0
+
+
+def _print_stats(stats, out: str) -> None:
+    print(
+        f"added {stats.added}, changed {stats.changed}, deleted {stats.deleted}, "
+        f"unchanged {stats.unchanged}, failed {stats.failed} · "
+        f"{stats.chunks} chunks in {stats.seconds:.1f}s → {out}"
+    )
+
+
+def _cmd_serve(args: argparse.Namespace) -> int:
+    from streamlit.web import bootstrap
+
+    from docuchat.core import metrics, warmup
+
+    # Warm up in the Streamlit server process itself, before any session
+    # exists, so the model the app's st.cache_resource returns is already
+    # loaded when the first user connects.
+    server = metrics.start_metrics_server(args.status_port)
+    warmup.start_warmup()
+    if server is not None:
+        print(f"status: http://localhost:{server.server_address[1]}/ready (and /metrics)")
+
+    app = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ui", "app.py")
+    flag_options = {"server.port": args.port, "server.headless": True}
+    bootstrap.load_config_options(flag_options=flag_options)
+    bootstrap.run(app, False, [], flag_options)
+    return 0
+
+
+def _cmd_embed_server(args: argparse.Namespace) -> int:
+    from docuchat.core.embed_server import EmbeddingServer
+    from docuchat.core.embeddings import create_embeddings
+
+    if (args.socket is None) == (args.port is None):
+        print("error: give exactly one of --socket and --port", file=sys.stderr)
+        return 2
+    if args.max_delay_ms < 0 or args.max_batch < 1:
+        print("error: --max-delay-ms must be >= 0 and --max-batch >= 1", file=sys.stderr)
+        return 2
+
+    address = f"unix:{args.socket}" if args.socket else f"{args.host}:{args.port}"
+    server = EmbeddingServer(
+        address,
+        create_embeddings(remote=False),  # never a client of itself
+        max_delay=args.max_delay_ms / 1000,
+        max_batch=args.max_batch,
+    )
+    print(f"embedding server: {server.address}  (replicas: DOCUCHAT_EMBED_SERVER={server.address})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="docuchat", description="DocuChat tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("ingest", help="index a directory tree into a knowledge base")
+    p.add_argument("directory", help="root of the document tree (PDF, DOCX, TXT)")
+    p.add_argument("--out", default="knowledge_base", help="knowledge base directory")
+    p.add_argument("--workers", type=int, default=None, help="extraction processes (default: all cores)")
+    p.add_argument("--embed-workers", type=int, default=0, help="embedding processes (default: in-process)")
+    p.add_argument("--batch-files", type=int, default=200, help="files extracted and indexed together")
+    p.add_argument("--snapshot", help="also export a .dckb snapshot to this path")
+    p.add_argument("--float16", action="store_true", help="half-precision snapshot vectors")
+    p.add_argument("--quiet", action="store_true", help="no progress bar")
+    p.add_argument("--shards", type=int, default=0, help="split files across N index shards")
+    p.add_argument("--shard", type=int, default=None, help="only (re)build this shard of --shards")
+    p.set_defaults(func=_cmd_ingest)
+
+    p = sub.add_parser("serve", help="run the web app with eager warm-up and readiness checks")
+    p.add_argument("--port", type=int, default=8501, help="Streamlit port")
+    p.add_argument(
+        "--status-port", type=int, default=None,
+        help="port for /ready, /healthz and /metrics (default: $DOCUCHAT_METRICS_PORT, else off)",
+    )
+    p.set_defaults(func=_cmd_serve)
+
+    p = sub.add_parser("embed-server", help="serve one embedding model to every app replica on the host")
+    p.add_argument("--socket", help="Unix socket path to listen on")
+    p.add_argument("--port", type=int, help="TCP port to listen on instead")
+    p.add_argument("--host", default="127.0.0.1", help="TCP interface (default: localhost only)")
+    p.add_argument(
+        "--max-delay-ms", type=float,
+        default=float(os.environ.get("DOCUCHAT_EMBED_MAX_DELAY_MS", "5")),
+        help="longest a text waits for others to share its model call "
+             "(default: $DOCUCHAT_EMBED_MAX_DELAY_MS, else 5)",
+    )
+    p.add_argument("--max-batch", type=int, default=256, help="texts per model call")
+    p.set_defaults(func=_cmd_embed_server)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""Persistent cache of extracted document text, shared across processes.
+
+Entries are keyed by the file's SHA-256, its extension and the extractor
+version, so bumping ``_EXTRACTOR_VERSION`` in :mod:`docuchat.core.document`
+invalidates everything extracted by older code. Writes are atomic
+(temp file + rename) and eviction is serialized with a lock file, so several
+server processes can share one cache directory.
+"""
+
+import gzip
+import json
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: eviction runs without the cross-process lock
+    fcntl = None
+
+_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "docuchat")
+_CACHE_MAX_MB = 512
+_EVICT_TARGET = 0.9  # shrink to 90% of the budget once it is exceeded
+
+
+def cache_root() -> str:
+    """Root of the on-disk caches: ``$DOCUCHAT_CACHE_DIR`` (default ``~/.cache/docuchat``)."""
+    return os.environ.get("DOCUCHAT_CACHE_DIR", _CACHE_DIR)
+
+
+def cache_budget_mb() -> int:
+    """``DOCUCHAT_CACHE_MAX_MB`` (default 512); ``0`` disables the caches."""
+    return int(os.environ.get("DOCUCHAT_CACHE_MAX_MB", _CACHE_MAX_MB))
+
+
+class ExtractionCache:
+    """
+    Size-bounded, LRU-evicted store of text entries.
+
+    Entries are ``{"text": ...}`` dicts, plus ``"pages"`` (page start
+    offsets) when given; other text caches such as summaries reuse it.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._approx_bytes: int | None = None  # refreshed on every eviction scan
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json.gz")
+
+    @staticmethod
+    def make_key(content_hash: str, ext: str, version: int) -> str:
+        return f"{content_hash}{ext.lower()}-v{version}"
+
+    def get(self, key: str) -> dict | None:
+        """Return the cached entry for ``key``, or ``None`` on a miss."""
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)  # mark as recently used for LRU eviction
+            return entry
+        except (OSError, EOFError, ValueError):
+            return None  # missing, concurrently evicted, or a truncated/corrupt file
+
+    def put(self, key: str, text: str, pages: list[int] | None = None) -> None:
+        """Atomically store an entry, evicting old ones if over budget."""
+        entry = {"text": text} if pages is None else {"text": text, "pages": pages}
+        path = self._path(key)
+        tmp = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        except OSError:  # e.g. disk full or the directory became read-only
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+            return
+
+        with self._lock:
+            if self._approx_bytes is not None:
+                self._approx_bytes += os.path.getsize(path)
+            if self._approx_bytes is None or self._approx_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        try:
+            lock_file = open(os.path.join(self.directory, ".lock"), "w")
+        except OSError:
+            return
+        try:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return  # another process is already evicting
+            entries = []
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if not name.endswith(".json.gz"):
+                        continue
+                    try:
+                        st = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, os.path.join(root, name)))
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                for _, size, path in sorted(entries):
+                    if total <= self.max_bytes * _EVICT_TARGET:
+                        break
+                    try:
+                        os.remove(path)
+                        total -= size
+                    except FileNotFoundError:
+                        pass
+            self._approx_bytes = total
+        finally:
+            lock_file.close()
+
+
+_cache: ExtractionCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> ExtractionCache | None:
+    """
+    Return the process-wide extraction cache.
+
+    Stored under ``$DOCUCHAT_CACHE_DIR/extractions`` and bounded by
+    ``DOCUCHAT_CACHE_MAX_MB``; setting the size to ``0`` disables caching
+    (returns ``None``), as does a cache directory that cannot be created.
+    """
+    global _cache
+    max_mb = cache_budget_mb()
+    if max_mb <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = ExtractionCache(
+                    os.path.join(cache_root(), "extractions"), max_mb * 1024 * 1024
+                )
+            except OSError:
+                return None  # unwritable cache directory: extract without caching
+        return _cache
@@ -0,0 +1,69 @@
+"""Tunable chunking and retrieval parameters.
+
+Defaults match the values the pipeline has always used. Each field can be
+overridden with an environment variable named ``DOCUCHAT_<FIELD>`` (e.g.
+``DOCUCHAT_CHUNK_SIZE=1500``); ``tests/sweep_rag.py`` measures the
+accuracy/latency trade-offs to pick them from data.
+"""
+
+import dataclasses
+import os
+import threading
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class RAGConfig:
+    chunk_size: int = 1000         # characters per chunk
+    chunk_overlap: int = 200       # characters shared by neighbouring chunks
+    top_k: int = 6                 # upper bound on chunks sent to the LLM
+    fetch_k: int = 20              # candidate pool for scoring and MMR re-ranking
+    score_threshold: float = 0.25  # discard chunks below this relevance score
+    lambda_mult: float = 0.7       # MMR relevance/diversity trade-off
+    min_k: int = 2                 # adaptive retrieval: never send fewer chunks (capped at top_k)
+    gap_factor: float = 3.0        # adaptive retrieval: score-drop sensitivity
+    extractive_confidence: float = 0.7  # extractive fast path: sentence similarity needed
+
+    def __post_init__(self):
+        if not 0 <= self.chunk_overlap < self.chunk_size:
+            raise ValueError("chunk_overlap must be >= 0 and smaller than chunk_size")
+        if not 1 <= self.top_k <= self.fetch_k:
+            raise ValueError("expected 1 <= top_k <= fetch_k")
+        if self.min_k < 1:
+            raise ValueError("min_k must be >= 1")  # above top_k, adaptive_k caps it
+        if not 0.0 <= self.lambda_mult <= 1.0:
+            raise ValueError("lambda_mult must be between 0 and 1")
+        if not 0.0 < self.extractive_confidence <= 1.0:
+            raise ValueError("extractive_confidence must be in (0, 1]")
+
+    @classmethod
+    def from_env(cls, environ: dict | None = None) -> "RAGConfig":
+        """Defaults overridden by any ``DOCUCHAT_<FIELD>`` variables that are set."""
+        environ = os.environ if environ is None else environ
+        overrides = {}
+        for f in dataclasses.fields(cls):
+            name = f"DOCUCHAT_{f.name.upper()}"
+            raw = environ.get(name)
+            if raw is not None:
+                kind = type(f.default)
+                try:
+                    overrides[f.name] = kind(raw)
+                except ValueError:
+                    raise ValueError(f"{name}={raw!r} is not a valid {kind.__name__}") from None
+        return cls(**overrides)
+
+    def replace(self, **changes) -> "RAGConfig":
+        return dataclasses.replace(self, **changes)
+
+
+_config: RAGConfig | None = None
+_config_lock = threading.Lock()
+
+
+def get_rag_config() -> RAGConfig:
+    """Return the process-wide configuration, read from the environment once."""
+    global _config
+    with _config_lock:
+        if _config is None:
+            _config = RAGConfig.from_env()
+        return _config
@@ -1,11 +1,36 @@
 """Document text extraction for PDF, DOCX, and TXT files."""
 
+import hashlib
+import io
+import math
 import os
 import re
+import time
+import zipfile
+from collections import Counter
+from typing import IO, Iterator
+from xml.etree.ElementTree import iterparse
 
 import PyPDF2
 import docx
 
+from docuchat.core.cache import ExtractionCache, get_extraction_cache
+from docuchat.core.metrics import EXTRACTION_CACHE, EXTRACTION_SECONDS
+from docuchat.core.profiling import profiled
+
+# Bump whenever extraction or cleaning output changes, to invalidate the cache
+_EXTRACTOR_VERSION = 5
+
+_ERROR_PREFIXES = ("Error reading", "Unsupported file type")
+_PAGE_LABEL = re.compile(r"^\[Page \d+\]$", re.MULTILINE)
+
+_BOILERPLATE_MIN_PAGES = 4   # pages needed before repetition means anything
+_BOILERPLATE_MIN_REPEATS = 3 # and never fewer pages than this per removed line
+_BOILERPLATE_SHARE = 0.5     # a line on at least this share of them is boilerplate
+_EDGE_LINES = 2              # lines at the top/bottom of a page where page numbers live
+_EDGE_MAX_WORDS = 5          # "Page 3 of 40", "ACME Report | 3": page-number lines are short
+_DIGITS = re.compile(r"\d+")
+
 
 def _clean_text(text: str) -> str:
     """Normalize whitespace and strip junk characters from extracted text."""
@@ -26,50 +51,312 @@ def _clean_text(text: str) -> str:
     return text.strip()
 
 
-def extract_text_from_file(file_path: str, filename: str) -> str:
+def _edge_keys(text: str) -> list[tuple[str, str | None] | None]:
+    """
+    ``(exact, numbered)`` comparison keys for the edge lines of a page.
+
+    Only the first and last few non-empty lines, where running headers and
+    footers live, get keys; every other line gets ``None`` and is never
+    removed. ``exact`` ignores case and spacing. ``numbered`` also wildcards
+    digits, so "Page 3 of 40" matches "Page 4 of 40"; it is only set for
+    short lines.
+    """
+    lines = text.splitlines()
+    filled = [i for i, line in enumerate(lines) if line.strip() and not _PAGE_LABEL.match(line)]
+    edges = set(filled[:_EDGE_LINES] + filled[-_EDGE_LINES:])
+    keys: list[tuple[str, str | None] | None] = []
+    for i, line in enumerate(lines):
+        if i not in edges:
+            keys.append(None)
+            continue
+        exact = " ".join(line.lower().split())
+        short = len(exact.split()) <= _EDGE_MAX_WORDS
+        keys.append((exact, _DIGITS.sub("#", exact) if short and _DIGITS.search(exact) else None))
+    return keys
+
+
+def strip_boilerplate(
+    pages: list[str],
+    min_share: float = _BOILERPLATE_SHARE,
+    min_pages: int = _BOILERPLATE_MIN_PAGES,
+) -> list[str]:
+    """
+    Remove running headers, footers and page numbers from one document's pages.
+
+    They appear on nearly every page, inflate the chunk count and index
+    size, and pollute retrieval. Only the first and last lines of each page
+    are candidates. One is dropped when the same line is on at least
+    ``min_share`` of the pages (and on three or more), or when it is a short
+    numbered line ("Page 3 of 40") whose number changes from page to page
+    on that many pages. Numbered headings repeated on a few pages
+    ("Chapter 3", "Section 2") are kept, as are ``[Page N]`` labels.
+    Documents are stripped one at a time, so the result does not depend
+    on which other files are indexed with them.
+
+    Args:
+        pages:     Text of each page of one document.
+        min_share: Fraction of pages a line must appear on.
+        min_pages: With fewer pages nothing is removed.
+
+    Returns:
+        The pages with boilerplate lines removed, in the same order.
+    """
+    if len(pages) < min_pages:
+        return pages
+    keyed = [_edge_keys(text) for text in pages]
+    exact_pages: Counter[str] = Counter()
+    numbered_variants: dict[str, set[str]] = {}
+    for keys in keyed:
+        present = {key for key in keys if key}
+        exact_pages.update({exact for exact, _ in present})
+        for exact, numbered in present:
+            if numbered:
+                numbered_variants.setdefault(numbered, set()).add(exact)
+    threshold = max(_BOILERPLATE_MIN_REPEATS, math.ceil(min_share * len(pages)))
+    repeated = {k for k, n in exact_pages.items() if n >= threshold}
+    # A page number differs on every page; a repeated "Chapter 3" does not
+    repeated |= {k for k, variants in numbered_variants.items() if len(variants) >= threshold}
+    if not repeated:
+        return pages
+    stripped = []
+    for text, keys in zip(pages, keyed):
+        stripped.append("\n".join(
+            line
+            for line, key in zip(text.splitlines(), keys)
+            if key is None or _PAGE_LABEL.match(line)
+            or not (key[0] in repeated or key[1] in repeated)
+        ))
+    return stripped
+
+
+Source = str | bytes | memoryview  # path on disk, or the file's raw bytes
+
+_HASH_CHUNK = 1 << 20  # 1 MiB per write/hash step
+
+
+class _MemoryReader(io.RawIOBase):
+    """Seekable read-only stream over a buffer, without copying it."""
+
+    def __init__(self, view: memoryview):
+        self._view = view.cast("B")
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = min(len(b), len(self._view) - self._pos)
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+def _open_binary(source: Source):
+    """Open a path, or wrap an in-memory buffer, as a binary file object."""
+    if isinstance(source, str):
+        return open(source, "rb")
+    return io.BufferedReader(_MemoryReader(memoryview(source)))
+
+
+def save_and_hash(data: bytes | memoryview, dest_path: str) -> str:
+    """
+    Write ``data`` to ``dest_path`` in chunks, hashing it on the way.
+
+    Args:
+        data:      File contents, e.g. ``UploadedFile.getbuffer()``.
+        dest_path: Where to write the file.
+
+    Returns:
+        The SHA-256 hex digest of the contents.
+    """
+    view = memoryview(data).cast("B")
+    digest = hashlib.sha256()
+    with open(dest_path, "wb") as f:
+        for start in range(0, len(view), _HASH_CHUNK):
+            chunk = view[start:start + _HASH_CHUNK]
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+def page_offsets(text: str) -> list[int]:
+    """Character offsets where each ``[Page N]`` section starts in ``text``."""
+    return [m.start() for m in _PAGE_LABEL.finditer(text)]
+
+
+@profiled("extract")
+def extract_text_from_file(
+    source: Source, filename: str, content_hash: str | None = None
+) -> str:
     """
     Extract plain text from a file based on its extension.
 
     Args:
-        file_path: Absolute path to the saved file on disk.
-        filename:  Original filename (used to determine file type).
+        source:       Path to the saved file on disk, or its raw contents as
+                      ``bytes`` / ``memoryview`` (parsed in memory, no disk I/O).
+        filename:     Original filename (used to determine file type).
+        content_hash: SHA-256 of the file contents. When given, the cleaned
+                      text is served from / stored in the persistent
+                      extraction cache, so repeat uploads skip parsing.
 
     Returns:
         Extracted text string, or an error message on failure.
     """
+    ext = os.path.splitext(filename)[1].lower()
+    cache = get_extraction_cache() if content_hash else None
+    if cache:
+        key = ExtractionCache.make_key(content_hash, ext, _EXTRACTOR_VERSION)
+        entry = cache.get(key)
+        EXTRACTION_CACHE.labels("miss" if entry is None else "hit").inc()
+        if entry is not None:
+            return entry["text"]
+
+    t0 = time.perf_counter()
+    text = _extract(source, ext)
+    EXTRACTION_SECONDS.labels(ext.lstrip(".") or "none").observe(time.perf_counter() - t0)
+    if cache and not text.startswith(_ERROR_PREFIXES):
+        cache.put(key, text, page_offsets(text))
+    return text
+
+
+def _extract(source: Source, ext: str) -> str:
+    """Dispatch on file extension; failures are returned as messages."""
     try:
-        ext = os.path.splitext(filename)[1].lower()
         if ext == ".pdf":
-            return _extract_pdf(file_path)
+            return _extract_pdf(source)
         elif ext == ".txt":
-            with open(file_path, "r", encoding="utf-8", errors="replace") as f:
-                return _clean_text(f.read())
+            if isinstance(source, str):
+                with open(source, "r", encoding="utf-8", errors="replace") as f:
+                    text = f.read()
+            else:
+                text = str(source, "utf-8", "replace")
+            # Text exported from PDFs (e.g. pdftotext) separates pages with form feeds
+            return _clean_text("\n".join(strip_boilerplate(text.split("\f"))))
         elif ext == ".docx":
-            return _extract_docx(file_path)
+            return _extract_docx(source)
         return f"Unsupported file type: '{ext}'"
     except Exception as e:
         return f"Error reading file: {e}"
 
 
-def _extract_pdf(file_path: str) -> str:
-    """Extract text from a PDF file page by page, labelling each page."""
+def _extract_pdf(source: Source, boilerplate: bool = True) -> str:
+    """
+    Extract text from a PDF file page by page, labelling each page.
+
+    Running headers, footers and page numbers repeated across pages are
+    removed (see :func:`strip_boilerplate`) unless ``boilerplate`` is false,
+    which ``tests/benchmark.py`` uses as the baseline.
+    """
     try:
-        with open(file_path, "rb") as f:
+        with _open_binary(source) as f:
             reader = PyPDF2.PdfReader(f)
-            pages = []
-            for i, page in enumerate(reader.pages):
-                text = page.extract_text() or ""
-                if text.strip():
-                    pages.append(f"[Page {i + 1}]\n{text}")
+            texts = [page.extract_text() or "" for page in reader.pages]
+            if boilerplate:
+                texts = strip_boilerplate(texts)
+            pages = [
+                f"[Page {i + 1}]\n{text}" for i, text in enumerate(texts) if text.strip()
+            ]
             return _clean_text("\n\n".join(pages))
     except Exception as e:
         return f"Error reading PDF: {e}"
 
 
-def _extract_docx(file_path: str) -> str:
-    """Extract text from a DOCX file — paragraphs and tables."""
+def _extract_docx(source: Source) -> str:
+    """
+    Extract text from a DOCX file — paragraphs and table rows in body order.
+
+    Streams ``word/document.xml`` with ``iterparse`` and discards each block
+    once emitted, so memory stays bounded on very large documents and tables
+    stay next to the text that refers to them.
+    """
+    try:
+        with _open_binary(source) as f, zipfile.ZipFile(f) as zf:
+            with zf.open("word/document.xml") as xml:
+                return _clean_text("\n".join(_iter_docx_blocks(xml)))
+    except Exception as e:
+        return f"Error reading DOCX: {e}"
+
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+
+
+def _iter_docx_blocks(xml: IO[bytes]) -> Iterator[str]:
+    """Yield body paragraphs and ``cell | cell`` table rows in document order."""
+    paragraphs: list[list[str]] = []  # stack: text boxes nest paragraphs
+    cells: list[str] = []             # finished cells of the current top-level row
+    cell_parts: list[str] = []        # paragraph texts of the current cell
+    table_depth = 0
+    fallback_depth = 0                # mc:Fallback repeats mc:Choice content
+    body = None
+
+    for event, elem in iterparse(xml, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == _W + "p":
+                paragraphs.append([])
+            elif tag == _W + "tbl" and not fallback_depth:  # its end is skipped in a fallback too
+                table_depth += 1
+            elif tag == _W + "body":
+                body = elem
+            elif tag == _MC_FALLBACK:
+                fallback_depth += 1
+            continue
+
+        if tag == _MC_FALLBACK:
+            fallback_depth -= 1
+        elif fallback_depth:
+            if tag == _W + "p":
+                paragraphs.pop()
+        elif tag == _W + "t":
+            if paragraphs:
+                paragraphs[-1].append(elem.text or "")
+        elif tag == _W + "tab":
+            if paragraphs:
+                paragraphs[-1].append("\t")
+        elif tag in (_W + "br", _W + "cr"):
+            if paragraphs:
+                paragraphs[-1].append("\n")
+        elif tag == _W + "p":
+            text = "".join(paragraphs.pop())
+            if table_depth:
+                cell_parts.append(text)
+            elif text.strip():
+                yield text
+        elif tag == _W + "tc" and table_depth == 1:
+            # Merged-cell continuations are empty and drop out here
+            cell_text = " ".join(t.strip() for t in cell_parts if t.strip())
+            if cell_text:
+                cells.append(cell_text)
+            cell_parts = []
+        elif tag == _W + "tr" and table_depth == 1:
+            if cells:
+                yield " | ".join(cells)
+            cells = []
+        elif tag == _W + "tbl":
+            table_depth -= 1
+
+        # Drop finished top-level blocks so the tree never grows
+        if body is not None and not table_depth and not paragraphs and tag in (_W + "p", _W + "tbl"):
+            body.clear()
+
+
+def _extract_docx_dom(source: Source) -> str:
+    """Reference DOCX extractor using the full python-docx DOM (benchmarks only)."""
     try:
-        doc = docx.Document(file_path)
+        with _open_binary(source) as f:
+            doc = docx.Document(f)
         parts = []
         for p in doc.paragraphs:
             if p.text.strip():
@@ -0,0 +1,387 @@
+"""Shared embedding server: one model for every app replica on a host.
+
+Each Streamlit process behind a load balancer would otherwise load its own
+copy of the embedding model, which multiplies memory use and warm-up time.
+``docuchat embed-server`` loads the model once. It serves it over a Unix
+socket or a localhost port. Setting ``DOCUCHAT_EMBED_SERVER`` in the
+replicas makes :func:`~docuchat.core.embeddings.create_embeddings` return a
+:class:`RemoteEmbeddings` client instead of a local model. Everything that
+embeds text then goes through the server transparently, including index
+builds and query embedding.
+
+Requests from all replicas are micro-batched (:class:`MicroBatcher`). The
+first text to arrive waits at most ``max_delay`` for others to join its
+model call, so concurrent single-query requests share one forward pass.
+
+Protocol (HTTP/1.1, keep-alive)::
+
+    POST /embed   {"texts": [...]}  ->  float32 vectors, row-major
+                                        (``X-Embedding-Dim`` header)
+    GET  /info                      ->  {"model": ..., "dim": ...}
+    GET  /healthz, /metrics
+"""
+
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from docuchat.core.embeddings import embedding_model_id
+from docuchat.core.metrics import EMBED_SERVER_BATCH_TEXTS, REGISTRY
+
+_MAX_DELAY_MS = 5.0        # default wait for more texts to join a model call
+_MAX_BATCH = 256           # texts per model call (one request may exceed it)
+_REQUEST_TEXTS = 512       # client: texts per request, so queries interleave with bulk builds
+_REQUEST_TIMEOUT = 120.0   # client: seconds to wait for one response
+_CONNECT_TIMEOUT = 60.0    # client: seconds to keep retrying while the server starts
+
+
+def parse_address(address: str) -> tuple[str, str | tuple[str, int]]:
+    """
+    ``("unix", path)`` or ``("tcp", (host, port))`` for a server address.
+
+    Accepted forms: ``unix:/run/docuchat/embed.sock``, ``/run/embed.sock``,
+    ``127.0.0.1:8765``, ``localhost:8765`` and ``http://127.0.0.1:8765``.
+
+    Raises:
+        ValueError: If the address is neither a socket path nor ``host:port``.
+    """
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    if address.startswith("/"):
+        return "unix", address
+    hostport = address.removeprefix("http://").rstrip("/")
+    host, sep, port = hostport.rpartition(":")
+    if not sep or not host or not port.isdigit():
+        raise ValueError(
+            f"embedding server address {address!r} must be a socket path or host:port"
+        )
+    return "tcp", (host, int(port))
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent embedding requests into shared model calls.
+
+    A single thread owns the model. It takes the oldest pending request,
+    then keeps collecting requests until ``max_delay`` has passed since
+    that first arrival or ``max_batch`` texts are gathered. It embeds all
+    of them in one call and hands every caller its own rows. Requests that
+    are already queued always join without waiting, so ``max_delay=0``
+    still batches under load.
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[list[str]], list[list[float]]],
+        max_delay: float = _MAX_DELAY_MS / 1000,
+        max_batch: int = _MAX_BATCH,
+    ):
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._embed = embed
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="docuchat-embed-batcher", daemon=True)
+        self._thread.start()
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Vectors for ``texts`` (blocks until their batch has run)."""
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+        future: Future = Future()
+        self._queue.put((texts, future))
+        return future.result()
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first: tuple) -> list[tuple]:
+        batch, count = [first], len(first[0])
+        deadline = time.monotonic() + self.max_delay
+        while count < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # stop after this batch
+                break
+            batch.append(item)
+            count += len(item[0])
+        return batch
+
+    def _run(self) -> None:
+        while (first := self._queue.get()) is not None:
+            batch = self._collect(first)
+            texts = [t for item, _ in batch for t in item]
+            EMBED_SERVER_BATCH_TEXTS.observe(len(texts))
+            try:
+                vectors = np.asarray(self._embed(texts), dtype="float32")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for item, future in batch:
+                future.set_result(vectors[start:start + len(item)])
+                start += len(item)
+
+
+class _EmbedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive: replicas reuse one connection per thread
+    server: "_Server"
+
+    def do_GET(self):
+        if self.path == "/info":
+            info = {"model": self.server.model_id, "dim": self.server.dim}
+            self._reply(200, json.dumps(info).encode(), "application/json")
+        elif self.path == "/healthz":
+            self._reply(200, b"ok\n")
+        elif self.path == "/metrics":
+            self._reply(200, REGISTRY.render().encode(), "text/plain; version=0.0.4; charset=utf-8")
+        else:
+            self._reply(404, b"not found\n")
+
+    def do_POST(self):
+        if self.path != "/embed":
+            self._reply(404, b"not found\n")
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            texts = json.loads(body)["texts"]
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                raise ValueError("texts must be a list of strings")
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, f"bad request: {e}\n".encode())
+            return
+        try:
+            vectors = self.server.batcher.embed(texts)
+        except Exception as e:
+            self._reply(500, f"{type(e).__name__}: {e}\n".encode())
+            return
+        self._reply(
+            200, vectors.astype("<f4").tobytes(), "application/octet-stream",
+            {"X-Embedding-Dim": str(vectors.shape[1] if len(vectors) else self.server.dim)},
+        )
+
+    def _reply(self, status: int, body: bytes, content_type: str = "text/plain; charset=utf-8",
+               headers: dict | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, *args):
+        pass  # one line per query from every replica would flood the log
+
+
+class _Server:
+    request_queue_size = 128  # every replica thread may connect at once
+    batcher: MicroBatcher
+    model_id: str
+    dim: int
+
+
+class _TCPServer(_Server, ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(_Server, socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class EmbeddingServer:
+    """
+    Serves one embedding model to every replica on the host.
+
+    The model is warmed up before the server starts listening, so a
+    replica's first request never pays for loading it.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        embeddings: Embeddings,
+        max_delay: float = _MAX_DELAY_MS / 1000,
+        max_batch: int = _MAX_BATCH,
+    ):
+        """
+        Args:
+            address:    Where to listen (see :func:`parse_address`); a TCP
+                        port of 0 picks a free one.
+            embeddings: The model, e.g. ``create_embeddings(remote=False)``.
+            max_delay:  Seconds a text may wait for others to join its batch.
+            max_batch:  Texts per model call.
+        """
+        self.embeddings = embeddings
+        self.batcher = MicroBatcher(embeddings.embed_documents, max_delay, max_batch)
+        dim = len(embeddings.embed_query("warm-up"))
+        kind, where = parse_address(address)
+        if kind == "unix":
+            if os.path.exists(where):
+                os.unlink(where)  # stale socket of a previous run
+            self._server: _Server = _UnixServer(where, _EmbedHandler)
+            self.address = f"unix:{where}"
+        else:
+            self._server = _TCPServer(where, _EmbedHandler)
+            self.address = f"{where[0]}:{self._server.server_address[1]}"
+        self._server.batcher = self.batcher
+        self._server.model_id = embedding_model_id()
+        self._server.dim = dim
+        self._thread: threading.Thread | None = None
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def start(self) -> "EmbeddingServer":
+        """Serve from a daemon thread (used by tests and benchmarks)."""
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="docuchat-embed-server", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def shutdown(self) -> None:
+        if self._thread is not None:
+            self._server.shutdown()
+        self._server.server_close()
+        self.batcher.close()
+        kind, where = parse_address(self.address)
+        if kind == "unix" and os.path.exists(where):
+            os.unlink(where)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+class RemoteEmbeddings(Embeddings):
+    """
+    LangChain ``Embeddings`` served by an :class:`EmbeddingServer`.
+
+    Each thread keeps one keep-alive connection. Large inputs are sent in
+    requests of ``_REQUEST_TEXTS`` texts, so other replicas' queries are
+    batched in between them rather than queued behind a whole index build.
+    While the server is starting, connections are retried for up to
+    ``connect_timeout`` seconds.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        timeout: float = _REQUEST_TIMEOUT,
+        connect_timeout: float = _CONNECT_TIMEOUT,
+    ):
+        self.address = address
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._kind, self._where = parse_address(address)
+        self._local = threading.local()
+        self._checked = False
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self._kind == "unix":
+                conn = _UnixHTTPConnection(self._where, self.timeout)
+            else:
+                conn = http.client.HTTPConnection(*self._where, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _drop_connection(self) -> None:
+        """Close this thread's connection so the next request opens a fresh one."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _request(self, method: str, path: str, body: bytes | None = None) -> tuple[bytes, dict]:
+        deadline = time.monotonic() + self.connect_timeout
+        retried = False
+        while True:
+            conn = self._connection()
+            try:
+                headers = {"Content-Type": "application/json"} if body is not None else {}
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (ConnectionRefusedError, FileNotFoundError, BlockingIOError):  # starting or busy
+                self._drop_connection()
+                if time.monotonic() >= deadline:
+                    raise ConnectionError(f"embedding server at {self.address} is not reachable") from None
+                time.sleep(0.2)
+                continue
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self._drop_connection()  # idle keep-alive connection was dropped: reconnect once
+                if retried:
+                    raise
+                retried = True
+                continue
+            except (socket.timeout, http.client.HTTPException, OSError):
+                # A timed-out or half-read exchange leaves http.client mid-request;
+                # reusing it would fail every later call with CannotSendRequest
+                self._drop_connection()
+                raise
+            if response.status != 200:
+                raise RuntimeError(
+                    f"embedding server error {response.status}: {data.decode(errors='replace').strip()}"
+                )
+            return data, dict(response.getheaders())
+
+    def _check_model(self) -> None:
+        """Refuse a server whose vectors are not in this instance's space."""
+        if self._checked:
+            return
+        info = json.loads(self._request("GET", "/info")[0])
+        if info["model"] != embedding_model_id():
+            raise ValueError(
+                f"Embedding server at {self.address} serves '{info['model']}', "
+                f"but this instance uses '{embedding_model_id()}'"
+            )
+        self._checked = True
+
+    def _embed(self, texts: list[str]) -> list[list[float]]:
+        self._check_model()
+        vectors: list[list[float]] = []
+        for start in range(0, len(texts), _REQUEST_TEXTS):
+            part = texts[start:start + _REQUEST_TEXTS]
+            data, headers = self._request("POST", "/embed", json.dumps({"texts": part}).encode())
+            dim = int(headers.get("X-Embedding-Dim", 0))
+            vectors.extend(np.frombuffer(data, dtype="<f4").reshape(len(part), dim).tolist())
+        return vectors
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return self._embed(list(texts))
+
+    def embed_query(self, text: str) -> list[float]:
+        # All DocuChat backends embed queries exactly like documents, so
+        # queries join the same batches
+        return self._embed([text])[0]
@@ -0,0 +1,331 @@
+"""Embedding backends, including a multi-process worker pool for bulk ingestion."""
+
+import functools
+import glob
+import hashlib
+import multiprocessing
+import os
+import platform
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_BACKENDS = ("minilm", "onnx", "onnx-int8", "hash")  # values of DOCUCHAT_EMBEDDINGS
+
+_MAX_SEQ_TOKENS = 256      # MiniLM truncates longer inputs
+_MAX_BATCH_TOKENS = 8192   # padded tokens per batch (size × longest item)
+_MAX_BATCH_SIZE = 128
+_HASH_DIM = 384            # same width as MiniLM, so index sizes compare
+_HASH_VERSION = 1          # bump when the hashing scheme changes
+_WORD = re.compile(r"\w+")
+_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "docuchat")
+
+
+def embedding_backend() -> str:
+    """Configured backend from ``DOCUCHAT_EMBEDDINGS`` (default ``minilm``)."""
+    backend = os.environ.get("DOCUCHAT_EMBEDDINGS", "minilm")
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"DOCUCHAT_EMBEDDINGS must be one of {', '.join(EMBEDDING_BACKENDS)}")
+    return backend
+
+
+def embedding_model_id() -> str:
+    """Identity of the configured embedding model, recorded in snapshots."""
+    if embedding_backend() == "hash":
+        return f"docuchat/hashing-v{_HASH_VERSION}-{_HASH_DIM}:normalized"
+    # The ONNX backends run the same MiniLM weights and produce vectors in
+    # the same space (see ``benchmark.py onnx``). Indexes built with PyTorch
+    # can therefore be served with ONNX Runtime.
+    return f"sentence-transformers/{EMBEDDING_MODEL}:normalized"
+
+
+def make_hf_embeddings() -> HuggingFaceEmbeddings:
+    """Local sentence-transformers model on CPU, with normalized vectors."""
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL,
+        model_kwargs={"device": "cpu"},
+        encode_kwargs={"normalize_embeddings": True},
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def _quantization_target() -> str:
+    """ONNX Runtime dynamic-quantization preset matching this CPU."""
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return "avx2"
+    if "avx512_vnni" in flags:
+        return "avx512_vnni"
+    return "avx512" if "avx512f" in flags else "avx2"
+
+
+def export_onnx_model(directory: str | None = None, quantize: bool = False) -> tuple[str, str]:
+    """
+    Export MiniLM to ONNX once, optionally with int8 dynamic quantization.
+
+    Needs the ``onnx`` extra (``pip install docuchat[onnx]``: Optimum and
+    ONNX Runtime). Later calls reuse the exported files.
+
+    Args:
+        directory: Where the model is saved (default:
+                   ``$DOCUCHAT_CACHE_DIR/onnx/all-MiniLM-L6-v2``).
+        quantize:  Also write an int8 model for this CPU's instruction set
+                   (AVX2, AVX-512, AVX-512 VNNI or ARM64).
+
+    Returns:
+        ``(model_dir, file_name)`` to load with sentence-transformers'
+        ONNX backend.
+
+    Raises:
+        ImportError: If Optimum / ONNX Runtime are not installed.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    root = os.environ.get("DOCUCHAT_CACHE_DIR", _CACHE_DIR)
+    directory = directory or os.path.join(root, "onnx", EMBEDDING_MODEL)
+    if not os.path.exists(os.path.join(directory, "onnx", "model.onnx")):
+        model = SentenceTransformer(EMBEDDING_MODEL, device="cpu", backend="onnx")
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=parent)
+        model.save_pretrained(staging)
+        try:
+            os.rename(staging, directory)  # atomic: concurrent exporters keep the first
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+    if not quantize:
+        return directory, "onnx/model.onnx"
+
+    target = _quantization_target()
+    pattern = os.path.join(directory, "onnx", f"model_*_{target}.onnx")
+    if not glob.glob(pattern):
+        from sentence_transformers.backend import export_dynamic_quantized_onnx_model
+
+        model = SentenceTransformer(directory, device="cpu", backend="onnx")
+        export_dynamic_quantized_onnx_model(model, target, directory)
+    return directory, os.path.relpath(sorted(glob.glob(pattern))[0], directory)
+
+
+def make_onnx_embeddings(quantize: bool = False) -> HuggingFaceEmbeddings:
+    """MiniLM on ONNX Runtime (CPU), with the same normalized 384-d output."""
+    model_dir, file_name = export_onnx_model(quantize=quantize)
+    return HuggingFaceEmbeddings(
+        model_name=model_dir,
+        model_kwargs={"device": "cpu", "backend": "onnx", "model_kwargs": {"file_name": file_name}},
+        encode_kwargs={"normalize_embeddings": True},
+    )
+
+
+@functools.lru_cache(maxsize=1 << 20)
+def _hash_bucket(word: str, dim: int) -> tuple[int, float]:
+    """Stable (bucket, ±1 sign) for a word, identical in every process."""
+    h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+    return h % dim, 1.0 if h >> 63 else -1.0
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic, model-free embeddings by feature hashing.
+
+    Every lower-cased word is hashed to one of ``dim`` buckets with a random
+    sign. The signed word counts are L2-normalized. This is a sparse random
+    projection of the bag of words: texts that share words score as
+    similar, so retrieval still behaves lexically. It needs no download, no
+    model load and no GPU, and embeds over ten thousand chunks per second on
+    one core.
+    Use it for tests and for benchmarking the pipeline without model cost,
+    not for answer quality.
+    """
+
+    def __init__(self, dim: int = _HASH_DIM):
+        self.dim = dim
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        rows, buckets, signs = [], [], []
+        for row, text in enumerate(texts):
+            for word in _WORD.findall(text.lower()):
+                bucket, sign = _hash_bucket(word, self.dim)
+                rows.append(row)
+                buckets.append(bucket)
+                signs.append(sign)
+        flat = np.asarray(rows, dtype=np.int64) * self.dim + np.asarray(buckets, dtype=np.int64)
+        vectors = np.bincount(flat, weights=signs, minlength=len(texts) * self.dim)
+        vectors = vectors.reshape(len(texts), self.dim).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, 1e-12)  # empty texts stay all-zero
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+def make_embeddings() -> Embeddings:
+    """In-process model for the configured backend (see :func:`embedding_backend`)."""
+    backend = embedding_backend()
+    if backend == "hash":
+        return HashingEmbeddings()
+    if backend.startswith("onnx"):
+        return make_onnx_embeddings(quantize=backend == "onnx-int8")
+    return make_hf_embeddings()
+
+
+def _token_length(text: str) -> int:
+    """Approximate word-piece count (~4 characters per token), capped."""
+    return min(len(text) // 4 + 1, _MAX_SEQ_TOKENS)
+
+
+def plan_batches(
+    texts: list[str],
+    max_tokens: int = _MAX_BATCH_TOKENS,
+    max_size: int = _MAX_BATCH_SIZE,
+) -> list[list[int]]:
+    """
+    Group text indices into batches of similar length.
+
+    Sorting by length before batching keeps padding waste low, and each
+    batch is capped at ``max_tokens`` padded tokens so short texts travel in
+    large batches and long ones in small batches.
+
+    Returns:
+        Lists of indices into ``texts``; every index appears exactly once.
+    """
+    lengths = [_token_length(t) for t in texts]
+    batches: list[list[int]] = []
+    current: list[int] = []
+    longest = 0
+    for i in sorted(range(len(texts)), key=lengths.__getitem__):
+        padded = max(longest, lengths[i]) * (len(current) + 1)
+        if current and (padded > max_tokens or len(current) >= max_size):
+            batches.append(current)
+            current, longest = [], 0
+        current.append(i)
+        longest = max(longest, lengths[i])
+    if current:
+        batches.append(current)
+    return batches
+
+
+# ---------------------------------------------------------------------------
+# Worker-side state: one model per pool process, loaded by the initializer
+# ---------------------------------------------------------------------------
+_worker_model: Embeddings | None = None
+_worker_barrier = None  # multiprocessing.Barrier shared by the pool's workers
+
+
+def _init_worker(factory: Callable[[], Embeddings], threads: int, barrier=None) -> None:
+    global _worker_model, _worker_barrier
+    _worker_barrier = barrier
+    try:
+        import torch
+
+        torch.set_num_threads(threads)  # split cores between workers, don't oversubscribe
+    except ImportError:
+        pass
+    _worker_model = factory()
+
+
+def _embed_batch(texts: list[str]) -> list[list[float]]:
+    return _worker_model.embed_documents(texts)
+
+
+def _embed_query(text: str) -> list[float]:
+    return _worker_model.embed_query(text)
+
+
+def _meet_siblings(timeout: float) -> int:
+    """Block until every worker runs this too, so each one has loaded its model."""
+    _worker_barrier.wait(timeout)
+    return os.getpid()
+
+
+class EmbeddingPool(Embeddings):
+    """
+    LangChain ``Embeddings`` backed by a pool of worker processes.
+
+    Each worker loads its own copy of the model. ``embed_documents`` splits
+    the input into length-sorted batches, queues them across the pool, and
+    reassembles the vectors in input order. Concurrent callers share the
+    same queue, so several sessions ingesting at once use every worker.
+    """
+
+    def __init__(self, workers: int, factory: Callable[[], Embeddings] = make_embeddings):
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        context = multiprocessing.get_context("spawn")
+        self.workers = workers
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(factory, threads, context.Barrier(workers)),
+        )
+
+    def warm_up(self, timeout: float = 600.0) -> None:
+        """
+        Start every worker and wait until each has loaded its model (the
+        pool otherwise spawns workers only as batches queue up).
+
+        Raises:
+            threading.BrokenBarrierError: If not all workers started within ``timeout``.
+        """
+        futures = [self._executor.submit(_meet_siblings, timeout) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        batches = plan_batches(texts)
+        futures = [
+            (batch, self._executor.submit(_embed_batch, [texts[i] for i in batch]))
+            for batch in batches
+        ]
+        vectors: list[list[float]] = [None] * len(texts)  # type: ignore[list-item]
+        for batch, future in futures:
+            for i, vector in zip(batch, future.result()):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._executor.submit(_embed_query, text).result()
+
+    def close(self) -> None:
+        self._executor.shutdown(cancel_futures=True)
+
+
+def create_embeddings(remote: bool = True) -> Embeddings:
+    """
+    Build the configured embedding backend.
+
+    ``DOCUCHAT_EMBEDDINGS`` picks the model: ``minilm`` (PyTorch, default),
+    ``onnx`` / ``onnx-int8`` (ONNX Runtime, optional extra) or the offline
+    ``hash`` embedder. ``DOCUCHAT_EMBED_WORKERS`` > 0 starts an
+    :class:`EmbeddingPool` with that many processes; the default (0) embeds
+    in-process.
+
+    If ``DOCUCHAT_EMBED_SERVER`` is set (and ``remote`` is true), no model is
+    loaded: a :class:`~docuchat.core.embed_server.RemoteEmbeddings` client
+    for the shared ``docuchat embed-server`` at that address is returned.
+    """
+    address = os.environ.get("DOCUCHAT_EMBED_SERVER")
+    if remote and address:
+        from docuchat.core.embed_server import RemoteEmbeddings  # imports this module
+
+        return RemoteEmbeddings(address)
+    workers = int(os.environ.get("DOCUCHAT_EMBED_WORKERS", "0"))
+    if workers > 0:
+        backend = embedding_backend()
+        if backend.startswith("onnx"):
+            export_onnx_model(quantize=backend == "onnx-int8")  # once, before workers race
+        return EmbeddingPool(workers)
+    return make_embeddings()
@@ -0,0 +1,188 @@
+"""Extractive fast path: answer factual lookups from a retrieved sentence, without the LLM.
+
+For questions like "How many sick days do employees receive?" the top
+retrieved chunk usually holds the answer in a single sentence. Waiting for a
+70B model to restate it costs seconds. :func:`extract_answer` splits the
+leading retrieved chunks into sentences and embeds them with the store's own
+model. It then scores each sentence by cosine similarity to the query
+embedding that retrieval already computed. When the best sentence clears a
+confidence threshold and clearly beats the runner-up, it is returned with
+its source citation. Otherwise the caller falls back to the LLM.
+
+Questions that need reasoning or synthesis ("why", "explain", "compare") and
+follow-ups that refer back to the conversation never take the fast path.
+"""
+
+import re
+from dataclasses import dataclass
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from docuchat.core.retrieval import Retrieval
+
+_MIN_MARGIN = 0.03      # lead the best sentence needs over the runner-up
+_CANDIDATE_CHUNKS = 3   # leading retrieved chunks searched for the answer
+_MIN_WORDS = 4          # shorter "sentences" are headings and labels
+_MAX_WORDS = 60         # longer ones are unsplit tables or lists
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
+_PAGE_LABEL = re.compile(r"^\[Page \d+\]$")
+_BULLET = re.compile(r"^\s*(?:[-*•▪]|\d{1,2}[.)])\s+")
+_TABLE_ROW = re.compile(r"\S(?: {2,}| : |\t)\S")
+_HEADING = re.compile(r"^(?:\d+(?:\.\d+)*|[A-Z]\.|SECTION \d+:?)\s+\S")
+_WORD = re.compile(r"[a-z0-9]+(?:[.'%-][a-z0-9]+)*")
+_NOT_A_LOOKUP = re.compile(
+    r"\b(why|explain|describe|discuss|elaborate|summari[sz]e|summary|overview|"
+    r"compare|comparison|differences?|pros|cons|advantages|disadvantages|"
+    r"recommend|should|opinion|steps|process|list all|"
+    r"how (?:do|does|did|can|could|should|would|is|are))\b",
+    re.IGNORECASE,
+)
+_REFERS_BACK = re.compile(
+    r"\b(it|its|they|them|their|that|those|these|this|he|she|his|her|"
+    r"above|previous|same|also|else)\b",
+    re.IGNORECASE,
+)
+_STOPWORDS = frozenset(
+    "a an the is are was were be been of in on at to for by with from and or "
+    "what which who whom when where how many much long does do did can".split()
+)
+
+
+@dataclass
+class ExtractiveAnswer:
+    sentence: str
+    source: str
+    confidence: float  # cosine similarity of sentence and question
+    margin: float      # lead over the next-best distinct sentence
+
+    def render(self) -> str:
+        return f"{self.sentence}\n\n[Source: {self.source}] · _quoted from the document_"
+
+
+def is_lookup_question(question: str, follow_up: bool = False) -> bool:
+    """
+    True for factual lookups a single sentence can answer.
+
+    Args:
+        question:  The user's question.
+        follow_up: Whether there is earlier conversation; then questions
+                   that refer back to it ("what about them?") need the LLM.
+    """
+    if _NOT_A_LOOKUP.search(question):
+        return False
+    return not (follow_up and _REFERS_BACK.search(question))
+
+
+def _standalone(line: str) -> bool:
+    """Headings, list items and table rows: lines never joined to their neighbours."""
+    return bool(
+        _BULLET.match(line) or _TABLE_ROW.search(line) or _HEADING.match(line)
+        or line.isupper()
+    )
+
+
+def split_sentences(text: str) -> list[str]:
+    """
+    Sentences of a chunk, with hard-wrapped lines of prose joined back together.
+
+    List items and ``key : value`` table rows each count as one sentence;
+    headings, ``[Page N]`` labels and separator lines are dropped.
+    """
+    units: list[str] = []
+    joinable = False  # whether the last unit is prose still open for continuation
+    for raw in text.splitlines():
+        line = raw.strip()
+        if (
+            not line or _PAGE_LABEL.match(line) or _HEADING.match(line) or line.isupper()
+            or not any(c.isalnum() for c in line)
+        ):
+            joinable = False
+            continue
+        if joinable and not _standalone(line):
+            units[-1] = f"{units[-1]} {line}"
+        else:
+            units.append(_BULLET.sub("", line))
+        joinable = not _standalone(line) and not line.endswith((".", "!", "?", ":"))
+    return [s.strip() for unit in units for s in _SENTENCE_END.split(unit) if s.strip()]
+
+
+def _cut_off(sentence: str) -> bool:
+    """True for the partial sentences a chunk boundary leaves at either end."""
+    return sentence[0].islower() or sentence.endswith((",", ";", "-", "—"))
+
+
+def _adds_information(sentence: str, question_words: set[str]) -> bool:
+    """False for sentences whose content words all come from the question."""
+    return bool(set(_WORD.findall(sentence.lower())) - question_words - _STOPWORDS)
+
+
+def best_sentence(
+    question: str, retrieval: Retrieval, embeddings: Embeddings
+) -> ExtractiveAnswer | None:
+    """
+    The retrieved sentence most similar to the question, whatever its score.
+
+    Sentences repeated by overlapping chunks are scored once; fragments
+    (including those cut off at chunk boundaries), run-on blocks and
+    sentences that only restate the question are skipped.
+
+    Returns:
+        The best candidate, or ``None`` if the chunks hold no usable sentence.
+    """
+    question_words = set(_WORD.findall(question.lower()))
+    seen, candidates = set(), []
+    for doc in retrieval.docs[:_CANDIDATE_CHUNKS]:
+        source = doc.metadata.get("source", "Unknown")
+        for sentence in split_sentences(doc.page_content):
+            key = " ".join(_WORD.findall(sentence.lower()))
+            words = len(key.split())
+            if key in seen or not _MIN_WORDS <= words <= _MAX_WORDS or _cut_off(sentence):
+                continue
+            seen.add(key)
+            if _adds_information(sentence, question_words):
+                candidates.append((sentence, source))
+    if not candidates:
+        return None
+
+    query = retrieval.query
+    if query is None:
+        query = np.asarray(embeddings.embed_query(question), dtype="float32")
+    vectors = np.asarray(embeddings.embed_documents([s for s, _ in candidates]), dtype="float32")
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    scores = vectors @ (query / max(float(np.linalg.norm(query)), 1e-12))
+
+    order = np.argsort(-scores)
+    best = int(order[0])
+    margin = float(scores[best] - scores[order[1]]) if len(order) > 1 else float(scores[best])
+    sentence, source = candidates[best]
+    return ExtractiveAnswer(sentence, source, float(scores[best]), margin)
+
+
+def extract_answer(
+    question: str,
+    retrieval: Retrieval,
+    embeddings: Embeddings,
+    min_confidence: float,
+    follow_up: bool = False,
+) -> ExtractiveAnswer | None:
+    """
+    Answer ``question`` with one retrieved sentence if that is safe.
+
+    Args:
+        question:       The user's question.
+        retrieval:      Chunks retrieved for it; ``retrieval.query`` is reused.
+        embeddings:     The model the store was built with.
+        min_confidence: Cosine similarity the best sentence needs.
+        follow_up:      Whether the question continues a conversation.
+
+    Returns:
+        The answer, or ``None`` when the LLM should answer instead.
+    """
+    if not is_lookup_question(question, follow_up):
+        return None
+    answer = best_sentence(question, retrieval, embeddings)
+    if answer is None or answer.confidence < min_confidence or answer.margin < _MIN_MARGIN:
+        return None
+    return answer
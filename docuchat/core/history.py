@@ -0,0 +1,155 @@
+"""Conversation history compaction: a recent-turn window plus a rolling summary."""
+
+import threading
+from typing import Callable
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_groq import ChatGroq
+
+from docuchat.core.scheduler import get_scheduler
+
+_HISTORY_TOKEN_BUDGET = 1500  # raw recent turns sent with every question
+_TURN_TOKEN_CAP = 400         # longer turns are truncated inside the window
+_SUMMARY_MAX_TOKENS = 300     # ceiling on the rolling summary length
+_MAX_STORED_MESSAGES = 1000   # summarized messages beyond this are dropped
+_SUMMARY_MODEL = "llama-3.1-8b-instant"  # summaries don't need the 70B model
+
+_SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and a "
+    "document assistant. Merge the new turns into the existing summary. Keep "
+    "facts, figures, document names and open questions; drop pleasantries. "
+    f"Reply with the updated summary only, at most {_SUMMARY_MAX_TOKENS * 3 // 4} words."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """``text`` cut to about ``max_tokens`` tokens (see :func:`estimate_tokens`)."""
+    max_chars = max_tokens * 4
+    return text if len(text) <= max_chars else text[:max_chars] + " …"
+
+
+def select_recent_turns(
+    history: list[dict], budget: int = _HISTORY_TOKEN_BUDGET
+) -> tuple[int, list[dict]]:
+    """
+    Pick the most recent turns that fit in a token budget.
+
+    Args:
+        history: Conversation as ``{"role": ..., "content": ...}`` dicts.
+        budget:  Maximum estimated tokens for the returned turns.
+
+    Returns:
+        ``(start, turns)`` — index of the first turn kept, and the kept turns
+        (oldest first) with over-long contents truncated.
+    """
+    turns: list[dict] = []
+    used = 0
+    start = len(history)
+    for i in range(len(history) - 1, -1, -1):
+        content = truncate_to_tokens(history[i]["content"], _TURN_TOKEN_CAP)
+        cost = estimate_tokens(content)
+        if used + cost > budget:
+            break
+        used += cost
+        start = i
+        turns.append({"role": history[i]["role"], "content": content})
+    turns.reverse()
+    return start, turns
+
+
+def summarize_turns(previous_summary: str, turns: list[dict], api_key: str) -> str:
+    """Fold ``turns`` into ``previous_summary`` with a small, fast LLM call."""
+    transcript = "\n".join(
+        f"{t['role'].upper()}: {truncate_to_tokens(t['content'], _TURN_TOKEN_CAP)}" for t in turns
+    )
+    llm = ChatGroq(
+        api_key=api_key,
+        model_name=_SUMMARY_MODEL,
+        max_tokens=_SUMMARY_MAX_TOKENS,
+        temperature=0.0,
+        max_retries=0,
+    )
+    messages = [
+        SystemMessage(content=_SUMMARY_PROMPT),
+        HumanMessage(
+            content=f"Existing summary:\n{previous_summary or '(none)'}\n\n"
+            f"New turns:\n{transcript}"
+        ),
+    ]
+    # Summaries queue as their own session and share the key's rate budget fairly
+    reply = get_scheduler(api_key).call(lambda: llm.invoke(messages), session_id="__summary__")
+    return truncate_to_tokens(reply.content.strip(), _SUMMARY_MAX_TOKENS)
+
+
+class ConversationMemory:
+    """
+    Rolling summary of the turns that have scrolled out of the recent window.
+
+    The summary is refreshed on a background thread after each answer, so the
+    next question never waits for it. Message positions are tracked as
+    absolute counts so the stored conversation list can be trimmed safely.
+    """
+
+    def __init__(
+        self,
+        summarizer: Callable[[str, list[dict], str], str] = summarize_turns,
+        budget: int = _HISTORY_TOKEN_BUDGET,
+    ):
+        self.summary = ""
+        self._summarizer = summarizer
+        self._budget = budget
+        self._summarized_upto = 0  # absolute index of first unsummarized message
+        self._dropped = 0          # messages already trimmed from the list front
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def refresh(self, conversation: list[dict], api_key: str) -> None:
+        """Summarize turns that fell out of the window, off the request path."""
+        start, _ = select_recent_turns(conversation, self._budget)
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            begin = self._summarized_upto - self._dropped
+            if start <= begin:
+                return
+            pending = [dict(t) for t in conversation[begin:start]]
+            previous = self.summary
+            upto = self._summarized_upto + len(pending)
+            self._thread = threading.Thread(
+                target=self._run, args=(previous, pending, api_key, upto), daemon=True
+            )
+            self._thread.start()
+
+    def _run(self, previous: str, pending: list[dict], api_key: str, upto: int) -> None:
+        try:
+            summary = self._summarizer(previous, pending, api_key)
+        except Exception:
+            return  # keep the old summary; the turns are retried next refresh
+        with self._lock:
+            self.summary = summary
+            self._summarized_upto = upto
+
+    @property
+    def dropped(self) -> int:
+        """Messages trimmed from the front so far: list position + this = absolute index."""
+        return self._dropped
+
+    def trim(self, conversation: list[dict]) -> None:
+        """Drop already-summarized messages once the list exceeds its cap."""
+        with self._lock:
+            excess = len(conversation) - _MAX_STORED_MESSAGES
+            removable = min(excess, self._summarized_upto - self._dropped)
+            if removable > 0:
+                del conversation[:removable]
+                self._dropped += removable
+
+    def wait(self, timeout: float | None = None) -> None:
+        """Block until a pending refresh has finished (used by tests)."""
+        thread = self._thread
+        if thread:
+            thread.join(timeout)
@@ -0,0 +1,243 @@
+"""Process-wide, memory-budgeted registry of per-session vector stores.
+
+Sessions hand their FAISS store to the :class:`IndexManager` instead of
+keeping it in ``st.session_state``. When the resident stores exceed the
+memory budget, the least-recently-used ones are written to disk and dropped
+from RAM; the next query for that session reloads them transparently.
+
+Streamlit does not report closed browser sessions, so sessions idle for
+longer than a TTL are dropped entirely, spill files included. The app
+rebuilds a dropped session's index on its next question.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from langchain_community.vectorstores import FAISS
+
+from docuchat.core.metrics import REGISTRY
+from docuchat.core.quantization import quantize_store, vector_precision
+
+_INDEX_BUDGET_MB = 1024
+_IDLE_MINUTES = 120  # sessions unused this long are dropped (0: never)
+_SPILL_DIR = os.path.join(tempfile.gettempdir(), "docuchat-indexes")
+_DOC_OVERHEAD = 200  # bytes per chunk for Document objects, metadata and ids
+
+
+def estimate_store_bytes(store: FAISS) -> int:
+    """Approximate resident size of a FAISS store: vectors plus chunk texts."""
+    index = store.index
+    code_size = getattr(index, "code_size", index.d * 4)
+    text_bytes = 0
+    for doc_id in store.index_to_docstore_id.values():
+        doc = store.docstore.search(doc_id)
+        text_bytes += len(getattr(doc, "page_content", "")) + _DOC_OVERHEAD
+    return index.ntotal * code_size + text_bytes
+
+
+@dataclass
+class _Entry:
+    store: FAISS | None   # None while spilled to disk
+    nbytes: int
+    embeddings: object    # shared embedding model, needed to reload
+    store_cls: type       # FAISS or QuantizedFAISS, to reload the same kind
+    spill_path: str | None = None
+    last_used: float = 0.0  # time.monotonic() of the last put/get
+
+
+class IndexManager:
+    """
+    LRU cache of session stores with spill-to-disk above a memory budget.
+
+    With a ``precision`` other than ``"float32"``, registered stores are
+    converted to reduced-precision codes (see :mod:`docuchat.core.quantization`)
+    and their exact vectors are kept in memory-mapped files under ``spill_dir``.
+    Sessions not used for ``idle_seconds`` are dropped (``None``: never).
+    """
+
+    def __init__(
+        self,
+        budget_bytes: int,
+        spill_dir: str,
+        precision: str = "float32",
+        idle_seconds: float | None = None,
+    ):
+        self.budget_bytes = budget_bytes
+        self.spill_dir = spill_dir
+        self.precision = precision
+        self.idle_seconds = idle_seconds
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._resident_bytes = 0
+        self._lock = threading.RLock()
+        self._evictions = 0
+        self._reloads = 0
+        self._evict_seconds = 0.0
+        self._reload_seconds = 0.0
+        self._expired = 0
+        os.makedirs(spill_dir, exist_ok=True)
+
+    def put(self, session_id: str, store: FAISS | None) -> None:
+        """Register (or replace) a session's store; ``None`` drops it."""
+        with self._lock:
+            self.drop(session_id)
+            self.expire_idle()
+            if store is None:
+                return
+            store = quantize_store(store, self.precision, os.path.join(self.spill_dir, "vectors"))
+            entry = _Entry(store, estimate_store_bytes(store), store.embedding_function, type(store))
+            entry.last_used = time.monotonic()
+            self._entries[session_id] = entry
+            self._resident_bytes += entry.nbytes
+            self._enforce_budget(keep=session_id)
+
+    def get(self, session_id: str) -> FAISS | None:
+        """Return a session's store, reloading it from disk if it was evicted."""
+        with self._lock:
+            self.expire_idle()
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(session_id)
+            if entry.store is None:
+                t0 = time.perf_counter()
+                entry.store = entry.store_cls.load_local(
+                    entry.spill_path,
+                    entry.embeddings,
+                    allow_dangerous_deserialization=True,  # written by us, below
+                )
+                self._reload_seconds += time.perf_counter() - t0
+                self._reloads += 1
+                self._resident_bytes += entry.nbytes
+                self._enforce_budget(keep=session_id)
+            return entry.store
+
+    def drop(self, session_id: str) -> None:
+        """Forget a session's store, in memory and on disk."""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is None:
+                return
+            if entry.store is not None:
+                self._resident_bytes -= entry.nbytes
+            if entry.spill_path:
+                shutil.rmtree(entry.spill_path, ignore_errors=True)
+
+    def expire_idle(self) -> int:
+        """Drop sessions unused for ``idle_seconds``; returns how many were dropped."""
+        if self.idle_seconds is None:
+            return 0
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            # Entries are kept in least-recently-used order
+            idle = []
+            for session_id, entry in self._entries.items():
+                if entry.last_used > cutoff:
+                    break
+                idle.append(session_id)
+            for session_id in idle:
+                self.drop(session_id)
+            self._expired += len(idle)
+            return len(idle)
+
+    def stats(self) -> dict:
+        """Eviction/reload counters and latencies, plus current residency."""
+        with self._lock:
+            resident = sum(1 for e in self._entries.values() if e.store is not None)
+            return {
+                "sessions": len(self._entries),
+                "resident_sessions": resident,
+                "spilled_sessions": len(self._entries) - resident,
+                "resident_bytes": self._resident_bytes,
+                "budget_bytes": self.budget_bytes,
+                "evictions": self._evictions,
+                "reloads": self._reloads,
+                "expired": self._expired,
+                "avg_evict_ms": 1000 * self._evict_seconds / max(1, self._evictions),
+                "avg_reload_ms": 1000 * self._reload_seconds / max(1, self._reloads),
+            }
+
+    def state_totals(self) -> dict[tuple[str], tuple[int, int]]:
+        """``(sessions, estimated bytes)`` per ``("resident" | "spilled",)``."""
+        totals = {("resident",): (0, 0), ("spilled",): (0, 0)}
+        with self._lock:
+            for e in self._entries.values():
+                key = ("resident",) if e.store is not None else ("spilled",)
+                sessions, nbytes = totals[key]
+                totals[key] = (sessions + 1, nbytes + e.nbytes)
+        return totals
+
+    def session_bytes(self) -> dict[tuple[str, str], int]:
+        """
+        Estimated index size per ``(session_id, "resident" | "spilled")``.
+
+        For the admin panel only: session ids must not become metric labels.
+        """
+        with self._lock:
+            return {
+                (sid, "resident" if e.store is not None else "spilled"): e.nbytes
+                for sid, e in self._entries.items()
+            }
+
+    def _enforce_budget(self, keep: str) -> None:
+        for session_id, entry in list(self._entries.items()):
+            if self._resident_bytes <= self.budget_bytes:
+                break
+            if session_id == keep or entry.store is None:
+                continue
+            t0 = time.perf_counter()
+            if entry.spill_path is None:  # stores are immutable once registered
+                entry.spill_path = os.path.join(self.spill_dir, session_id)
+                entry.store.save_local(entry.spill_path)
+            entry.store = None
+            self._resident_bytes -= entry.nbytes
+            self._evict_seconds += time.perf_counter() - t0
+            self._evictions += 1
+
+
+_manager: IndexManager | None = None
+_manager_lock = threading.Lock()
+
+
+def get_index_manager() -> IndexManager:
+    """
+    Return the process-wide index manager.
+
+    The budget comes from ``DOCUCHAT_INDEX_BUDGET_MB``, spilled indexes go
+    to ``DOCUCHAT_INDEX_SPILL_DIR`` (a temp directory by default), and
+    ``DOCUCHAT_VECTOR_PRECISION`` (float32, float16 or int8) sets how vectors
+    are held in memory. Sessions idle for ``DOCUCHAT_INDEX_IDLE_MINUTES``
+    (default 120, ``0`` to keep them until the process exits) are dropped.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            budget_mb = int(os.environ.get("DOCUCHAT_INDEX_BUDGET_MB", _INDEX_BUDGET_MB))
+            spill_dir = os.environ.get("DOCUCHAT_INDEX_SPILL_DIR", _SPILL_DIR)
+            idle_minutes = float(os.environ.get("DOCUCHAT_INDEX_IDLE_MINUTES", _IDLE_MINUTES))
+            _manager = IndexManager(
+                budget_mb * 1024 * 1024,
+                spill_dir,
+                vector_precision(),
+                idle_seconds=idle_minutes * 60 if idle_minutes > 0 else None,
+            )
+            # Aggregated by state: a per-session label would add a series
+            # for every browser session and export session ids
+            REGISTRY.gauge(
+                "docuchat_index_bytes", "Estimated index size of all sessions, by state",
+                lambda: {k: v[1] for k, v in _manager.state_totals().items()}, ("state",),
+            )
+            REGISTRY.gauge(
+                "docuchat_index_sessions", "Sessions with an index, by state",
+                lambda: {k: v[0] for k, v in _manager.state_totals().items()}, ("state",),
+            )
+            REGISTRY.gauge(
+                "docuchat_index_resident_bytes", "Index bytes held in RAM, all sessions",
+                lambda: _manager.stats()["resident_bytes"],
+            )
+        return _manager
@@ -0,0 +1,381 @@
+"""Resumable, incremental bulk ingestion of a directory tree into a knowledge base.
+
+A knowledge base directory holds::
+
+    index/          FAISS store (``save_local`` format), replaced atomically
+    journal.jsonl   append-only log of committed file records
+
+Files are processed in batches and each batch's chunks are added to the
+in-memory index. At a checkpoint the index is saved, and only then are the
+records of the batches since the previous checkpoint appended (and fsync'd)
+to the journal. Saving rewrites the whole index, so checkpoints are taken
+when the unsaved chunks reach a fraction of the saved index (or after a
+time limit) rather than after every batch; total write volume then stays
+proportional to the index size. On start the journal is replayed to learn
+what is already indexed, and any index entries the journal doesn't know
+about (from a crash between the two steps) are dropped, so an interrupted
+run resumes from its last checkpoint. Re-running on the same tree only processes added,
+changed and deleted files. A sharded knowledge base holds one such directory
+per shard (see :mod:`docuchat.core.sharding`).
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from docuchat.core.document import extract_text_from_file
+from docuchat.core.embeddings import embedding_model_id
+from docuchat.core.sharding import shard_of
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
+_BATCH_FILES = 200               # files extracted and indexed together
+_CHECKPOINT_GROWTH = 0.5         # save once unsaved chunks reach this share of the saved index
+_MIN_CHECKPOINT_CHUNKS = 5000    # … but never for fewer unsaved chunks than this
+_CHECKPOINT_SECONDS = 600.0      # … or when the last save is this old
+
+
+@dataclass
+class FileRecord:
+    path: str           # relative to the ingested root
+    sha256: str
+    size: int
+    mtime: float
+    ids: list[str] = field(default_factory=list)  # docstore ids of its chunks
+    error: str = ""
+
+
+@dataclass
+class IngestStats:
+    added: int = 0
+    changed: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    failed: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _extract_job(root: str, rel: str) -> tuple[FileRecord, str | None]:
+    """
+    Worker: hash and extract one file (runs in a pool process).
+
+    The text is ``None`` if the file could not be read at all (deleted or
+    locked since the scan); the record's ``error`` says why.
+    """
+    path = os.path.join(root, rel)
+    try:
+        st = os.stat(path)
+        sha = _hash_file(path)
+    except OSError as e:
+        return FileRecord(rel, "", 0, 0.0, error=f"Error reading {rel}: {e}"), None
+    text = extract_text_from_file(path, rel, content_hash=sha)
+    error = text if text.startswith(("Error reading", "Unsupported file type")) else ""
+    record = FileRecord(rel, sha, st.st_size, st.st_mtime, error=error)
+    return record, "" if error else text
+
+
+def scan_tree(root: str) -> dict[str, os.stat_result]:
+    """Relative paths (``/``-separated) and stats of every supported file."""
+    found = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in sorted(filenames):
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                full = os.path.join(dirpath, name)
+                found[os.path.relpath(full, root).replace(os.sep, "/")] = os.stat(full)
+    return found
+
+
+class KnowledgeBase:
+    """On-disk FAISS store plus the journal of which files it contains."""
+
+    def __init__(self, directory: str, embeddings: Embeddings):
+        self.directory = directory
+        self.embeddings = embeddings
+        self.records: dict[str, FileRecord] = {}
+        self.store: FAISS | None = None
+        self._unsaved: list[dict] = []  # journal entries waiting for the next checkpoint
+        self._unsaved_chunks = 0
+        self._saved_chunks = 0
+        self._saved_at = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    @property
+    def _index_dir(self) -> str:
+        return os.path.join(self.directory, "index")
+
+    @property
+    def _journal_path(self) -> str:
+        return os.path.join(self.directory, "journal.jsonl")
+
+    def _recover(self) -> None:
+        # Finish or roll back an interrupted index swap
+        new, old = self._index_dir + ".new", self._index_dir + ".old"
+        if not os.path.exists(self._index_dir) and os.path.exists(new):
+            os.rename(new, self._index_dir)
+        shutil.rmtree(new, ignore_errors=True)
+        shutil.rmtree(old, ignore_errors=True)
+
+        if os.path.exists(self._journal_path):
+            valid = 0
+            with open(self._journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # torn final line from a crash
+                    self._apply(entry)
+                    valid += len(line)
+            if valid < os.path.getsize(self._journal_path):
+                os.truncate(self._journal_path, valid)
+
+        if os.path.exists(self._index_dir):
+            self.store = FAISS.load_local(
+                self._index_dir, self.embeddings, allow_dangerous_deserialization=True
+            )
+            known = {i for r in self.records.values() for i in r.ids}
+            orphans = [i for i in self.store.index_to_docstore_id.values() if i not in known]
+            if orphans:
+                self.store.delete(orphans)
+            self._saved_chunks = self.store.index.ntotal
+
+    def _apply(self, entry: dict) -> None:
+        op = entry.pop("op")
+        if op == "meta":
+            if entry["model"] != embedding_model_id():
+                raise ValueError(
+                    f"Knowledge base was built with '{entry['model']}', "
+                    f"but this instance uses '{embedding_model_id()}'"
+                )
+        elif op == "put":
+            self.records[entry["path"]] = FileRecord(**entry)
+        elif op == "delete":
+            self.records.pop(entry["path"], None)
+
+    def _append(self, entries: list[dict]) -> None:
+        with open(self._journal_path, "a", encoding="utf-8") as f:
+            if f.tell() == 0:
+                f.write(json.dumps({"op": "meta", "model": embedding_model_id()}) + "\n")
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _save_index(self) -> None:
+        new, old = self._index_dir + ".new", self._index_dir + ".old"
+        if self.store is None:
+            shutil.rmtree(self._index_dir, ignore_errors=True)
+            return
+        self.store.save_local(new)
+        if os.path.exists(self._index_dir):
+            os.rename(self._index_dir, old)
+        os.rename(new, self._index_dir)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def commit(self, removed: list[str], added: list[tuple[FileRecord, list]]) -> int:
+        """
+        Apply one batch: drop ``removed`` paths' chunks and index the
+        ``(record, chunks)`` pairs in ``added``. The batch is saved and
+        journalled at the next :meth:`checkpoint`, which runs here when it
+        is due.
+
+        Returns:
+            Number of chunks added.
+        """
+        stale: list[str] = []
+        if self.store is not None:
+            present = set(self.store.index_to_docstore_id.values())
+            stale = [
+                i for p in removed if p in self.records for i in self.records[p].ids if i in present
+            ]
+            if stale:
+                self.store.delete(stale)
+
+        docs, ids = [], []
+        for record, chunks in added:
+            record.ids = [str(uuid.uuid4()) for _ in chunks]
+            docs.extend(chunks)
+            ids.extend(record.ids)
+        if docs:
+            if self.store is None:
+                self.store = FAISS.from_documents(docs, self.embeddings, ids=ids)
+            else:
+                self.store.add_documents(docs, ids=ids)
+        if self.store is not None and self.store.index.ntotal == 0:
+            self.store = None
+
+        entries = [{"op": "delete", "path": p} for p in removed]
+        entries += [{"op": "put", **record.__dict__} for record, _ in added]
+        for entry in entries:
+            self._apply(dict(entry))
+        self._unsaved.extend(entries)
+        self._unsaved_chunks += len(docs) + len(stale)
+        due = (
+            self._unsaved_chunks >= max(_MIN_CHECKPOINT_CHUNKS, _CHECKPOINT_GROWTH * self._saved_chunks)
+            or time.monotonic() - self._saved_at >= _CHECKPOINT_SECONDS
+        )
+        if due:
+            self.checkpoint()
+        return len(docs)
+
+    def checkpoint(self) -> None:
+        """Save the index, then journal every batch committed since the last checkpoint."""
+        if not self._unsaved:
+            return
+        self._save_index()
+        self._append(self._unsaved)
+        self._unsaved = []
+        self._unsaved_chunks = 0
+        self._saved_chunks = self.store.index.ntotal if self.store is not None else 0
+        self._saved_at = time.monotonic()
+
+    def touch(self, record: FileRecord) -> None:
+        """Journal new stat info for a file whose content is unchanged."""
+        entry = {"op": "put", **record.__dict__}
+        self._append([entry])
+        self._apply(dict(entry))
+
+    def compact(self) -> None:
+        """Checkpoint, then rewrite the journal as one ``put`` per current file."""
+        self.checkpoint()
+        tmp = self._journal_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"op": "meta", "model": embedding_model_id()}) + "\n")
+            for record in self.records.values():
+                f.write(json.dumps({"op": "put", **record.__dict__}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._journal_path)
+
+
+class _Progress:
+    """Single-line progress bar on stderr."""
+
+    def __init__(self, total: int, label: str):
+        self.total, self.label, self.done = total, label, 0
+        self.start = time.perf_counter()
+
+    def advance(self, n: int = 1) -> None:
+        self.done += n
+        elapsed = time.perf_counter() - self.start
+        rate = self.done / elapsed if elapsed else 0.0
+        eta = (self.total - self.done) / rate if rate else 0.0
+        filled = int(30 * self.done / max(1, self.total))
+        sys.stderr.write(
+            f"\r{self.label} [{'#' * filled}{'.' * (30 - filled)}] "
+            f"{self.done}/{self.total}  {rate:.1f}/s  ETA {eta:,.0f}s "
+        )
+        sys.stderr.flush()
+
+    def close(self) -> None:
+        sys.stderr.write("\n")
+
+
+def ingest_directory(
+    root: str,
+    kb_dir: str,
+    embeddings: Embeddings,
+    workers: int | None = None,
+    batch_files: int = _BATCH_FILES,
+    progress: bool = True,
+    shard: tuple[int, int] | None = None,
+) -> IngestStats:
+    """
+    Incrementally index every PDF/DOCX/TXT file under ``root`` into ``kb_dir``.
+
+    Args:
+        root:        Directory tree to ingest.
+        kb_dir:      Knowledge base directory (created if missing).
+        embeddings:  Embedding backend (e.g. an :class:`EmbeddingPool`).
+        workers:     Extraction processes (default: CPU count).
+        batch_files: Files extracted and indexed together. The index is
+                     saved when enough new chunks have accumulated, so a
+                     crash loses at most the work since that checkpoint.
+        progress:    Draw a progress bar on stderr.
+        shard:       ``(index, count)``: only ingest the files that
+                     :func:`~docuchat.core.sharding.shard_of` assigns to
+                     shard ``index`` of ``count`` (``kb_dir`` is that
+                     shard's directory).
+
+    Returns:
+        Counts of added/changed/deleted/unchanged/failed files and chunks.
+    """
+    from docuchat.core.rag import split_documents  # rag pulls in streamlit; keep it lazy
+
+    t0 = time.perf_counter()
+    kb = KnowledgeBase(kb_dir, embeddings)
+    stats = IngestStats()
+    found = scan_tree(root)
+    if shard is not None:
+        index, count = shard
+        found = {rel: st for rel, st in found.items() if shard_of(rel, count) == index}
+
+    deleted = [p for p in kb.records if p not in found]
+    todo: list[str] = []
+    for rel, st in found.items():
+        record = kb.records.get(rel)
+        if record and record.size == st.st_size and record.mtime == st.st_mtime:
+            stats.unchanged += 1
+        else:
+            todo.append(rel)
+
+    bar = _Progress(len(todo), "Ingesting") if progress and todo else None
+    if deleted:
+        kb.commit(deleted, [])
+        stats.deleted = len(deleted)
+
+    # spawn: never fork a parent that may already hold an initialized model
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        for start in range(0, len(todo), batch_files):
+            batch = todo[start:start + batch_files]
+            removed, added = [], []
+            for record, text in pool.map(_extract_job, [root] * len(batch), batch):
+                if text is None:
+                    # Unreadable right now: keep any indexed version, retry next run
+                    stats.failed += 1
+                    continue
+                previous = kb.records.get(record.path)
+                if previous and previous.sha256 == record.sha256 and not previous.error:
+                    # Touched but identical: keep its chunks, refresh the stat
+                    record.ids = previous.ids
+                    kb.touch(record)
+                    stats.unchanged += 1
+                    continue
+                if previous:
+                    removed.append(record.path)
+                    stats.changed += 1
+                else:
+                    stats.added += 1
+                if record.error:
+                    stats.failed += 1
+                chunks = split_documents([{"original_name": record.path, "text_content": text}])
+                added.append((record, chunks))
+            stats.chunks += kb.commit(removed, added)
+            if bar:
+                bar.advance(len(batch))
+    if bar:
+        bar.close()
+
+    kb.compact()
+    stats.seconds = time.perf_counter() - t0
+    return stats
@@ -0,0 +1,389 @@
+"""In-process runtime metrics with Prometheus text exposition.
+
+Counters and histograms are recorded on the hot path, so recording is kept
+to a dict lookup, a bisect and an uncontended lock. Gauges that describe
+state (process RSS, per-session index sizes) are computed only when the
+metrics are read, by callbacks registered with :meth:`MetricsRegistry.gauge`.
+
+Set ``DOCUCHAT_METRICS_PORT`` to serve ``/metrics`` for Prometheus from the
+app process (see :func:`start_metrics_server`). The same server answers
+``/healthz`` (process up) and ``/ready`` (start-up warm-up finished, see
+:mod:`docuchat.core.warmup`) for load-balancer checks.
+"""
+
+import bisect
+import math
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Seconds; spans a cache hit (~1 ms) to a slow LLM answer (~1 min)
+_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _CounterChild:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("_lock", "_bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple):
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot: above every bound
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def snapshot(self) -> tuple[list[int], float]:
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._child(())
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _child(self, values: tuple):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def labels(self, *values):
+        """The child series for these label values (created on first use)."""
+        child = self._children.get(values)  # fast path: already seen, as given
+        if child is not None:
+            return child
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return self._child(tuple(str(v) for v in values))
+
+    def series(self) -> list[tuple[tuple, object]]:
+        with self._lock:
+            return list(self._children.items())
+
+
+class Counter(_Metric):
+    """Monotonically increasing total, optionally split by labels."""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def value(self, *values) -> float:
+        child = self._children.get(tuple(str(v) for v in values))
+        return child.value if child else 0.0
+
+    def render(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+            for values, child in self.series()
+        ]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = _LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def render(self) -> list[str]:
+        lines = []
+        for values, child in self.series():
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def summary(self, *values) -> dict:
+        """Count, sum, mean and bucket-interpolated p50/p95/p99 of one series (or all merged)."""
+        if values:
+            child = self._children.get(tuple(str(v) for v in values))
+            children = [child] if child else []
+        else:
+            children = [c for _, c in self.series()]
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        for child in children:
+            child_counts, child_sum = child.snapshot()
+            counts = [a + b for a, b in zip(counts, child_counts)]
+            total += child_sum
+        n = sum(counts)
+        return {
+            "count": n,
+            "sum": total,
+            "mean": total / n if n else 0.0,
+            "p50": self._quantile(0.50, counts),
+            "p95": self._quantile(0.95, counts),
+            "p99": self._quantile(0.99, counts),
+        }
+
+    def _quantile(self, q: float, counts: list[int]) -> float:
+        """Linear interpolation inside the bucket holding the q-th observation."""
+        n = sum(counts)
+        if not n:
+            return 0.0
+        rank, seen, lower = q * n, 0, 0.0
+        for bound, count in zip(self.buckets, counts):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.buckets[-1]  # in the overflow bucket: report the top bound
+
+
+class _Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple, collect: Callable):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self) -> list[tuple[tuple, float]]:
+        """``collect()`` returns a number, or a ``{label values: number}`` dict."""
+        result = self.collect()
+        if result is None:
+            return []
+        if isinstance(result, dict):
+            return [(tuple(str(part) for part in key), float(value)) for key, value in result.items()]
+        return [((), float(result))]
+
+    def render(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}"
+            for values, value in self.samples()
+        ]
+
+
+class MetricsRegistry:
+    """Named metrics of one process, rendered together for exposition."""
+
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = _LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, collect: Callable, labelnames: tuple = ()) -> None:
+        """Register (or replace) a gauge whose value is read from ``collect`` at scrape time."""
+        with self._lock:
+            self._metrics[name] = _Gauge(name, help, labelnames, collect)
+
+    def get(self, name: str):
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.render()
+            except Exception:
+                continue  # a failing gauge callback must not break the scrape
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+def process_rss_bytes() -> int | None:
+    """Current resident set size (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+REGISTRY = MetricsRegistry()
+
+EXTRACTION_SECONDS = REGISTRY.histogram(
+    "docuchat_extraction_seconds", "Time to parse one document (cache misses)", ("format",)
+)
+EXTRACTION_CACHE = REGISTRY.counter(
+    "docuchat_extraction_cache_total", "Extraction cache lookups", ("result",)
+)
+EMBEDDING_SECONDS = REGISTRY.histogram(
+    "docuchat_embedding_seconds", "Time to embed the chunks of one index build"
+)
+EMBEDDED_CHUNKS = REGISTRY.counter(
+    "docuchat_embedded_chunks_total", "Chunks embedded for index builds"
+)
+RETRIEVAL_SECONDS = REGISTRY.histogram(
+    "docuchat_retrieval_seconds", "Time to retrieve context chunks for a question"
+)
+LLM_SECONDS = REGISTRY.histogram(
+    "docuchat_llm_seconds", "LLM request duration, from send to last token"
+)
+LLM_TTFT_SECONDS = REGISTRY.histogram(
+    "docuchat_llm_time_to_first_token_seconds", "LLM request time to first streamed token"
+)
+LLM_REQUESTS = REGISTRY.counter(
+    "docuchat_llm_requests_total", "Answered questions by outcome", ("outcome",)
+)
+EXTRACTIVE_ANSWERS = REGISTRY.counter(
+    "docuchat_extractive_answers_total", "Questions answered from a retrieved sentence, without an LLM"
+)
+SHARD_FAILURES = REGISTRY.counter(
+    "docuchat_shard_failures_total", "Shard searches left out of an answer", ("shard", "reason")
+)
+EMBED_SERVER_BATCH_TEXTS = REGISTRY.histogram(
+    "docuchat_embed_server_batch_texts", "Texts per model call of the shared embedding server",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+REGISTRY.gauge(
+    "docuchat_process_resident_bytes", "Resident memory of this process", process_rss_bytes
+)
+
+
+_readiness_check: Callable[[], bool] = lambda: True
+
+
+def set_readiness_check(check: Callable[[], bool]) -> None:
+    """Decide what ``/ready`` reports (default: ready as soon as the server is up)."""
+    global _readiness_check
+    _readiness_check = check
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path in ("/", "/metrics"):
+            self._reply(200, REGISTRY.render(), "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/healthz":
+            self._reply(200, "ok\n")
+        elif path == "/ready":
+            ready = _readiness_check()
+            self._reply(200 if ready else 503, "ready\n" if ready else "warming up\n")
+        else:
+            self.send_error(404)
+
+    def _reply(self, status: int, text: str, content_type: str = "text/plain; charset=utf-8"):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass  # scrapes every few seconds would flood the app log
+
+
+_server: ThreadingHTTPServer | None = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int | None = None, host: str = "0.0.0.0") -> ThreadingHTTPServer | None:
+    """
+    Serve :data:`REGISTRY` at ``/metrics`` from a daemon thread (once per process).
+
+    Args:
+        port: Port to listen on; defaults to ``DOCUCHAT_METRICS_PORT``.
+              Nothing is started when neither is set.
+        host: Interface to bind.
+
+    Returns:
+        The running server, or ``None`` if metrics serving is not configured.
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            if port is None:
+                configured = os.environ.get("DOCUCHAT_METRICS_PORT", "")
+                if not configured:
+                    return None
+                port = int(configured)
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="docuchat-metrics", daemon=True).start()
+        return _server
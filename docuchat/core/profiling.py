@@ -0,0 +1,195 @@
+"""Opt-in cProfile + tracemalloc captures of individual requests.
+
+Functions decorated with :func:`profiled` run unchanged unless profiling is
+on, either process-wide (``DOCUCHAT_PROFILE=1``) or for the current context
+only (:func:`enable_for_context`, used by the admin toggle so one session can
+profile its own uploads and questions). When it is off the wrapper costs a
+single flag check. Each profiled call writes:
+
+    <stamp>-<id>-<name>.prof   cProfile stats (``python -m pstats``, snakeviz,
+                               or ``flameprof`` for a flame graph)
+    <stamp>-<id>-<name>.txt    wall time, top functions by cumulative time
+                               and the top allocations made during the call
+
+to ``$DOCUCHAT_PROFILE_DIR`` (default ``$DOCUCHAT_CACHE_DIR/profiles``).
+
+tracemalloc is process-wide: while captures overlap (two sessions
+profiling at once), each one's peak and allocation list include the
+other's, and the report says so. cProfile timings stay per thread.
+"""
+
+import contextvars
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+from dataclasses import dataclass
+
+_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "docuchat")
+_MAX_CAPTURES = 50        # oldest captures are deleted beyond this
+_TOP_FUNCTIONS = 30
+_TOP_ALLOCATIONS = 25
+_TRACE_FRAMES = 10        # traceback depth recorded per allocation
+
+_process_enabled = os.environ.get("DOCUCHAT_PROFILE", "") not in ("", "0", "false")
+_context_enabled: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "docuchat_profiling", default=False
+)
+_active = threading.local()   # a capture is running in this thread (no nesting)
+_trace_lock = threading.Lock()
+_trace_users = 0              # concurrent captures sharing tracemalloc
+_trace_starts = 0             # captures started so far, to detect overlaps
+
+
+@dataclass
+class Capture:
+    name: str
+    prof_path: str
+    report_path: str
+    created: float
+    seconds: float
+
+
+def profile_dir() -> str:
+    root = os.environ.get("DOCUCHAT_CACHE_DIR", _CACHE_DIR)
+    return os.environ.get("DOCUCHAT_PROFILE_DIR", os.path.join(root, "profiles"))
+
+
+def is_enabled() -> bool:
+    return _process_enabled or _context_enabled.get()
+
+
+def enable_for_context(enabled: bool) -> None:
+    """Turn profiling on or off for code running in the current context/thread."""
+    _context_enabled.set(enabled)
+
+
+def profiled(name: str):
+    """Decorator: capture a profile of each call while profiling is enabled."""
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not (_process_enabled or _context_enabled.get()) or getattr(_active, "on", False):
+                return fn(*args, **kwargs)
+            return _capture(name, fn, args, kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def _start_tracing() -> int:
+    """Start (or join) tracing; returns this capture's start number."""
+    global _trace_users, _trace_starts
+    with _trace_lock:
+        if _trace_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(_TRACE_FRAMES)
+        _trace_users += 1
+        _trace_starts += 1
+        if _trace_users == 1:
+            tracemalloc.reset_peak()  # resetting would clobber another capture's peak
+        return _trace_starts if _trace_users == 1 else -1
+
+
+def _stop_tracing(started: int) -> bool:
+    """Stop (or leave) tracing; returns whether another capture overlapped this one."""
+    global _trace_users
+    with _trace_lock:
+        overlapped = started != _trace_starts or _trace_users > 1
+        _trace_users -= 1
+        if _trace_users == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        return overlapped
+
+
+def _capture(name: str, fn, args, kwargs):
+    _active.on = True
+    started = _start_tracing()
+    before = tracemalloc.take_snapshot()
+    profiler = cProfile.Profile()
+    t0 = time.perf_counter()
+    try:
+        profiler.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+    finally:
+        seconds = time.perf_counter() - t0
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        overlapped = _stop_tracing(started)
+        _active.on = False
+        try:
+            _write_capture(name, profiler, before, after, seconds, peak, overlapped)
+        except OSError:
+            pass  # never fail the request because the profile couldn't be saved
+
+
+def _write_capture(name, profiler, before, after, seconds, peak_bytes, overlapped=False) -> Capture:
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.join(
+        directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}-{name}"
+    )
+    profiler.dump_stats(stem + ".prof")
+
+    out = io.StringIO()
+    out.write(f"{name}: {seconds * 1000:.1f} ms wall, peak traced memory {peak_bytes / 1e6:.1f} MB\n")
+    if overlapped:
+        out.write("(another capture overlapped: memory figures include its allocations)\n")
+    out.write("\n")
+    out.write(f"== Top {_TOP_FUNCTIONS} functions by cumulative time ==\n")
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(_TOP_FUNCTIONS)
+    out.write(f"\n== Top {_TOP_ALLOCATIONS} allocations during the call (net, by line) ==\n")
+    for stat in after.compare_to(before, "lineno")[:_TOP_ALLOCATIONS]:
+        out.write(f"{stat}\n")
+    with open(stem + ".txt", "w", encoding="utf-8") as f:
+        f.write(out.getvalue())
+
+    _prune(directory)
+    return Capture(name, stem + ".prof", stem + ".txt", time.time(), seconds)
+
+
+def _prune(directory: str) -> None:
+    profiles = sorted(
+        (e for e in os.scandir(directory) if e.name.endswith(".prof")),
+        key=lambda e: e.stat().st_mtime,
+    )
+    for entry in profiles[:-_MAX_CAPTURES]:
+        for path in (entry.path, entry.path[: -len(".prof")] + ".txt"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def list_captures(limit: int = 20) -> list[Capture]:
+    """Most recent captures first."""
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    captures = []
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(".prof"):
+            continue
+        stem = entry.path[: -len(".prof")]
+        name = stem.rsplit("-", 1)[-1]  # <date>-<time>-<id>-<name>
+        try:
+            with open(stem + ".txt", encoding="utf-8") as f:
+                header = f.readline()  # "<name>: <ms> ms wall, ..."
+        except OSError:
+            continue  # pruned or still being written
+        try:
+            seconds = float(header.split(": ", 1)[1].split(" ms", 1)[0]) / 1000
+        except (IndexError, ValueError):
+            seconds = 0.0
+        captures.append(Capture(name, entry.path, stem + ".txt", entry.stat().st_mtime, seconds))
+    captures.sort(key=lambda c: c.created, reverse=True)
+    return captures[:limit]
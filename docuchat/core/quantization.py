@@ -0,0 +1,182 @@
+"""Reduced-precision vector storage with exact re-scoring.
+
+A flat float32 index holds 1.5 KiB per 384-d MiniLM vector. A
+:class:`QuantizedFAISS` store keeps float16 (2x smaller) or int8
+scalar-quantized (4x smaller) codes in RAM and searches over those. The
+float32 originals live in a memory-mapped file; only the rows of each
+search's top ``fetch_k`` candidates are paged in and re-scored exactly, so
+the final ranking matches the flat index while resident memory shrinks.
+"""
+
+import os
+import shutil
+import tempfile
+import weakref
+from typing import Any
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+
+PRECISIONS = {
+    "float32": None,  # plain flat index, no quantization
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+_VECTORS_DIR = os.path.join(tempfile.gettempdir(), "docuchat-vectors")
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ReadOnlyIndexError(TypeError):
+    """Raised when adding to or deleting from a :class:`QuantizedFAISS` store."""
+
+
+class ExactVectors:
+    """Read-only float32 matrix in a memory-mapped file, paged in on demand."""
+
+    def __init__(self, path: str, dim: int, owned: bool = False):
+        self.path = path
+        count = os.path.getsize(path) // (4 * dim)
+        self.array = (
+            np.memmap(path, dtype="float32", mode="r", shape=(count, dim))
+            if count
+            else np.empty((0, dim), dtype="float32")
+        )
+        if owned:  # temp file: delete it together with this object
+            weakref.finalize(self, _remove_quietly, path)
+
+    @classmethod
+    def write(cls, vectors: np.ndarray, directory: str) -> "ExactVectors":
+        os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=directory, suffix=".f32")
+        with os.fdopen(fd, "wb") as f:
+            f.write(np.ascontiguousarray(vectors, dtype="float32").tobytes())
+        return cls(path, vectors.shape[1], owned=True)
+
+
+class QuantizedFAISS(FAISS):
+    """
+    FAISS store searching compact codes and re-scoring candidates exactly.
+
+    Read-only: build a flat store, then convert it with :func:`quantize_store`.
+    ``save_local``/``load_local`` keep the exact vectors next to the index.
+    """
+
+    exact: ExactVectors
+
+    def rescored_search(
+        self, embedding: np.ndarray, k: int, params: faiss.SearchParameters | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find ``k`` candidates over the compact codes, then re-rank them by
+        exact squared L2 distance. ``params`` is passed to the index search
+        (e.g. an ID selector restricting it to some documents).
+
+        Returns:
+            ``(distances, indices)`` shaped ``(1, n)`` like ``index.search``.
+        """
+        _, indices = self.index.search(embedding, k, params=params)
+        ids = indices[0][indices[0] != -1]
+        rows = np.asarray(self.exact.array[ids])
+        distances = ((rows - embedding[0]) ** 2).sum(axis=1)
+        order = np.argsort(distances, kind="stable")
+        return distances[order][None, :], ids[order][None, :]
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: list[float],
+        k: int = 4,
+        filter: Any = None,
+        fetch_k: int = 20,
+        **kwargs: Any,
+    ) -> list[tuple[Document, float]]:
+        if filter is not None or kwargs:
+            # Metadata filters and score thresholds: approximate scores only
+            return super().similarity_search_with_score_by_vector(
+                embedding, k, filter, fetch_k, **kwargs
+            )
+        distances, indices = self.rescored_search(
+            np.asarray([embedding], dtype="float32"), max(k, fetch_k)
+        )
+        return [
+            (self.docstore.search(self.index_to_docstore_id[int(i)]), float(d))
+            for d, i in zip(distances[0][:k], indices[0][:k])
+        ]
+
+    def save_local(self, folder_path: str, index_name: str = "index") -> None:
+        super().save_local(folder_path, index_name)
+        shutil.copyfile(self.exact.path, os.path.join(folder_path, f"{index_name}.f32"))
+
+    @classmethod
+    def load_local(cls, folder_path: str, embeddings, index_name: str = "index", **kwargs) -> "QuantizedFAISS":
+        store = super().load_local(folder_path, embeddings, index_name, **kwargs)
+        store.exact = ExactVectors(os.path.join(folder_path, f"{index_name}.f32"), store.index.d)
+        return store
+
+    def _read_only(self, *args, **kwargs):
+        raise ReadOnlyIndexError("Quantized stores are read-only; rebuild and re-quantize")
+
+    add_texts = add_embeddings = add_documents = merge_from = delete = _read_only
+
+
+def quantize_store(store: FAISS, precision: str, directory: str = _VECTORS_DIR) -> FAISS:
+    """
+    Convert a flat FAISS store to reduced-precision codes with exact re-scoring.
+
+    Args:
+        store:     Flat (float32, L2) store; it is not modified.
+        precision: One of :data:`PRECISIONS`. ``"float32"`` returns ``store``.
+        directory: Where the memory-mapped float32 vectors are written.
+
+    Returns:
+        A :class:`QuantizedFAISS` sharing ``store``'s docstore, or ``store``
+        itself if there is nothing to convert.
+
+    Raises:
+        ValueError: For an unknown precision or a non-L2 store.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown vector precision '{precision}' (choose from {', '.join(PRECISIONS)})")
+    qtype = PRECISIONS[precision]
+    if qtype is None or isinstance(store, QuantizedFAISS) or store.index.ntotal == 0:
+        return store
+    if store.distance_strategy != DistanceStrategy.EUCLIDEAN_DISTANCE:
+        raise ValueError("Only Euclidean-distance stores can be quantized")
+
+    vectors = store.index.reconstruct_n(0, store.index.ntotal)
+    index = faiss.IndexScalarQuantizer(store.index.d, qtype, faiss.METRIC_L2)
+    index.train(vectors)
+    index.add(vectors)
+    quantized = QuantizedFAISS(
+        store.embedding_function,
+        index,
+        store.docstore,
+        store.index_to_docstore_id,
+        relevance_score_fn=store.override_relevance_score_fn,
+    )
+    quantized.exact = ExactVectors.write(vectors, directory)
+    return quantized
+
+
+def full_precision_vectors(store: FAISS) -> np.ndarray:
+    """All of a store's vectors as float32 (exact even for quantized stores)."""
+    if isinstance(store, QuantizedFAISS):
+        return np.asarray(store.exact.array)
+    index = store.index
+    return index.reconstruct_n(0, index.ntotal) if index.ntotal else np.empty((0, index.d), "float32")
+
+
+def vector_precision() -> str:
+    """Configured precision from ``DOCUCHAT_VECTOR_PRECISION`` (default float32)."""
+    precision = os.environ.get("DOCUCHAT_VECTOR_PRECISION", "float32")
+    if precision not in PRECISIONS:
+        raise ValueError(f"DOCUCHAT_VECTOR_PRECISION must be one of {', '.join(PRECISIONS)}")
+    return precision
@@ -1,30 +1,50 @@
 """RAG pipeline: vector store construction and retrieval-augmented generation."""
 
+import hashlib
+import queue
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator
+
 import streamlit as st
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain_groq import ChatGroq
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from docuchat.core.config import RAGConfig, get_rag_config
+from docuchat.core.embeddings import create_embeddings
+from docuchat.core.extractive import extract_answer
+from docuchat.core.history import select_recent_turns
+from docuchat.core.metrics import (
+    EMBEDDED_CHUNKS,
+    EMBEDDING_SECONDS,
+    EXTRACTIVE_ANSWERS,
+    LLM_REQUESTS,
+    LLM_SECONDS,
+    LLM_TTFT_SECONDS,
+    RETRIEVAL_SECONDS,
+)
+from docuchat.core.profiling import profiled
+from docuchat.core.retrieval import retrieve, retrieve_per_source
+from docuchat.core.scheduler import get_scheduler, is_rate_limit_error
+from docuchat.core.sharding import ShardedIndex
+from docuchat.core.snapshot import import_snapshot
+from docuchat.core.summaries import SummaryTree, is_broad_question, select_summaries
+
 # ---------------------------------------------------------------------------
 # Embedding model — cached across Streamlit sessions/reruns so it is loaded
-# only once per server process (avoids repeated 90 MB downloads).
+# only once per server process (avoids repeated 90 MB downloads). With
+# DOCUCHAT_EMBED_WORKERS set this is a multi-process pool instead.
 # ---------------------------------------------------------------------------
 @st.cache_resource(show_spinner="Loading embedding model…")
-def _get_embeddings() -> HuggingFaceEmbeddings:
-    return HuggingFaceEmbeddings(
-        model_name="all-MiniLM-L6-v2",
-        model_kwargs={"device": "cpu"},
-        encode_kwargs={"normalize_embeddings": True},
-    )
+def _get_embeddings() -> Embeddings:
+    return create_embeddings()
 
-_CHUNK_SIZE = 1000      # larger chunks preserve full sentences and paragraphs
-_CHUNK_OVERLAP = 200    # bigger overlap avoids losing info at chunk boundaries
-_TOP_K = 6              # retrieve more candidates for better coverage
-_FETCH_K = 20           # candidate pool for MMR diversity re-ranking
-_SCORE_THRESHOLD = 0.25 # discard chunks below this relevance score
-_MAX_HISTORY = 3        # last N conversation turns passed as context
+# Chunking and retrieval parameters live in RAGConfig (docuchat/core/config.py)
 _LLM_MODEL = "llama-3.3-70b-versatile"  # more accurate model for better answers
 
 _SYSTEM_PROMPT = (
@@ -39,25 +59,54 @@ _SYSTEM_PROMPT = (
     "5. For follow-up questions, use the conversation history to understand context."
 )
 
+# Map-reduce answering across documents (see stream_map_reduce)
+_MAP_MODEL = "llama-3.1-8b-instant"  # per-document notes: short, so the small model
+_MAP_MAX_TOKENS = 400
+_MAP_CONCURRENCY = 4     # per-document calls in flight (the key's scheduler caps this too)
+_MAP_MAX_DOCUMENTS = 8   # best-matching documents read per question
+_NOT_FOUND = "NOT FOUND"
+
+_MAP_PROMPT = (
+    "You read excerpts of ONE document and extract everything in them that "
+    "helps answer the question: facts, figures, terms and conditions, quoted "
+    "exactly. Do not use outside knowledge and do not answer for other "
+    f"documents. If the excerpts contain nothing relevant, reply exactly: {_NOT_FOUND}"
+)
+_REDUCE_PROMPT = (
+    _SYSTEM_PROMPT + "\n6. The context holds notes extracted from each document "
+    "separately. Cover every document that has relevant notes; when the "
+    "question compares them, set the documents side by side (a table works "
+    "well) and point out the differences."
+)
 
-def build_vector_store(files: list[dict]) -> FAISS | None:
+_CROSS_DOCUMENT_QUESTION = re.compile(
+    r"\b(compare|comparison|differ(s|ence|ences)?|"
+    r"(across|each|every|all)( of)? (the |my |these )?"
+    r"(documents?|files?|specs?|specifications|reports?|papers?|contracts?))\b",
+    re.IGNORECASE,
+)
+
+
+def split_documents(files: list[dict], config: RAGConfig | None = None) -> list[Document]:
     """
-    Build a FAISS vector store from a list of uploaded files.
+    Chunk files into LangChain documents tagged with their source name.
 
-    Each file dict must contain:
-        - ``original_name`` (str): display name used as chunk metadata source.
-        - ``text_content``  (str): extracted plain text of the document.
+    Each file is chunked on its own, so its chunks do not depend on which
+    other files are indexed with it (running headers and footers were
+    already stripped per document at extraction).
 
     Args:
-        files: List of file metadata dicts.
+        files:  File dicts with ``original_name`` and ``text_content`` keys
+                (see :func:`build_vector_store`).
+        config: Chunking parameters (default: :func:`get_rag_config`).
 
     Returns:
-        A FAISS vector store ready for similarity search, or ``None`` if all
-        files have empty content.
+        Chunks in file order; files with empty content contribute nothing.
     """
+    config = config or get_rag_config()
     splitter = RecursiveCharacterTextSplitter(
-        chunk_size=_CHUNK_SIZE,
-        chunk_overlap=_CHUNK_OVERLAP,
+        chunk_size=config.chunk_size,
+        chunk_overlap=config.chunk_overlap,
         separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""],
     )
     docs = []
@@ -70,78 +119,409 @@ def build_vector_store(files: list[dict]) -> FAISS | None:
             metadatas=[{"source": file["original_name"]}],
         )
         docs.extend(chunks)
+    return docs
+
+
+@profiled("build_index")
+def build_vector_store(files: list[dict], config: RAGConfig | None = None) -> FAISS | None:
+    """
+    Build a FAISS vector store from a list of uploaded files.
+
+    Each file dict must contain:
+        - ``original_name`` (str): display name used as chunk metadata source.
+        - ``text_content``  (str): extracted plain text of the document.
+
+    Args:
+        files:  List of file metadata dicts.
+        config: Chunking parameters (default: :func:`get_rag_config`).
+
+    Returns:
+        A FAISS vector store ready for similarity search, or ``None`` if all
+        files have empty content.
+    """
+    docs = split_documents(files, config)
+    if not docs:
+        return None
+    embeddings = _get_embeddings()
+    texts = [d.page_content for d in docs]
+    t0 = time.perf_counter()
+    vectors = embeddings.embed_documents(texts)
+    EMBEDDING_SECONDS.observe(time.perf_counter() - t0)
+    EMBEDDED_CHUNKS.inc(len(texts))
+    return FAISS.from_embeddings(
+        list(zip(texts, vectors)), embeddings, metadatas=[d.metadata for d in docs]
+    )
+
+
+def load_snapshot(source: str | bytes) -> FAISS:
+    """
+    Rebuild a vector store from a knowledge-base snapshot without re-embedding.
+
+    Args:
+        source: Snapshot path or raw bytes (see :mod:`docuchat.core.snapshot`).
+
+    Returns:
+        A FAISS vector store using the shared embedding model for queries.
+
+    Raises:
+        ValueError: If the snapshot is corrupt or was built with a different
+            embedding model.
+    """
+    return import_snapshot(source, _get_embeddings())
 
-    return FAISS.from_documents(docs, _get_embeddings()) if docs else None
 
+def _prompt_key(messages: list) -> str:
+    """Stable hash of a message list, used to coalesce identical requests."""
+    digest = hashlib.sha256(_LLM_MODEL.encode())
+    for m in messages:
+        digest.update(f"\x00{m.type}\x00{m.content}".encode())
+    return digest.hexdigest()
 
+
+def _generate(
+    llm: ChatGroq, messages: list, on_token: Callable[[str], None] | None = None
+) -> str:
+    """
+    Stream one completion, recording time to first token and total latency.
+
+    ``on_token`` is called with each piece of the answer as it arrives.
+    """
+    parts: list[str] = []
+    t0 = time.perf_counter()
+    for chunk in llm.stream(messages):
+        if chunk.content and not parts:
+            LLM_TTFT_SECONDS.observe(time.perf_counter() - t0)
+        if chunk.content:
+            parts.append(chunk.content)
+            if on_token:
+                on_token(chunk.content)
+    LLM_SECONDS.observe(time.perf_counter() - t0)
+    return "".join(parts)
+
+
+def _chat_messages(
+    system_prompt: str,
+    context: str,
+    question: str,
+    conversation_history: list[dict] | None,
+    history_summary: str,
+) -> list:
+    """System prompt + summary of older turns + token-budgeted recent history + question."""
+    messages: list = [SystemMessage(content=system_prompt)]
+    if history_summary:
+        messages.append(
+            SystemMessage(content=f"Summary of the earlier conversation:\n{history_summary}")
+        )
+    if conversation_history:
+        _, recent = select_recent_turns(conversation_history)
+        for turn in recent:
+            if turn["role"] == "user":
+                messages.append(HumanMessage(content=turn["content"]))
+            elif turn["role"] == "assistant":
+                messages.append(AIMessage(content=turn["content"]))
+    messages.append(
+        HumanMessage(
+            content=f"Document Context:\n{context}\n\nQuestion: {question}"
+        )
+    )
+    return messages
+
+
+def _is_auth_error(e: Exception) -> bool:
+    error = str(e).lower()
+    return any(
+        token in error for token in ["401", "authentication", "invalid api key", "unauthorized"]
+    )
+
+
+def error_message(e: Exception) -> str:
+    """User-facing message for a failed answer, counted by outcome."""
+    error = str(e)
+    if _is_auth_error(e):
+        LLM_REQUESTS.labels("auth_error").inc()
+        return "Authentication failed. Please check your API key."
+    if is_rate_limit_error(e):
+        LLM_REQUESTS.labels("rate_limited").inc()
+        return "The AI service is busy right now (rate limit reached). Please try again shortly."
+    LLM_REQUESTS.labels("error").inc()
+    return f"Error: {error}"
+
+
+def is_cross_document_question(question: str) -> bool:
+    """True for questions that ask about every document rather than the best match."""
+    return bool(_CROSS_DOCUMENT_QUESTION.search(question))
+
+
+def plan_map_reduce(
+    question: str, vector_store: FAISS, config: RAGConfig | None = None
+) -> dict[str, list[Document]]:
+    """
+    Decide whether ``question`` should be answered per document, and with what.
+
+    Args:
+        question:     The user's question.
+        vector_store: FAISS index built from the uploaded documents.
+        config:       Retrieval parameters (default: :func:`get_rag_config`).
+
+    Returns:
+        Source name → that document's chunks, for the (at most
+        ``_MAP_MAX_DOCUMENTS``) best-matching documents with a chunk above
+        the score threshold. Empty when the question is not a cross-document
+        one or fewer than two documents are relevant.
+    """
+    if not is_cross_document_question(question) or isinstance(vector_store, ShardedIndex):
+        return {}
+    config = config or get_rag_config()
+    t0 = time.perf_counter()
+    per_source = retrieve_per_source(
+        vector_store,
+        question,
+        top_k=config.top_k,
+        fetch_k=config.fetch_k,
+        score_threshold=config.score_threshold,
+        lambda_mult=config.lambda_mult,
+        min_k=config.min_k,
+        gap_factor=config.gap_factor,
+    )
+    RETRIEVAL_SECONDS.observe(time.perf_counter() - t0)
+    relevant = sorted(
+        ((r.scores[0], source, r.docs) for source, r in per_source.items() if r.candidates),
+        key=lambda item: -item[0],
+    )[:_MAP_MAX_DOCUMENTS]
+    if len(relevant) < 2:
+        return {}
+    return {source: docs for _, source, docs in relevant}
+
+
+def stream_map_reduce(
+    question: str,
+    plan: dict[str, list[Document]],
+    api_key: str,
+    conversation_history: list[dict] | None = None,
+    history_summary: str = "",
+    session_id: str = "default",
+) -> Iterator[tuple[str | None, str]]:
+    """
+    Answer across documents: one concurrent call per document, then one merge.
+
+    The per-document ("map") calls use the small fast model and run
+    ``_MAP_CONCURRENCY`` at a time through the key's scheduler, so the wall
+    time is about one short call plus the final answer, not one call per
+    document. The final ("reduce") call sees only the extracted notes and
+    is streamed.
+
+    Args:
+        question: The user's question.
+        plan:     Source name → chunks, from :func:`plan_map_reduce`.
+        api_key, conversation_history, history_summary, session_id:
+                  As for :func:`get_ai_response`.
+
+    Yields:
+        ``(source, notes)`` for each document as its call finishes, then
+        ``(None, text)`` pieces of the final answer. Failures end the stream
+        with an error message, as :func:`get_ai_response` returns them.
+    """
+    try:
+        mapper = ChatGroq(
+            api_key=api_key,
+            model_name=_MAP_MODEL,
+            max_tokens=_MAP_MAX_TOKENS,
+            temperature=0.0,
+            max_retries=0,  # retries are owned by the scheduler
+        )
+        scheduler = get_scheduler(api_key)
+
+        def map_one(source: str, docs: list[Document]) -> str:
+            context = "\n\n---\n\n".join(d.page_content for d in docs)
+            messages = [
+                SystemMessage(content=_MAP_PROMPT),
+                HumanMessage(
+                    content=f"Document: {source}\n\nExcerpts:\n{context}\n\nQuestion: {question}"
+                ),
+            ]
+            return scheduler.call(
+                lambda: _generate(mapper, messages).strip(), session_id=session_id
+            )
+
+        notes: dict[str, str] = {}
+        with ThreadPoolExecutor(_MAP_CONCURRENCY, thread_name_prefix="map") as pool:
+            futures = {pool.submit(map_one, s, docs): s for s, docs in plan.items()}
+            for future in as_completed(futures):
+                source = futures[future]
+                try:
+                    notes[source] = future.result()
+                except Exception as e:
+                    if _is_auth_error(e) or is_rate_limit_error(e):
+                        raise  # every other call fails the same way
+                    notes[source] = f"(could not be read: {e})"
+                yield source, notes[source]
+
+        context = "\n\n---\n\n".join(
+            f"[Source {i}: {source}]\n{notes[source]}"
+            for i, source in enumerate(plan, 1)
+            if not notes[source].startswith(_NOT_FOUND)
+        ) or "None of the documents contain relevant information."
+        messages = _chat_messages(
+            _REDUCE_PROMPT, context, question, conversation_history, history_summary
+        )
+        llm = ChatGroq(
+            api_key=api_key,
+            model_name=_LLM_MODEL,
+            max_tokens=2048,
+            temperature=0.1,
+            max_retries=0,
+        )
+        # The merge runs on a worker so its tokens can be yielded as they arrive
+        tokens: queue.Queue = queue.Queue()
+        with ThreadPoolExecutor(1, thread_name_prefix="reduce") as pool:
+            merge = pool.submit(
+                scheduler.call,
+                lambda: _generate(llm, messages, on_token=tokens.put),
+                session_id=session_id,
+            )
+            merge.add_done_callback(lambda _: tokens.put(None))
+            while (token := tokens.get()) is not None:
+                yield None, token
+            merge.result()
+        LLM_REQUESTS.labels("ok").inc()
+    except Exception as e:
+        yield None, error_message(e)
+
+
+@profiled("answer")
 def get_ai_response(
     question: str,
     vector_store: FAISS,
     api_key: str,
     conversation_history: list[dict] | None = None,
+    history_summary: str = "",
+    session_id: str = "default",
+    config: RAGConfig | None = None,
+    summaries: list[SummaryTree] | None = None,
+    extractive: bool = False,
+    plan: dict[str, list[Document]] | None = None,
 ) -> str:
     """
     Answer a question with RAG: retrieve relevant chunks, then query the LLM.
 
     Args:
         question:             The user's question.
-        vector_store:         FAISS index built from uploaded documents.
+        vector_store:         FAISS index built from uploaded documents, or
+                              a :class:`~docuchat.core.sharding.ShardedIndex`.
         api_key:              Groq API key (``gsk_...``).
         conversation_history: List of past ``{"role": ..., "content": ...}`` dicts
-                              used to support follow-up questions.
+                              used to support follow-up questions. Only the
+                              most recent turns that fit the history token
+                              budget are sent.
+        history_summary:      Rolling summary of older turns (see
+                              :class:`~docuchat.core.history.ConversationMemory`).
+        session_id:           Caller identity used for fair queuing of LLM
+                              requests that share the same API key.
+        config:               Retrieval parameters (default:
+                              :func:`~docuchat.core.config.get_rag_config`).
+        summaries:            Summary trees of the documents (see
+                              :mod:`~docuchat.core.summaries`). Broad questions
+                              ("summarize", "compare", "main themes") are
+                              answered from them instead of retrieved chunks.
+        extractive:           Answer factual lookups with the best-matching
+                              retrieved sentence when it scores above
+                              ``config.extractive_confidence``, skipping the
+                              LLM (see :mod:`~docuchat.core.extractive`).
+        plan:                 :func:`plan_map_reduce` result if the caller
+                              already computed it (``{}``: answer from one
+                              retrieval), so the per-document search is not
+                              run twice; ``None`` plans here.
 
     Returns:
         Answer string from the LLM, or a descriptive error message.
+        Questions across several documents ("compare … in each spec") are
+        answered per document and merged (see :func:`stream_map_reduce`).
     """
     try:
-        # Step 1 — MMR retrieval for diverse, relevant chunks
-        retriever = vector_store.as_retriever(
-            search_type="mmr",
-            search_kwargs={"k": _TOP_K, "fetch_k": _FETCH_K, "lambda_mult": 0.7},
-        )
-        mmr_docs = retriever.invoke(question)
+        # Step 1 — Broad questions go to the most detailed summaries that fit
+        # one prompt, cross-document ones to a per-document map-reduce;
+        # everything else uses adaptive retrieval: score the candidate pool
+        # once, send only the chunks before the significant score drop, and
+        # MMR re-rank only when they are near-duplicates (falls back to MMR
+        # if nothing scores above the threshold)
+        selected = []
+        if summaries and is_broad_question(question):
+            selected = select_summaries(question, summaries)
+        if selected:
+            labelled = [(f"{source} · {level}", text) for source, level, text in selected]
+        else:
+            config = config or get_rag_config()
+            if plan is None:
+                plan = plan_map_reduce(question, vector_store, config)
+            if plan:
+                return "".join(
+                    text
+                    for source, text in stream_map_reduce(
+                        question, plan, api_key, conversation_history, history_summary, session_id
+                    )
+                    if source is None
+                )
+            t0 = time.perf_counter()
+            params = dict(
+                top_k=config.top_k,
+                fetch_k=config.fetch_k,
+                score_threshold=config.score_threshold,
+                lambda_mult=config.lambda_mult,
+                min_k=config.min_k,
+                gap_factor=config.gap_factor,
+            )
+            if isinstance(vector_store, ShardedIndex):
+                retrieval = vector_store.retrieve(question, **params)
+            else:
+                retrieval = retrieve(vector_store, question, **params)
+            RETRIEVAL_SECONDS.observe(time.perf_counter() - t0)
 
-        # Step 2 — Score filtering: keep only chunks above the relevance threshold
-        scored = vector_store.similarity_search_with_relevance_scores(question, k=_TOP_K)
-        good_docs = [doc for doc, score in scored if score >= _SCORE_THRESHOLD]
-        # Fall back to unfiltered MMR docs if all chunks score below threshold
-        final_docs = good_docs if good_docs else mmr_docs
+            # Factual lookups whose answer is one retrieved sentence skip the LLM
+            if extractive and vector_store.embeddings is not None:
+                quick = extract_answer(
+                    question,
+                    retrieval,
+                    vector_store.embeddings,
+                    config.extractive_confidence,
+                    follow_up=bool(history_summary) or any(
+                        turn["role"] == "assistant" for turn in conversation_history or []
+                    ),
+                )
+                if quick:
+                    EXTRACTIVE_ANSWERS.inc()
+                    return quick.render()
+            labelled = [
+                (d.metadata.get("source", "Unknown"), d.page_content) for d in retrieval.docs
+            ]
 
-        # Step 3 — Build context string with source labels
+        # Step 2 — Build context string with source labels
         context_parts = []
-        for i, doc in enumerate(final_docs, 1):
-            source = doc.metadata.get("source", "Unknown")
-            context_parts.append(f"[Source {i}: {source}]\n{doc.page_content}")
+        for i, (source, text) in enumerate(labelled, 1):
+            context_parts.append(f"[Source {i}: {source}]\n{text}")
         context = "\n\n---\n\n".join(context_parts)
 
-        # Step 4 — Build message list: system prompt + recent history + current question
-        messages: list = [SystemMessage(content=_SYSTEM_PROMPT)]
-        if conversation_history:
-            for turn in conversation_history[-(_MAX_HISTORY * 2):]:
-                if turn["role"] == "user":
-                    messages.append(HumanMessage(content=turn["content"]))
-                elif turn["role"] == "assistant":
-                    messages.append(AIMessage(content=turn["content"]))
-        messages.append(
-            HumanMessage(
-                content=f"Document Context:\n{context}\n\nQuestion: {question}"
-            )
+        # Step 3 — Build message list: system prompt + summary of older turns +
+        # token-budgeted recent history + current question
+        messages = _chat_messages(
+            _SYSTEM_PROMPT, context, question, conversation_history, history_summary
         )
 
-        # Step 5 — Generate answer
+        # Step 4 — Generate answer through the per-key scheduler (rate limiting,
+        # 429 retries, coalescing of identical in-flight prompts)
         llm = ChatGroq(
             api_key=api_key,
             model_name=_LLM_MODEL,
             max_tokens=2048,
             temperature=0.1,
+            max_retries=0,  # retries are owned by the scheduler
+        )
+        answer = get_scheduler(api_key).call(
+            lambda: _generate(llm, messages),
+            session_id=session_id,
+            key=_prompt_key(messages),
         )
-        return llm.invoke(messages).content
+        LLM_REQUESTS.labels("ok").inc()
+        return answer
 
     except Exception as e:
-        error = str(e)
-        if any(
-            token in error.lower()
-            for token in ["401", "authentication", "invalid api key", "unauthorized"]
-        ):
-            return "Authentication failed. Please check your API key."
-        return f"Error: {error}"
+        return error_message(e)
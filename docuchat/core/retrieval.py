@@ -0,0 +1,235 @@
+"""Query-adaptive retrieval: pick how many chunks to send from the score distribution.
+
+A fixed top-k sends six chunks even when the first one or two score far
+above the rest and already contain the answer. :func:`retrieve` embeds the
+query once, scores a candidate pool, and cuts the ranking at the largest
+score drop when that drop stands out from the pool's typical step. MMR
+re-ranking only runs when the chosen chunks are near-duplicates of each
+other; for already-diverse candidates it would cost time and change nothing.
+"""
+
+import statistics
+import weakref
+from dataclasses import dataclass
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from langchain_core.documents import Document
+
+from docuchat.core.quantization import QuantizedFAISS
+
+_MIN_K = 2          # never send fewer chunks than this
+_GAP_FACTOR = 3.0   # a cut needs a drop this many times the pool's median step
+_MIN_STEP = 0.005   # floor for the median step, so flat pools don't cut on noise
+_REDUNDANCY = 0.95  # cosine similarity at which two chunks count as duplicates
+
+
+@dataclass
+class Retrieval:
+    docs: list[Document]
+    scores: list[float]   # relevance in [0, 1], aligned with ``docs``
+    candidates: int       # pool chunks that cleared the score threshold
+    mmr: bool             # whether MMR re-ranking ran
+    query: np.ndarray | None = None  # the query embedding the search used
+
+
+def adaptive_k(
+    scores: list[float],
+    max_k: int,
+    min_k: int = _MIN_K,
+    gap_factor: float = _GAP_FACTOR,
+) -> int:
+    """
+    Choose k by cutting a descending score list at its most significant drop.
+
+    Args:
+        scores:     Relevance scores of the whole candidate pool, best first.
+                    Steps between all of them set the "typical" drop.
+        max_k:      Upper bound on the result (e.g. top-k or the number of
+                    candidates above the score threshold).
+        min_k:      Lower bound on the result.
+        gap_factor: How many times the median step a drop must exceed.
+
+    Returns:
+        Number of leading chunks to keep, between ``min(min_k, max_k)`` and
+        ``max_k``.
+    """
+    n = min(max_k, len(scores))
+    if n <= min_k:
+        return n
+    steps = [a - b for a, b in zip(scores, scores[1:])]
+    typical = max(statistics.median(steps), _MIN_STEP)
+    cut, drop = n, 0.0
+    for keep in range(min_k, n):
+        if steps[keep - 1] > drop:
+            cut, drop = keep, steps[keep - 1]
+    return cut if drop > gap_factor * typical else n
+
+
+def _redundant(vectors: np.ndarray, threshold: float = _REDUNDANCY) -> bool:
+    """True if any two rows are at least ``threshold`` cosine-similar."""
+    if len(vectors) < 2:
+        return False
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    sims = unit @ unit.T
+    np.fill_diagonal(sims, -1.0)
+    return bool(sims.max() >= threshold)
+
+
+def retrieve(
+    store: FAISS,
+    query: str,
+    top_k: int,
+    fetch_k: int,
+    score_threshold: float,
+    lambda_mult: float,
+    adaptive: bool = True,
+    min_k: int = _MIN_K,
+    gap_factor: float = _GAP_FACTOR,
+) -> Retrieval:
+    """
+    Retrieve context chunks for ``query``.
+
+    With ``adaptive=False`` this is the fixed policy: the top ``top_k``
+    chunks above ``score_threshold``. Either way, if nothing clears the
+    threshold the result falls back to MMR over the whole candidate pool.
+
+    Args:
+        store:           FAISS store to search.
+        query:           User question.
+        top_k:           Maximum chunks to return.
+        fetch_k:         Candidate pool size.
+        score_threshold: Minimum relevance score for a candidate.
+        lambda_mult:     MMR relevance/diversity trade-off.
+        adaptive:        Choose k per query and run MMR only on redundant
+                         candidates.
+        min_k:           Adaptive lower bound on chunks returned.
+        gap_factor:      Adaptive cut sensitivity (see :func:`adaptive_k`).
+
+    Returns:
+        The chosen chunks with their scores.
+    """
+    embedding = np.asarray([store._embed_query(query)], dtype="float32")
+    return _retrieve_vector(
+        store, embedding, top_k, fetch_k, score_threshold, lambda_mult, adaptive, min_k, gap_factor
+    )
+
+
+def _retrieve_vector(
+    store: FAISS,
+    embedding: np.ndarray,
+    top_k: int,
+    fetch_k: int,
+    score_threshold: float,
+    lambda_mult: float,
+    adaptive: bool = True,
+    min_k: int = _MIN_K,
+    gap_factor: float = _GAP_FACTOR,
+    positions: np.ndarray | None = None,
+) -> Retrieval:
+    """:func:`retrieve` for an embedded query, optionally over a subset of index positions."""
+    params = None
+    if positions is not None:
+        fetch_k = min(fetch_k, len(positions))
+        params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(positions))
+    fetch_k = min(fetch_k, store.index.ntotal)
+    if fetch_k <= 0:
+        return Retrieval([], [], 0, False, embedding[0])
+    if isinstance(store, QuantizedFAISS):
+        distances, indices = store.rescored_search(embedding, fetch_k, params)
+    else:
+        distances, indices = store.index.search(embedding, fetch_k, params=params)
+    to_relevance = store._select_relevance_score_fn()
+    pool = [(int(i), to_relevance(float(d))) for d, i in zip(distances[0], indices[0]) if i != -1]
+    good = [(i, s) for i, s in pool if s >= score_threshold]
+
+    mmr = not good
+    if not good:
+        chosen = _mmr(store, embedding, pool, top_k, lambda_mult)
+    elif not adaptive:
+        chosen = good[:top_k]
+    else:
+        k = adaptive_k([s for _, s in pool], min(top_k, len(good)), min_k, gap_factor)
+        chosen = good[:k]
+        if _redundant(_vectors(store, chosen)):
+            chosen = _mmr(store, embedding, good, k, lambda_mult)
+            mmr = True
+
+    docs = [store.docstore.search(store.index_to_docstore_id[i]) for i, _ in chosen]
+    return Retrieval(docs, [s for _, s in chosen], len(good), mmr, embedding[0])
+
+
+# store -> (id mapping and ntotal it was computed from, source -> index positions);
+# FAISS.delete replaces the mapping, adding grows ntotal
+_positions_cache: "weakref.WeakKeyDictionary[FAISS, tuple[dict, int, dict[str, np.ndarray]]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def source_positions(store: FAISS) -> dict[str, np.ndarray]:
+    """Index positions of each source document's chunks, in first-seen order."""
+    mapping, ntotal = store.index_to_docstore_id, store.index.ntotal
+    cached = _positions_cache.get(store)
+    if cached is not None and cached[0] is mapping and cached[1] == ntotal:
+        return cached[2]
+    grouped: dict[str, list[int]] = {}
+    for position, doc_id in mapping.items():
+        doc = store.docstore.search(doc_id)
+        source = doc.metadata.get("source", "Unknown") if hasattr(doc, "metadata") else "Unknown"
+        grouped.setdefault(source, []).append(position)
+    positions = {s: np.asarray(p, dtype="int64") for s, p in grouped.items()}
+    _positions_cache[store] = (mapping, ntotal, positions)
+    return positions
+
+
+def retrieve_per_source(
+    store: FAISS,
+    query: str,
+    top_k: int,
+    fetch_k: int,
+    score_threshold: float,
+    lambda_mult: float,
+    min_k: int = _MIN_K,
+    gap_factor: float = _GAP_FACTOR,
+) -> dict[str, Retrieval]:
+    """
+    Adaptive retrieval run separately within each source document.
+
+    A global top-k can fill up with chunks from one or two files; this gives
+    every document its own ranking. The query is embedded once and each
+    search is restricted to that document's chunks.
+
+    Returns:
+        Source name → retrieval, for every document in the store.
+    """
+    embedding = np.asarray([store._embed_query(query)], dtype="float32")
+    return {
+        source: _retrieve_vector(
+            store, embedding, top_k, fetch_k, score_threshold, lambda_mult,
+            min_k=min_k, gap_factor=gap_factor, positions=positions,
+        )
+        for source, positions in source_positions(store).items()
+    }
+
+
+def _vectors(store: FAISS, candidates: list[tuple[int, float]]) -> np.ndarray:
+    if isinstance(store, QuantizedFAISS):
+        return np.asarray(store.exact.array[[i for i, _ in candidates]])
+    return np.vstack([store.index.reconstruct(i) for i, _ in candidates])
+
+
+def _mmr(
+    store: FAISS,
+    embedding: np.ndarray,
+    candidates: list[tuple[int, float]],
+    k: int,
+    lambda_mult: float,
+) -> list[tuple[int, float]]:
+    if not candidates:
+        return []
+    picked = maximal_marginal_relevance(
+        embedding, list(_vectors(store, candidates)), k=k, lambda_mult=lambda_mult
+    )
+    return [candidates[j] for j in picked]
@@ -0,0 +1,212 @@
+"""Rate-limit-aware scheduling of LLM calls, shared per API key.
+
+Every Groq request goes through an :class:`LLMScheduler` that
+
+- admits calls through a token bucket sized to the provider's rate limit,
+- retries 429 responses with jittered exponential backoff, honouring
+  ``Retry-After`` by pausing the whole bucket,
+- coalesces identical in-flight prompts into a single request, and
+- serves waiting sessions round-robin, so one busy session cannot starve
+  the others.
+"""
+
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from email.utils import parsedate_to_datetime
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+_RATE_PER_MINUTE = 30   # Groq free-tier request limit per key
+_BURST = 5              # requests allowed back-to-back before throttling
+_MAX_CONCURRENCY = 4    # simultaneous in-flight requests per key
+_MAX_RETRIES = 4        # retries after a rate-limit response
+_BACKOFF_BASE = 1.0     # seconds; doubled on each attempt
+_BACKOFF_MAX = 30.0     # cap for a single backoff sleep
+_RATE_LIMIT_MESSAGE = re.compile(
+    r"\brate[ _-]?limit|\btoo many requests\b|\b(?:error code|status(?: code)?|http)[: ]+429\b",
+    re.IGNORECASE,
+)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    Return True if ``error`` is an HTTP 429 / rate-limit failure: by its
+    status code (groq's ``RateLimitError``), else by a rate-limit phrase or
+    a 429 status in its message (not any "429" such as a request id).
+    """
+    if getattr(error, "status_code", None) == 429:
+        return True
+    return bool(_RATE_LIMIT_MESSAGE.search(str(error)))
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    """Read the ``Retry-After`` header (seconds or HTTP date) from an error."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _TokenBucket:
+    """Classic token bucket; callers must hold the scheduler lock."""
+
+    def __init__(self, rate_per_second: float, capacity: int):
+        self._rate = rate_per_second
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """Take a token and return 0, or return the seconds until one is free."""
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self._rate
+
+
+class LLMScheduler:
+    """Admission control, retries and request coalescing for one API key."""
+
+    def __init__(
+        self,
+        rate_per_minute: float = _RATE_PER_MINUTE,
+        burst: int = _BURST,
+        max_concurrency: int = _MAX_CONCURRENCY,
+        max_retries: int = _MAX_RETRIES,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self._bucket = _TokenBucket(rate_per_minute / 60.0, burst)
+        self._max_concurrency = max_concurrency
+        self._max_retries = max_retries
+        self._sleep = sleep
+        self._cond = threading.Condition()
+        self._queues: dict[str, deque] = {}  # session -> waiting tickets (FIFO)
+        self._ring: deque[str] = deque()     # sessions with waiters, in service order
+        self._active = 0
+        self._paused_until = 0.0
+        self._inflight: dict[str, Future] = {}
+
+    def call(self, fn: Callable[[], T], session_id: str = "default", key: str | None = None) -> T:
+        """
+        Run ``fn`` once admitted, retrying on rate-limit errors.
+
+        Args:
+            fn:         Zero-argument callable performing the LLM request.
+            session_id: Caller identity used for fair queuing.
+            key:        Optional coalescing key; concurrent calls with the same
+                        key share the first caller's result.
+
+        Returns:
+            Whatever ``fn`` returns. The last error is re-raised if all
+            retries fail or the error is not a rate limit.
+        """
+        if key is None:
+            return self._call_with_retries(fn, session_id)
+
+        with self._cond:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = self._call_with_retries(fn, session_id)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._cond:
+                self._inflight.pop(key, None)
+
+    def _call_with_retries(self, fn: Callable[[], T], session_id: str) -> T:
+        for attempt in range(self._max_retries + 1):
+            self._acquire(session_id)
+            try:
+                return fn()
+            except Exception as e:
+                if attempt == self._max_retries or not is_rate_limit_error(e):
+                    raise
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = random.uniform(0, min(_BACKOFF_MAX, _BACKOFF_BASE * 2**attempt))
+                else:
+                    # The provider told us when to come back: hold every caller
+                    with self._cond:
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                        self._cond.notify_all()
+                    delay = 0.0
+            finally:
+                self._release()
+            if delay:
+                self._sleep(delay)
+        raise AssertionError("unreachable")
+
+    def _acquire(self, session_id: str) -> None:
+        ticket = object()
+        with self._cond:
+            queue = self._queues.setdefault(session_id, deque())
+            if not queue:
+                self._ring.append(session_id)
+            queue.append(ticket)
+            while True:
+                if (
+                    self._ring[0] == session_id
+                    and queue[0] is ticket
+                    and self._active < self._max_concurrency
+                ):
+                    wait = max(0.0, self._paused_until - time.monotonic())
+                    if not wait:
+                        wait = self._bucket.try_acquire()
+                    if not wait:
+                        break
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+            queue.popleft()
+            self._ring.popleft()
+            if queue:
+                self._ring.append(session_id)  # back of the line for its next request
+            else:
+                del self._queues[session_id]
+            self._active += 1
+            self._cond.notify_all()
+
+    def _release(self) -> None:
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+
+_SCHEDULERS: dict[str, LLMScheduler] = {}
+_SCHEDULERS_LOCK = threading.Lock()
+
+
+def get_scheduler(api_key: str) -> LLMScheduler:
+    """Return the process-wide scheduler for ``api_key`` (keyed by its hash)."""
+    digest = hashlib.sha256(api_key.encode()).hexdigest()
+    with _SCHEDULERS_LOCK:
+        if digest not in _SCHEDULERS:
+            _SCHEDULERS[digest] = LLMScheduler()
+        return _SCHEDULERS[digest]
@@ -0,0 +1,372 @@
+"""Sharded knowledge bases: index shards in worker processes, scatter-gather search.
+
+One FAISS index in one process caps both the corpus (it must fit one
+address space and one FAISS search) and query concurrency (searches share
+that process's cores). A sharded knowledge base splits the ingested files
+across ``N`` shards by a stable hash of their path. Each shard is an
+ordinary :class:`~docuchat.core.ingest.KnowledgeBase` directory, so it can
+be re-ingested on its own (``docuchat ingest --shards N --shard I``).
+
+:class:`ShardedIndex` serves one worker process per shard. A query is
+embedded once by the coordinator and fanned out to every shard. The
+shards' candidates are merged by score, cut with :func:`adaptive_k`, and
+MMR picks the final chunks from the merged set, so near-duplicates from
+different shards do not crowd each other out. A shard that misses the
+timeout or fails is left out of that answer instead of failing it.
+
+Each shard has a single worker, so a search that overruns the timeout
+would hold up every later query to that shard. Such a shard is skipped
+(reason ``busy``) until the search returns, and its process is replaced
+if it stays stuck. A crashed shard is restarted with exponential backoff,
+so an index that cannot load is not re-spawned on every query.
+"""
+
+import glob
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from docuchat.core.metrics import SHARD_FAILURES
+from docuchat.core.retrieval import _GAP_FACTOR, _MIN_K, Retrieval, adaptive_k
+
+_SHARD_TIMEOUT = 2.0         # seconds a query waits for the slowest shard
+_STALL_RESTART = 30.0        # seconds a search may overrun before its process is replaced
+_RESTART_BACKOFF_BASE = 1.0  # seconds before retrying a failed restart; doubled each time
+_RESTART_BACKOFF_MAX = 60.0  # cap for the wait between restart attempts
+_SHARD_DIR = re.compile(r"shard-(\d+)-of-(\d+)$")
+
+
+def shard_of(path: str, shards: int) -> int:
+    """Shard a file belongs to: a stable hash of its relative path, so edits stay put."""
+    digest = hashlib.sha256(path.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little") % shards
+
+
+def shard_directory(kb_dir: str, shard: int, shards: int) -> str:
+    return os.path.join(kb_dir, f"shard-{shard:02d}-of-{shards:02d}")
+
+
+def shard_count(kb_dir: str) -> int:
+    """
+    Number of shards of a sharded knowledge base (0 if it is not sharded).
+
+    Raises:
+        ValueError: If shard directories of different layouts are mixed.
+    """
+    counts = {
+        int(m.group(2))
+        for path in glob.glob(os.path.join(kb_dir, "shard-*-of-*"))
+        if (m := _SHARD_DIR.search(path))
+    }
+    if len(counts) > 1:
+        raise ValueError(
+            f"{kb_dir} mixes shard layouts ({', '.join(map(str, sorted(counts)))} shards); "
+            "re-ingest it with one --shards value"
+        )
+    return counts.pop() if counts else 0
+
+
+@dataclass
+class ShardedRetrieval(Retrieval):
+    missing: list[int] = field(default_factory=list)  # shards that timed out or failed
+
+
+class _SearchOnly(Embeddings):
+    """Placeholder model for shard workers: queries arrive already embedded."""
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        raise RuntimeError("shard workers search by vector; embed in the coordinator")
+
+    def embed_query(self, text: str) -> list[float]:
+        raise RuntimeError("shard workers search by vector; embed in the coordinator")
+
+
+# ---------------------------------------------------------------------------
+# Worker-side state: one shard's store per process, loaded by the initializer
+# ---------------------------------------------------------------------------
+_shard_store: FAISS | None = None
+
+
+def _init_shard(index_dir: str, threads: int) -> None:
+    global _shard_store
+    faiss.omp_set_num_threads(threads)  # split cores between shards, don't oversubscribe
+    if os.path.exists(index_dir):
+        _shard_store = FAISS.load_local(
+            index_dir, _SearchOnly(), allow_dangerous_deserialization=True
+        )
+
+
+def _shard_size() -> int:
+    return _shard_store.index.ntotal if _shard_store is not None else 0
+
+
+def _search_shard(embedding: np.ndarray, fetch_k: int) -> list[tuple[float, Document, np.ndarray]]:
+    """Worker: the shard's best ``fetch_k`` chunks as ``(relevance, document, vector)``."""
+    store = _shard_store
+    if store is None or store.index.ntotal == 0:
+        return []
+    distances, indices = store.index.search(embedding, min(fetch_k, store.index.ntotal))
+    to_relevance = store._select_relevance_score_fn()
+    return [
+        (
+            to_relevance(float(d)),
+            store.docstore.search(store.index_to_docstore_id[int(i)]),
+            store.index.reconstruct(int(i)),
+        )
+        for d, i in zip(distances[0], indices[0])
+        if i != -1
+    ]
+
+
+def _terminate(processes: list[multiprocessing.Process]) -> None:
+    """Kill shard processes stuck in a search (``shutdown()`` only waits for them)."""
+    for process in processes:
+        process.terminate()
+
+
+class ShardedIndex:
+    """
+    Coordinator for a sharded knowledge base: one search process per shard.
+
+    Accepted wherever the RAG pipeline takes a vector store for retrieval
+    (:func:`~docuchat.core.rag.get_ai_response`); map-reduce answering
+    needs a single store and is skipped.
+    """
+
+    def __init__(
+        self,
+        kb_dir: str,
+        embeddings: Embeddings,
+        timeout: float = _SHARD_TIMEOUT,
+        threads: int | None = None,
+    ):
+        """
+        Start one process per shard and wait until each has loaded its index.
+
+        Args:
+            kb_dir:     Knowledge base built with ``docuchat ingest --shards N``.
+            embeddings: Model the shards were built with; embeds queries.
+            timeout:    Seconds a query waits for the slowest shard.
+            threads:    FAISS threads per shard process (default: cores / shards).
+
+        Raises:
+            ValueError: If ``kb_dir`` holds no sharded knowledge base.
+        """
+        self.kb_dir = kb_dir
+        self.embeddings = embeddings
+        self.timeout = timeout
+        self.shards = shard_count(kb_dir)
+        if not self.shards:
+            raise ValueError(f"{kb_dir} is not a sharded knowledge base")
+        self._threads = threads or max(1, (os.cpu_count() or 1) // self.shards)
+        self._lock = threading.Lock()
+        self._reloading: set[int] = set()
+        self._stalled: dict[int, float] = {}         # shard -> when a search overran
+        self._restart_failures: dict[int, int] = {}  # shard -> failed restarts in a row
+        self._retry_at: dict[int, float] = {}        # shard -> earliest next restart
+        started = [self._start(shard) for shard in range(self.shards)]
+        self.sizes = [loaded.result() for _, loaded in started]  # chunks per shard
+        self._executors = [executor for executor, _ in started]
+
+    def _start(self, shard: int) -> tuple[ProcessPoolExecutor, Future]:
+        """Spawn a shard's process; the future resolves once its index is loaded."""
+        index_dir = os.path.join(shard_directory(self.kb_dir, shard, self.shards), "index")
+        executor = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_shard,
+            initargs=(index_dir, self._threads),
+        )
+        return executor, executor.submit(_shard_size)
+
+    def reload(self, shard: int) -> None:
+        """
+        Serve one shard's re-ingested index.
+
+        The old process keeps answering until the new one has loaded, so
+        queries never see the shard missing during a rebuild.
+        """
+        self._replace(shard)
+
+    def _replace(self, shard: int, terminate: bool = False) -> None:
+        """Swap in a freshly loaded process; ``terminate`` kills the old one."""
+        executor, loaded = self._start(shard)
+        try:
+            size = loaded.result()
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        with self._lock:
+            old, self._executors[shard] = self._executors[shard], executor
+            self.sizes[shard] = size
+            self._stalled.pop(shard, None)
+            self._restart_failures.pop(shard, None)
+            self._retry_at.pop(shard, None)
+        # The pool forgets its processes on shutdown(), so collect them first
+        processes = list((getattr(old, "_processes", None) or {}).values())
+        old.shutdown(wait=False, cancel_futures=True)
+        if terminate:
+            _terminate(processes)
+
+    def _restart(self, shard: int, terminate: bool = False) -> None:
+        """
+        Replace a crashed or stuck shard process in the background (once at
+        a time). After a failed attempt, e.g. an index that no longer loads,
+        the next one waits ``_RESTART_BACKOFF_BASE`` seconds, doubled per
+        failure up to ``_RESTART_BACKOFF_MAX``.
+        """
+        with self._lock:
+            if shard in self._reloading or time.monotonic() < self._retry_at.get(shard, 0.0):
+                return
+            self._reloading.add(shard)
+
+        def run() -> None:
+            try:
+                self._replace(shard, terminate)
+            except Exception:
+                with self._lock:
+                    failures = self._restart_failures.get(shard, 0) + 1
+                    self._restart_failures[shard] = failures
+                    self._retry_at[shard] = time.monotonic() + min(
+                        _RESTART_BACKOFF_BASE * 2 ** (failures - 1), _RESTART_BACKOFF_MAX
+                    )
+            finally:
+                with self._lock:
+                    self._reloading.discard(shard)
+
+        threading.Thread(target=run, name=f"docuchat-shard-{shard}", daemon=True).start()
+
+    def _stall(self, shard: int, executor: ProcessPoolExecutor, future: Future) -> None:
+        """Skip a shard whose only worker is still running a timed-out search."""
+        with self._lock:
+            self._stalled.setdefault(shard, time.monotonic())
+
+        def unstall(_: Future) -> None:
+            with self._lock:
+                if self._executors[shard] is executor:
+                    self._stalled.pop(shard, None)
+
+        future.add_done_callback(unstall)
+
+    def search(
+        self, embedding: np.ndarray, fetch_k: int
+    ) -> tuple[list[tuple[float, Document, np.ndarray]], list[int]]:
+        """
+        Scatter one embedded query to every shard and gather the answers.
+
+        Returns:
+            ``(candidates, missing)``: every answering shard's candidates,
+            best first, and the shards that timed out or failed.
+        """
+        with self._lock:
+            executors = list(self._executors)
+            stalled = dict(self._stalled)
+        futures: dict[Future, int] = {}
+        missing = []
+        for shard, executor in enumerate(executors):
+            if shard in stalled:
+                # Queued behind the overrunning search it would time out too
+                missing.append(shard)
+                SHARD_FAILURES.labels(str(shard), "busy").inc()
+                if time.monotonic() - stalled[shard] > _STALL_RESTART:
+                    self._restart(shard, terminate=True)
+                continue
+            try:
+                futures[executor.submit(_search_shard, embedding, fetch_k)] = shard
+            except (BrokenProcessPool, RuntimeError) as e:  # RuntimeError: being reloaded
+                missing.append(shard)
+                SHARD_FAILURES.labels(str(shard), "error").inc()
+                if isinstance(e, BrokenProcessPool):
+                    self._restart(shard)
+        done, _ = wait(futures, timeout=self.timeout)
+
+        candidates = []
+        for future, shard in futures.items():
+            if future not in done:
+                missing.append(shard)
+                SHARD_FAILURES.labels(str(shard), "timeout").inc()
+                if not future.cancel():  # already running: the worker is busy until it returns
+                    self._stall(shard, executors[shard], future)
+                continue
+            try:
+                candidates.extend(future.result())
+            except BrokenProcessPool:
+                missing.append(shard)
+                SHARD_FAILURES.labels(str(shard), "error").inc()
+                self._restart(shard)  # the worker died: serve the shard again soon
+            except Exception:
+                missing.append(shard)
+                SHARD_FAILURES.labels(str(shard), "error").inc()
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        return candidates, sorted(missing)
+
+    def retrieve(
+        self,
+        query: str,
+        top_k: int,
+        fetch_k: int,
+        score_threshold: float,
+        lambda_mult: float,
+        min_k: int = _MIN_K,
+        gap_factor: float = _GAP_FACTOR,
+    ) -> ShardedRetrieval:
+        """
+        Retrieve context chunks across all shards.
+
+        Each shard returns its own top ``fetch_k``; the merged pool is cut
+        where :func:`adaptive_k` finds the score gap and MMR picks that
+        many chunks from the candidates above ``score_threshold`` (from the
+        whole pool if none clear it). Arguments are those of
+        :func:`~docuchat.core.retrieval.retrieve`.
+        """
+        embedding = np.asarray([self.embeddings.embed_query(query)], dtype="float32")
+        return self.retrieve_vector(
+            embedding, top_k, fetch_k, score_threshold, lambda_mult, min_k, gap_factor
+        )
+
+    def retrieve_vector(
+        self,
+        embedding: np.ndarray,
+        top_k: int,
+        fetch_k: int,
+        score_threshold: float,
+        lambda_mult: float,
+        min_k: int = _MIN_K,
+        gap_factor: float = _GAP_FACTOR,
+    ) -> ShardedRetrieval:
+        """:meth:`retrieve` for an already embedded query."""
+        pool, missing = self.search(embedding, fetch_k)
+        pool = pool[:fetch_k]
+        good = [c for c in pool if c[0] >= score_threshold]
+        candidates = good or pool
+        if not candidates:
+            return ShardedRetrieval([], [], 0, False, embedding[0], missing)
+        k = (
+            adaptive_k([c[0] for c in pool], min(top_k, len(good)), min_k, gap_factor)
+            if good else min(top_k, len(pool))
+        )
+        picked = maximal_marginal_relevance(
+            embedding, [c[2] for c in candidates], k=k, lambda_mult=lambda_mult
+        )
+        chosen = [candidates[j] for j in picked]
+        return ShardedRetrieval(
+            [c[1] for c in chosen], [c[0] for c in chosen], len(good), True, embedding[0], missing
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            for executor in self._executors:
+                executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,203 @@
+"""Portable single-file knowledge-base snapshots.
+
+A snapshot carries everything needed to serve a knowledge base without
+re-embedding: the vectors, chunk texts, metadata and the identity of the
+embedding model that produced them.
+
+Layout (all integers little-endian)::
+
+    b"DCKB" | version:u16 | flags:u16 | header_len:u32 | header (JSON)
+    vectors (count × dim × itemsize) | chunks (zlib-compressed JSON)
+    sha256 of everything above (32 bytes)
+"""
+
+import hashlib
+import io
+import json
+import os
+import struct
+import tempfile
+import uuid
+import zlib
+from typing import BinaryIO
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from docuchat.core.embeddings import embedding_model_id
+from docuchat.core.quantization import full_precision_vectors
+
+MAGIC = b"DCKB"
+FORMAT_VERSION = 1
+_PREAMBLE = struct.Struct("<4sHHI")
+_DIGEST_SIZE = 32
+_DTYPES = {"float16": np.dtype("<f2"), "float32": np.dtype("<f4")}
+
+
+class _HashingWriter:
+    """File wrapper that hashes everything written through it."""
+
+    def __init__(self, f: BinaryIO):
+        self._f = f
+        self.digest = hashlib.sha256()
+
+    def write(self, data) -> None:
+        self.digest.update(data)
+        self._f.write(data)
+
+
+def export_snapshot(store: FAISS, dest: str | BinaryIO, float16: bool = False) -> None:
+    """
+    Write ``store`` as a snapshot.
+
+    Args:
+        store:   FAISS store built with the current embedding backend.
+        dest:    Output path (written atomically) or a binary file object.
+        float16: Store vectors at half precision (half the vector bytes,
+                 with a negligible effect on similarity scores).
+    """
+    if isinstance(dest, str):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dest)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                export_snapshot(store, f, float16)
+            os.replace(tmp, dest)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return
+
+    index = store.index
+    count, dim = index.ntotal, index.d
+    vectors = full_precision_vectors(store).astype("<f2" if float16 else "<f4")
+
+    docs = [store.docstore.search(store.index_to_docstore_id[i]) for i in range(count)]
+    chunks = zlib.compress(
+        json.dumps([[d.page_content, d.metadata] for d in docs]).encode("utf-8")
+    )
+    header = json.dumps(
+        {
+            "model": embedding_model_id(),
+            "dim": dim,
+            "count": count,
+            "dtype": "float16" if float16 else "float32",
+            "chunks_bytes": len(chunks),
+        }
+    ).encode("utf-8")
+
+    out = _HashingWriter(dest)
+    out.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, 0, len(header)))
+    out.write(header)
+    out.write(vectors.tobytes())
+    out.write(chunks)
+    dest.write(out.digest.digest())
+
+
+def read_snapshot_header(data: bytes) -> dict:
+    """
+    Validate magic, version, checksum and the header's fields; return the
+    parsed header.
+
+    Raises:
+        ValueError: If any of them is wrong, or the sections the header
+            describes do not add up to the file's size.
+    """
+    if len(data) < _PREAMBLE.size + _DIGEST_SIZE:
+        raise ValueError("Not a DocuChat snapshot (file too short)")
+    magic, version, _flags, header_len = _PREAMBLE.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a DocuChat snapshot (bad magic)")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {version} (expected {FORMAT_VERSION})")
+    body, digest = data[:-_DIGEST_SIZE], data[-_DIGEST_SIZE:]
+    if hashlib.sha256(body).digest() != digest:
+        raise ValueError("Snapshot checksum mismatch (file is corrupt or truncated)")
+    start = _PREAMBLE.size
+    header = json.loads(bytes(data[start:start + header_len]))
+    if not isinstance(header, dict):
+        raise ValueError("Malformed snapshot header (not a JSON object)")
+    for key, kind in (("model", str), ("dim", int), ("count", int), ("chunks_bytes", int)):
+        if type(header.get(key)) is not kind:  # not isinstance: bools are ints
+            raise ValueError(f"Malformed snapshot header (missing or invalid '{key}')")
+    if header.get("dtype") not in _DTYPES:
+        raise ValueError(f"Malformed snapshot header (unknown dtype {header.get('dtype')!r})")
+    if header["dim"] <= 0 or header["count"] < 0 or header["chunks_bytes"] < 0:
+        raise ValueError("Malformed snapshot header (negative or zero sizes)")
+    vec_bytes = header["count"] * header["dim"] * _DTYPES[header["dtype"]].itemsize
+    if start + header_len + vec_bytes + header["chunks_bytes"] != len(body):
+        raise ValueError("Malformed snapshot (section sizes do not match the file size)")
+    return header
+
+
+def import_snapshot(source: str | bytes, embeddings: Embeddings) -> FAISS:
+    """
+    Rebuild a FAISS store from a snapshot without re-embedding anything.
+
+    Args:
+        source:     Snapshot path or its raw bytes.
+        embeddings: Embedding backend used for future queries; it must be
+                    the same model the snapshot was built with.
+
+    Returns:
+        A FAISS store equivalent to the exported one.
+
+    Raises:
+        ValueError: If the file is malformed, corrupt, from another format
+            version, or was built with a different embedding model.
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            source = f.read()
+    data = memoryview(source)
+    header = read_snapshot_header(data)
+    if header["model"] != embedding_model_id():
+        raise ValueError(
+            f"Snapshot was built with embedding model '{header['model']}', "
+            f"but this instance uses '{embedding_model_id()}'"
+        )
+
+    count, dim = header["count"], header["dim"]
+    dtype = _DTYPES[header["dtype"]]
+    offset = _PREAMBLE.size + _PREAMBLE.unpack_from(data)[3]
+    vec_bytes = count * dim * dtype.itemsize
+    vectors = np.frombuffer(data, dtype, count * dim, offset).reshape(count, dim)
+    offset += vec_bytes
+    try:
+        chunks = json.loads(zlib.decompress(data[offset:offset + header["chunks_bytes"]]))
+    except zlib.error as e:
+        raise ValueError(f"Malformed snapshot chunks ({e})") from None
+    if not isinstance(chunks, list) or len(chunks) != count:
+        raise ValueError(
+            f"Malformed snapshot ({count} vectors but "
+            f"{len(chunks) if isinstance(chunks, list) else 'no'} chunks)"
+        )
+    if not all(
+        isinstance(c, list) and len(c) == 2 and isinstance(c[0], str) and isinstance(c[1], dict)
+        for c in chunks
+    ):
+        raise ValueError("Malformed snapshot chunks (expected [text, metadata] pairs)")
+
+    index = faiss.IndexFlatL2(dim)
+    if count:
+        index.add(np.ascontiguousarray(vectors, dtype="float32"))
+    ids = [str(uuid.uuid4()) for _ in range(count)]
+    docstore = InMemoryDocstore(
+        {doc_id: Document(page_content=text, metadata=meta) for doc_id, (text, meta) in zip(ids, chunks)}
+    )
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=dict(enumerate(ids)),
+    )
+
+
+def snapshot_bytes(store: FAISS, float16: bool = False) -> bytes:
+    """Serialize ``store`` to an in-memory snapshot (for downloads)."""
+    buf = io.BytesIO()
+    export_snapshot(store, buf, float16)
+    return buf.getvalue()
@@ -0,0 +1,333 @@
+"""Hierarchical summaries for broad questions ("summarize", "compare", "main themes").
+
+Retrieval sends at most ``top_k`` chunks to the LLM, which cannot answer a
+question about a whole document. A summary tree is built once per document:
+consecutive stretches of text are summarized (chunk level), groups of those
+are merged (section level) and merged again until one summary is left
+(document level). Calls run in parallel through the per-key scheduler and
+every node is cached by a hash of its input, so unchanged documents, renamed
+copies and shared passages are never summarized twice.
+
+A broad question is answered from the most detailed level of the trees that
+still fits one bounded prompt (see :func:`select_summaries`).
+"""
+
+import hashlib
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_groq import ChatGroq
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from docuchat.core.cache import ExtractionCache, cache_budget_mb, cache_root
+from docuchat.core.history import estimate_tokens, truncate_to_tokens
+from docuchat.core.scheduler import get_scheduler
+
+_SUMMARY_MODEL = "llama-3.1-8b-instant"  # summaries don't need the 70B model
+_LEAF_CHARS = 6000            # source characters per chunk-level summary
+_FANOUT = 6                   # child summaries merged into one parent
+_NODE_MAX_TOKENS = 250        # ceiling on each summary
+_MAX_PARALLEL = 4             # concurrent LLM calls while building trees
+_CONTEXT_TOKEN_BUDGET = 3000  # summaries sent with one broad question
+_SUMMARY_CACHE_MAX_MB = 64
+_PROMPT_VERSION = 1           # bump when the prompts change, to invalidate cached summaries
+
+_LEAF_PROMPT = (
+    "Summarize this passage of a document. Keep names, figures, dates, "
+    "decisions and conclusions; drop examples and repetition. Reply with the "
+    f"summary only, at most {_NODE_MAX_TOKENS * 3 // 4} words."
+)
+_MERGE_PROMPT = (
+    "These are summaries of consecutive parts of one document. Merge them into "
+    "a single summary of the whole that keeps the main themes, key facts and "
+    "figures, in document order. Reply with the summary only, at most "
+    f"{_NODE_MAX_TOKENS * 3 // 4} words."
+)
+
+_BROAD_QUESTION = re.compile(
+    r"\b(summari[sz]e|summary|overview|outline|gist|tl;?dr|"
+    r"main (themes?|points?|ideas?|topics?|findings|takeaways?)|"
+    r"key (themes|points|ideas|findings|takeaways)|"
+    r"what (is|are) (this|these|the) (documents?|files?|papers?|reports?) about|"
+    r"compare|comparison|differences? between|similarities)\b",
+    re.IGNORECASE,
+)
+
+# (instruction, text) -> summary; LLMSummarizer is the real one
+Summarizer = Callable[[str, str], str]
+
+
+class LLMSummarizer:
+    """Summarizes through the Groq API, queued on the key's fair scheduler."""
+
+    def __init__(self, api_key: str, model: str = _SUMMARY_MODEL):
+        self.model = model
+        self._api_key = api_key
+        self._llm = ChatGroq(
+            api_key=api_key,
+            model_name=model,
+            max_tokens=_NODE_MAX_TOKENS,
+            temperature=0.0,
+            max_retries=0,  # retries are owned by the scheduler
+        )
+
+    def __call__(self, instruction: str, text: str) -> str:
+        messages = [SystemMessage(content=instruction), HumanMessage(content=text)]
+        reply = get_scheduler(self._api_key).call(
+            lambda: self._llm.invoke(messages), session_id="__summary_tree__"
+        )
+        return reply.content.strip()
+
+
+@dataclass
+class SummaryTree:
+    source: str
+    levels: list[list[str]]  # levels[0]: chunk summaries … levels[-1]: [document summary]
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.levels)  # false while the tree is still being built
+
+    @property
+    def summary(self) -> str:
+        return self.levels[-1][0]
+
+    def level_name(self, depth: int) -> str:
+        if depth == len(self.levels) - 1:
+            return "document summary"
+        return "chunk summary" if depth == 0 else "section summary"
+
+
+_cache: ExtractionCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_summary_cache() -> ExtractionCache | None:
+    """
+    Return the process-wide summary cache.
+
+    Stored under ``$DOCUCHAT_CACHE_DIR/summaries`` with the same LRU store
+    as extractions; ``DOCUCHAT_CACHE_MAX_MB=0`` or an unwritable cache
+    directory disables it (returns ``None``).
+    """
+    global _cache
+    if cache_budget_mb() <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = ExtractionCache(
+                    os.path.join(cache_root(), "summaries"), _SUMMARY_CACHE_MAX_MB * 1024 * 1024
+                )
+            except OSError:
+                return None
+        return _cache
+
+
+def _summarize_node(
+    instruction: str, text: str, summarize: Summarizer, cache: ExtractionCache | None
+) -> str:
+    """One summary, served from the cache when this exact input was seen before."""
+    model = getattr(summarize, "model", "")
+    digest = hashlib.sha256(f"{_PROMPT_VERSION}\x00{model}\x00{instruction}\x00{text}".encode())
+    key = f"summary-{digest.hexdigest()}"
+    if cache is not None:
+        entry = cache.get(key)
+        if entry is not None:
+            return entry["text"]
+    summary = truncate_to_tokens(summarize(instruction, text), _NODE_MAX_TOKENS)
+    if cache is not None:
+        cache.put(key, summary)
+    return summary
+
+
+def build_summary_trees(
+    documents: dict[str, str],
+    summarize: Summarizer,
+    cache: ExtractionCache | None = None,
+    max_workers: int = _MAX_PARALLEL,
+) -> dict[str, SummaryTree]:
+    """
+    Build a summary tree for every document, level by level.
+
+    All nodes of one level, across all documents, are summarized in
+    parallel, so a large upload takes as many rounds as its tallest tree
+    rather than one call after another.
+
+    Args:
+        documents:   Source name → extracted text. Empty texts are skipped.
+        summarize:   ``(instruction, text) -> summary``, e.g. :class:`LLMSummarizer`.
+        cache:       Node cache (default: :func:`get_summary_cache`).
+        max_workers: Concurrent summarizer calls.
+
+    Returns:
+        Source name → tree, for the non-empty documents.
+    """
+    cache = cache if cache is not None else get_summary_cache()
+    splitter = RecursiveCharacterTextSplitter(chunk_size=_LEAF_CHARS, chunk_overlap=0)
+    pending = {
+        source: [c.page_content for c in splitter.create_documents([text])]
+        for source, text in documents.items()
+        if text.strip()
+    }
+    levels: dict[str, list[list[str]]] = {source: [] for source in pending}
+    instruction = _LEAF_PROMPT
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summaries") as pool:
+        while pending:
+            jobs = [(source, text) for source, texts in pending.items() for text in texts]
+            results = list(pool.map(
+                lambda job: _summarize_node(instruction, job[1], summarize, cache), jobs
+            ))
+            done: dict[str, list[str]] = {source: [] for source in pending}
+            for (source, _), summary in zip(jobs, results):
+                done[source].append(summary)
+            pending = {}
+            for source, summaries in done.items():
+                levels[source].append(summaries)
+                if len(summaries) > 1:
+                    pending[source] = [
+                        "\n\n".join(summaries[i:i + _FANOUT])
+                        for i in range(0, len(summaries), _FANOUT)
+                    ]
+            instruction = _MERGE_PROMPT
+    return {source: SummaryTree(source, tree) for source, tree in levels.items()}
+
+
+def is_broad_question(question: str) -> bool:
+    """True for questions about whole documents rather than specific facts."""
+    return bool(_BROAD_QUESTION.search(question))
+
+
+def select_summaries(
+    question: str, trees: list[SummaryTree], budget: int = _CONTEXT_TOKEN_BUDGET
+) -> list[tuple[str, str, str]]:
+    """
+    Pick the most detailed summaries that fit one prompt.
+
+    Documents named in the question (by file name, with or without the
+    extension) are the targets, otherwise all of them. Every target starts
+    at its document summary; each is then moved one level deeper (towards
+    the chunk summaries) in turn while the total stays within ``budget``.
+
+    Returns:
+        ``(source, level name, text)`` triples in document and text order;
+        empty if any target's tree is not :attr:`~SummaryTree.ready`, so
+        the question is answered by retrieval instead of from a subset of
+        the documents.
+    """
+    named = [
+        t for t in trees
+        if re.search(rf"\b{re.escape(os.path.splitext(t.source)[0])}\b", question, re.IGNORECASE)
+    ]
+    targets = named or trees
+    if not targets or not all(t.ready for t in targets):
+        return []
+
+    def cost(tree: SummaryTree, depth: int) -> int:
+        return sum(estimate_tokens(s) for s in tree.levels[depth])
+
+    depth = {t.source: len(t.levels) - 1 for t in targets}
+    used = sum(cost(t, depth[t.source]) for t in targets)
+    deepened = True
+    while deepened:
+        deepened = False
+        for t in targets:
+            d = depth[t.source]
+            if d > 0 and used - cost(t, d) + cost(t, d - 1) <= budget:
+                used += cost(t, d - 1) - cost(t, d)
+                depth[t.source] = d - 1
+                deepened = True
+
+    # Even the document summaries may not fit: share the budget evenly
+    per_summary = budget // len(targets) if used > budget else None
+    selected = []
+    for t in targets:
+        d = depth[t.source]
+        for text in t.levels[d]:
+            if per_summary is not None:
+                text = truncate_to_tokens(text, per_summary)
+            selected.append((t.source, t.level_name(d), text))
+    return selected
+
+
+class SummaryIndex:
+    """
+    Summary trees of a session's documents, keyed by content hash.
+
+    Trees are built on a background thread (see :meth:`refresh`), so
+    uploads and questions never wait for them; until a document's tree is
+    ready, broad questions about it fall back to normal retrieval.
+    """
+
+    def __init__(self, summarizer_factory: Callable[[str], Summarizer] = LLMSummarizer):
+        self.trees: dict[str, SummaryTree] = {}  # content hash -> tree
+        self.error = ""
+        self._factory = summarizer_factory
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def building(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def missing(self, hashes: list[str]) -> list[str]:
+        with self._lock:
+            return [h for h in hashes if h not in self.trees]
+
+    def refresh(self, documents: dict[str, tuple[str, str]], api_key: str) -> None:
+        """
+        Start building trees for documents that have none yet.
+
+        Args:
+            documents: Content hash → ``(source name, text)``.
+            api_key:   Key the summarizer calls are made with.
+        """
+        with self._lock:
+            if self.building:
+                return
+            todo = {h: doc for h, doc in documents.items() if h not in self.trees}
+            if not todo:
+                return
+            self._thread = threading.Thread(
+                target=self._run, args=(todo, api_key), daemon=True
+            )
+            self._thread.start()
+
+    def _run(self, todo: dict[str, tuple[str, str]], api_key: str) -> None:
+        try:
+            built = build_summary_trees(
+                {h: text for h, (_, text) in todo.items()}, self._factory(api_key)
+            )
+        except Exception as e:
+            with self._lock:
+                self.error = f"{type(e).__name__}: {e}"
+            return  # retried on the next refresh
+        with self._lock:
+            for h, tree in built.items():
+                self.trees[h] = SummaryTree(todo[h][0], tree.levels)
+            self.error = ""
+
+    def trees_for(self, files: dict[str, str]) -> list[SummaryTree]:
+        """
+        One tree per file in ``files`` (content hash → current source name).
+
+        Files whose tree is still being built get an empty, not
+        :attr:`~SummaryTree.ready` tree, so :func:`select_summaries` knows
+        every document in the session.
+        """
+        with self._lock:
+            return [
+                SummaryTree(name, self.trees[h].levels if h in self.trees else [])
+                for h, name in files.items()
+            ]
+
+    def wait(self, timeout: float | None = None) -> None:
+        """Block until a pending build has finished (used by tests)."""
+        thread = self._thread
+        if thread:
+            thread.join(timeout)
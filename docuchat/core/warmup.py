@@ -0,0 +1,171 @@
+"""Eager start-up warm-up and readiness signalling.
+
+The first request after a deploy would otherwise pay for the embedding model
+load, tokenizer and kernel warm-up, the first FAISS search and the LLM client
+imports. :func:`start_warmup` does all of that in a background thread as soon
+as the process starts. :func:`is_ready` turns true when it has finished, and
+the status server (:mod:`docuchat.core.metrics`) answers ``/ready`` with 200
+only from then on, so a load balancer routes traffic to warm instances only.
+A failed warm-up (e.g. a model download that timed out) is retried with
+exponential backoff until it succeeds.
+"""
+
+import threading
+import time
+from dataclasses import dataclass, field
+
+from docuchat.core import metrics
+
+# Typical chunk lengths, so tokenizer and attention kernels see realistic shapes
+_WARMUP_TEXTS = [
+    "Warm-up passage about company policy, annual leave and remote work.",
+    "Product specification: latency, throughput and rate limits. " * 8,
+    "Research findings on sleep duration and workplace performance. " * 16,
+]
+_WARMUP_QUERY = "How many days of annual leave do employees get?"
+_RETRY_BACKOFF_BASE = 5.0    # seconds before the first retry; doubled each time
+_RETRY_BACKOFF_MAX = 300.0   # cap for the wait between attempts
+
+
+@dataclass
+class WarmupReport:
+    ready: bool = False
+    error: str | None = None
+    attempt: int = 1
+    seconds: dict[str, float] = field(default_factory=dict)  # per step
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(self.seconds.values())
+
+
+_report = WarmupReport()
+_ready = threading.Event()
+_thread: threading.Thread | None = None
+_lock = threading.Lock()
+
+
+def warm_up() -> WarmupReport:
+    """
+    Run every warm-up step in the calling thread and mark the process ready.
+
+    Steps: import the pipeline and construct the LLM client, load the
+    embedding model (the shared ``st.cache_resource`` instance the app
+    uses; with a worker pool, every worker loads its copy), embed documents
+    and a query, then build a tiny index and run a retrieval through it.
+
+    Returns:
+        The report; on failure ``error`` is set and the process stays not ready.
+    """
+    from langchain_community.vectorstores import FAISS
+
+    from docuchat.core.config import get_rag_config
+    from docuchat.core.embeddings import EmbeddingPool
+    from docuchat.core.retrieval import retrieve
+
+    report = WarmupReport()
+    step_start = time.perf_counter()
+
+    def step(name: str) -> None:
+        nonlocal step_start
+        now = time.perf_counter()
+        report.seconds[name] = now - step_start
+        step_start = now
+
+    try:
+        from langchain_groq import ChatGroq
+
+        from docuchat.core import rag
+
+        ChatGroq(api_key="gsk_warmup", model_name=rag._LLM_MODEL, max_retries=0)
+        step("imports")
+
+        embeddings = rag._get_embeddings()
+        if isinstance(embeddings, EmbeddingPool):
+            embeddings.warm_up()
+        step("load_embeddings")
+
+        vectors = embeddings.embed_documents(_WARMUP_TEXTS)
+        embeddings.embed_query(_WARMUP_QUERY)
+        step("embed")
+
+        config = get_rag_config()
+        store = FAISS.from_embeddings(list(zip(_WARMUP_TEXTS, vectors)), embeddings)
+        retrieve(
+            store,
+            _WARMUP_QUERY,
+            top_k=min(config.top_k, len(_WARMUP_TEXTS)),
+            fetch_k=config.fetch_k,
+            score_threshold=config.score_threshold,
+            lambda_mult=config.lambda_mult,
+            min_k=1,
+            gap_factor=config.gap_factor,
+        )
+        step("search")
+        report.ready = True
+    except Exception as e:
+        report.error = f"{type(e).__name__}: {e}"
+
+    global _report
+    _report = report
+    if report.ready:
+        _ready.set()
+    return report
+
+
+def _attempt(attempt: int) -> None:
+    """Run one warm-up; on failure schedule the next after a backoff."""
+    report = warm_up()
+    report.attempt = attempt
+    if report.ready:
+        return
+    delay = min(_RETRY_BACKOFF_BASE * 2 ** (attempt - 1), _RETRY_BACKOFF_MAX)
+    # The wait is a daemon timer, so a process exiting meanwhile does not block on it
+    timer = threading.Timer(delay, _start_attempt, (attempt + 1,))
+    timer.daemon = True
+    timer.start()
+
+
+def _start_attempt(attempt: int) -> threading.Thread:
+    global _thread
+    # Explicitly not a daemon (threads inherit it from Streamlit's script
+    # thread): killing it mid-way through native model loading at
+    # interpreter exit aborts the process
+    _thread = threading.Thread(
+        target=_attempt, args=(attempt,), name="docuchat-warmup", daemon=False
+    )
+    _thread.start()
+    return _thread
+
+
+def start_warmup() -> threading.Thread:
+    """
+    Start :func:`warm_up` in a background thread (once per process),
+    retrying after ``_RETRY_BACKOFF_BASE`` seconds, doubled per failure up
+    to ``_RETRY_BACKOFF_MAX``, until it succeeds.
+    """
+    with _lock:
+        return _thread or _start_attempt(1)
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def wait_ready(timeout: float | None = None) -> bool:
+    """Block until warm-up has finished successfully, or ``timeout`` passes."""
+    return _ready.wait(timeout)
+
+
+def warmup_report() -> WarmupReport:
+    return _report
+
+
+metrics.set_readiness_check(is_ready)
+metrics.REGISTRY.gauge(
+    "docuchat_ready", "1 once start-up warm-up has completed", lambda: int(is_ready())
+)
+metrics.REGISTRY.gauge(
+    "docuchat_warmup_seconds", "Duration of each start-up warm-up step",
+    lambda: {(name,): s for name, s in _report.seconds.items()}, ("step",),
+)
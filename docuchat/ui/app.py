@@ -12,6 +12,15 @@ from docuchat.core import (
     get_ai_response,
     validate_groq_api_key,
 )
+from docuchat.core import metrics
+from docuchat.core.document import save_and_hash
+from docuchat.core.history import ConversationMemory
+from docuchat.core.index_manager import get_index_manager
+from docuchat.core.profiling import enable_for_context, list_captures
+from docuchat.core.rag import error_message, load_snapshot, plan_map_reduce, stream_map_reduce
+from docuchat.core.snapshot import snapshot_bytes
+from docuchat.core.summaries import SummaryIndex, is_broad_question, select_summaries
+from docuchat.core.warmup import start_warmup
 
 # ---------------------------------------------------------------------------
 # App configuration
@@ -21,6 +30,13 @@ st.set_page_config(page_title="DocuChat", page_icon="🤖", layout="wide")
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Admin tools (request profiling, metrics) are only shown when DOCUCHAT_ADMIN=1
+ADMIN_MODE = os.environ.get("DOCUCHAT_ADMIN", "") == "1"
+
+# Only the latest messages are rendered as chat bubbles on every rerun; older
+# ones are grouped into pages shown on demand, so reruns stay constant-time
+HISTORY_PAGE = 20
+
 # ---------------------------------------------------------------------------
 # Session state
 # ---------------------------------------------------------------------------
@@ -30,42 +46,291 @@ if "files" not in st.session_state:
 if "conversation" not in st.session_state:
     st.session_state.conversation: list[dict] = []
 
+if "history_markdown" not in st.session_state:
+    st.session_state.history_markdown: dict[int, str] = {}  # page start -> markdown
+
+if "session_id" not in st.session_state:
+    st.session_state.session_id: str = uuid.uuid4().hex
+
+if "memory" not in st.session_state:
+    st.session_state.memory = ConversationMemory()
+
+if "summary_index" not in st.session_state:
+    st.session_state.summary_index = SummaryIndex()  # trees for broad questions
+
 if "api_key" not in st.session_state:
     st.session_state.api_key: str = ""
 
 if "known_files" not in st.session_state:
-    st.session_state.known_files: set[str] = set()
+    st.session_state.known_files: set[str] = set()  # SHA-256 of loaded files
 
-if "vector_store" not in st.session_state:
-    st.session_state.vector_store = None
+if "seen_uploads" not in st.session_state:
+    st.session_state.seen_uploads: set[str] = set()  # uploader file ids already handled
+
+if "snapshot_path" not in st.session_state:
+    st.session_state.snapshot_path: str = ""  # imported knowledge-base snapshot
+
+# Vector stores live in the process-wide IndexManager (keyed by session_id),
+# which spills idle sessions to disk when the memory budget is exceeded.
+index_manager = get_index_manager()
+
+# Prometheus /metrics and /ready endpoints, if DOCUCHAT_METRICS_PORT is set,
+# and the model warm-up (both once per process; `docuchat serve` starts them
+# before the first session instead)
+metrics.start_metrics_server()
+start_warmup()
+
+# Applies to everything this script run does (uploads, rebuilds, answers)
+enable_for_context(ADMIN_MODE and st.session_state.get("profile_requests", False))
 
 
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
-def _rebuild_vector_store() -> None:
-    """Rebuild the FAISS index from all currently loaded files."""
-    st.session_state.vector_store = (
-        build_vector_store(st.session_state.files)
-        if st.session_state.files
-        else None
-    )
-
-
-def _remove_file(file_id: str, original_name: str, size_bytes: int, path: str) -> None:
-    """Delete a file from disk and remove it from session state."""
-    try:
-        if path and os.path.exists(path):
-            os.remove(path)
-    except Exception:
-        pass
+def _file_text(f: dict) -> str:
+    """Extracted text of a loaded file (extraction cache hit, or re-extract from disk)."""
+    return extract_text_from_file(f["path"], f["original_name"], content_hash=f.get("sha256"))
+
+
+def _rebuild_vector_store(fresh_texts: dict[str, str] | None = None) -> None:
+    """
+    Rebuild the FAISS index from all currently loaded files.
+
+    ``fresh_texts`` maps content hashes to text extracted during this run,
+    so just-uploaded files are not read back from the cache.
+    """
+    fresh_texts = fresh_texts or {}
+    files = [
+        {
+            "original_name": f["original_name"],
+            "text_content": fresh_texts.get(f.get("sha256")) or _file_text(f),
+        }
+        for f in st.session_state.files
+    ]
+    store = build_vector_store(files) if files else None
+    if st.session_state.snapshot_path:
+        imported = load_snapshot(st.session_state.snapshot_path)
+        if store:
+            store.merge_from(imported)
+        else:
+            store = imported
+    index_manager.put(st.session_state.session_id, store)
+
+
+def _loaded_hashes() -> dict[str, str]:
+    """Content hash → display name of every loaded file."""
+    return {f["sha256"]: f["original_name"] for f in st.session_state.files if f.get("sha256")}
+
+
+def _refresh_summaries() -> None:
+    """Start summary-tree builds (in the background) for files that have none yet."""
+    index = st.session_state.summary_index
+    missing = set(index.missing(list(_loaded_hashes())))
+    if missing and not index.building:
+        index.refresh(
+            {f["sha256"]: (f["original_name"], _file_text(f))
+             for f in st.session_state.files if f.get("sha256") in missing},
+            st.session_state.api_key,
+        )
+
+
+def _has_knowledge() -> bool:
+    """True once documents are uploaded or a snapshot is imported."""
+    return bool(st.session_state.files or st.session_state.snapshot_path)
+
+
+def _remove_files(file_ids: set[str]) -> None:
+    """Delete files from disk, remove them from session state and rebuild once."""
+    for f in st.session_state.files:
+        if f.get("id") not in file_ids:
+            continue
+        try:
+            if f.get("path") and os.path.exists(f["path"]):
+                os.remove(f["path"])
+        except Exception:
+            pass
+        st.session_state.known_files.discard(f.get("sha256", ""))
     st.session_state.files = [
-        f for f in st.session_state.files if f.get("id") != file_id
+        f for f in st.session_state.files if f.get("id") not in file_ids
     ]
-    st.session_state.known_files.discard(f"{original_name}:{size_bytes}")
     _rebuild_vector_store()
 
 
+def _page_markdown(start: int) -> str:
+    """
+    One markdown block for the page of older messages starting at absolute
+    message number ``start`` (trimmed messages included in the count). Full
+    pages never change until the chat is cleared, so they are kept in this
+    session's state; the oldest page may be partly trimmed and is not kept.
+    """
+    pages = st.session_state.history_markdown
+    if start in pages:
+        return pages[start]
+    dropped = st.session_state.memory.dropped
+    first = max(start, dropped)
+    text = "\n\n---\n\n".join(
+        f"**{'You' if m['role'] == 'user' else 'DocuChat'}:** {m['content']}"
+        for m in st.session_state.conversation[first - dropped:start + HISTORY_PAGE - dropped]
+    )
+    if first == start:
+        pages[start] = text
+    return text
+
+
+@st.fragment
+def _chat_history() -> None:
+    """
+    Render the conversation: the latest messages as chat bubbles, older
+    ones as whole pages, revealed a page at a time without a full rerun.
+    """
+    conversation = st.session_state.conversation
+    dropped = st.session_state.memory.dropped
+    end = dropped + len(conversation)
+    # Pages are aligned to absolute message numbers, so trimming the oldest
+    # messages never shifts them and full pages stay cache hits; between one
+    # and two pages of recent messages stay live
+    live_start = max(dropped, (end // HISTORY_PAGE - 1) * HISTORY_PAGE)
+    starts = range(dropped - dropped % HISTORY_PAGE, live_start, HISTORY_PAGE)
+    shown = min(st.session_state.get("history_pages", 0), len(starts))
+    starts = starts[len(starts) - shown:]
+    hidden = (max(starts[0], dropped) if starts else live_start) - dropped
+    for trimmed in [s for s in st.session_state.history_markdown if s < dropped]:
+        del st.session_state.history_markdown[trimmed]
+    if hidden > 0:
+        st.button(
+            f"Show earlier messages ({hidden} more)",
+            type="tertiary",
+            on_click=lambda: st.session_state.update(history_pages=shown + 1),
+        )
+    for start in starts:
+        st.markdown(_page_markdown(start))
+    if starts:
+        st.divider()
+    for msg in conversation[live_start - dropped:]:
+        with st.chat_message("user" if msg["role"] == "user" else "assistant"):
+            st.markdown(msg["content"])
+
+
+@st.fragment
+def _file_list() -> None:
+    """Loaded documents as one table; selecting rows and removing them reruns only this."""
+    st.subheader(f"Documents ({len(st.session_state.files)})")
+    table = st.dataframe(
+        [
+            {"Document": f["original_name"], "KB": round(f["size"] / 1024, 1)}
+            for f in st.session_state.files
+        ],
+        hide_index=True,
+        use_container_width=True,
+        height=min(36 + 35 * len(st.session_state.files), 300),
+        on_select="rerun",
+        selection_mode="multi-row",
+        key="file_table",
+    )
+    rows = table.selection.rows
+    if st.button(
+        f"🗑 Remove {len(rows)} selected" if rows else "🗑 Remove selected",
+        disabled=not rows,
+        use_container_width=True,
+    ):
+        files = st.session_state.files
+        _remove_files({files[i]["id"] for i in rows if i < len(files)})
+        st.rerun()  # index, hints and summaries all depend on the file list
+
+
+@st.dialog("Runtime metrics", width="large")
+def _metrics_dialog() -> None:
+    """Process-wide latency percentiles, rates and sizes (admin only)."""
+    rows = []
+    for label, histogram in [
+        ("Extraction", metrics.EXTRACTION_SECONDS),
+        ("Embedding (per build)", metrics.EMBEDDING_SECONDS),
+        ("Retrieval", metrics.RETRIEVAL_SECONDS),
+        ("LLM time to first token", metrics.LLM_TTFT_SECONDS),
+        ("LLM total", metrics.LLM_SECONDS),
+    ]:
+        s = histogram.summary()
+        rows.append({
+            "Stage": label,
+            "Count": s["count"],
+            "Mean ms": round(s["mean"] * 1000, 1),
+            "p50 ms": round(s["p50"] * 1000, 1),
+            "p95 ms": round(s["p95"] * 1000, 1),
+            "p99 ms": round(s["p99"] * 1000, 1),
+        })
+    st.dataframe(rows, hide_index=True, use_container_width=True)
+
+    hits = metrics.EXTRACTION_CACHE.value("hit")
+    lookups = hits + metrics.EXTRACTION_CACHE.value("miss")
+    requests = sum(child.value for _, child in metrics.LLM_REQUESTS.series())
+    embedded = metrics.EMBEDDING_SECONDS.summary()["sum"]
+    rss = metrics.process_rss_bytes()
+    cols = st.columns(5)
+    cols[0].metric("Extraction cache hits", f"{hits / lookups:.0%}" if lookups else "–")
+    cols[1].metric(
+        "Embedding throughput",
+        f"{metrics.EMBEDDED_CHUNKS.value() / embedded:.0f}/s" if embedded else "–",
+    )
+    cols[2].metric(
+        "LLM errors",
+        f"{1 - metrics.LLM_REQUESTS.value('ok') / requests:.0%}" if requests else "–",
+    )
+    cols[3].metric(
+        "Auth failures (401)",
+        f"{metrics.LLM_REQUESTS.value('auth_error') / requests:.0%}" if requests else "–",
+    )
+    cols[4].metric("Process RSS", f"{rss / 1e6:.0f} MB" if rss else "–")
+
+    sessions = [
+        {"Session": sid[:8], "State": state, "Index MB": round(nbytes / 1e6, 2)}
+        for (sid, state), nbytes in index_manager.session_bytes().items()
+    ]
+    if sessions:
+        st.dataframe(sessions, hide_index=True, use_container_width=True)
+    st.download_button(
+        "Download Prometheus metrics",
+        metrics.REGISTRY.render(),
+        file_name="docuchat-metrics.prom",
+        mime="text/plain",
+    )
+
+
+@st.fragment
+def _admin_panel() -> None:
+    """Metrics and profiling controls; their interactions rerun only this panel."""
+    with st.expander("Admin"):
+        if st.button("Runtime metrics", use_container_width=True):
+            _metrics_dialog()
+        st.toggle(
+            "Profile my requests",
+            key="profile_requests",
+            help="cProfile + allocation snapshot of each extraction, index build and answer",
+        )
+        for capture in list_captures(limit=10):
+            try:
+                with open(capture.prof_path, "rb") as f:
+                    prof = f.read()
+                with open(capture.report_path, "rb") as f:
+                    report = f.read()
+            except OSError:
+                continue  # pruned by a newer capture since it was listed
+            stamp = datetime.fromtimestamp(capture.created).strftime("%H:%M:%S")
+            st.caption(f"{stamp} · {capture.name} · {capture.seconds * 1000:.0f} ms")
+            prof_col, report_col = st.columns(2)
+            prof_col.download_button(
+                ".prof", prof,
+                file_name=os.path.basename(capture.prof_path),
+                key=f"prof-{capture.prof_path}",
+                use_container_width=True,
+            )
+            report_col.download_button(
+                "Report", report,
+                file_name=os.path.basename(capture.report_path),
+                key=f"report-{capture.report_path}",
+                use_container_width=True,
+            )
+
+
 # ---------------------------------------------------------------------------
 # Sidebar
 # ---------------------------------------------------------------------------
@@ -81,55 +346,94 @@ with st.sidebar:
     )
 
     if uploaded:
-        new_files_added = False
+        fresh_texts: dict[str, str] = {}
         for file in uploaded:
             try:
-                size_bytes = getattr(file, "size", None) or len(file.getbuffer())
-                unique_key = f"{file.name}:{size_bytes}"
-                if unique_key in st.session_state.known_files:
+                # The uploader re-sends every file on each rerun; skip handled ones
+                if file.file_id in st.session_state.seen_uploads:
                     continue
+                st.session_state.seen_uploads.add(file.file_id)
 
+                buffer = file.getbuffer()
                 file_id = f"{uuid.uuid4()}_{file.name}"
                 file_path = os.path.join(UPLOAD_DIR, file_id)
-                with open(file_path, "wb") as f:
-                    f.write(file.getbuffer())
+                content_hash = save_and_hash(buffer, file_path)
+                # Dedup on content, so renamed copies are caught and distinct
+                # files that share a name and size are not merged
+                if content_hash in st.session_state.known_files:
+                    os.remove(file_path)
+                    st.toast(f"ℹ️ {file.name} is already loaded")
+                    continue
 
                 st.session_state.files.append(
                     {
                         "id": file_id,
                         "original_name": file.name,
                         "path": file_path,
-                        "size": os.path.getsize(file_path),
-                        "text_content": extract_text_from_file(file_path, file.name),
+                        "size": buffer.nbytes,
+                        "sha256": content_hash,
                         "uploaded_at": datetime.now().isoformat(),
                     }
                 )
-                st.session_state.known_files.add(unique_key)
+                # Text is only held for this run; later rebuilds read it back
+                # from the extraction cache instead of keeping it in the session
+                fresh_texts[content_hash] = extract_text_from_file(
+                    buffer, file.name, content_hash=content_hash
+                )
+                st.session_state.known_files.add(content_hash)
                 st.toast(f"✅ Uploaded {file.name}")
-                new_files_added = True
             except Exception as e:
                 st.warning(f"Failed to process {file.name}: {e}")
 
-        if new_files_added:
+        if fresh_texts:
             with st.spinner("Building knowledge base…"):
-                _rebuild_vector_store()
+                _rebuild_vector_store(fresh_texts)
 
     # --- Uploaded file list ---
     if st.session_state.files:
-        st.subheader("Documents")
-        for f in list(st.session_state.files):
-            col1, col2 = st.columns([0.85, 0.15])
-            with col1:
-                st.write(f"📄 {f['original_name']} ({round(f['size'] / 1024, 1)} KB)")
-            with col2:
-                if st.button("🗑", key=f"rm_{f['id']}", help="Remove", use_container_width=True):
-                    _remove_file(
-                        file_id=f["id"],
-                        original_name=f["original_name"],
-                        size_bytes=int(f.get("size", 0)),
-                        path=f.get("path", ""),
-                    )
-                    st.rerun()
+        _file_list()
+
+    # --- Knowledge base snapshot (build once, ship to other instances) ---
+    with st.expander("Knowledge base snapshot"):
+        if _has_knowledge():
+            half = st.checkbox("Half-precision vectors (smaller file)")
+            if st.button("Prepare snapshot", use_container_width=True):
+                store = index_manager.get(st.session_state.session_id)
+                if store is None:  # dropped after the session sat idle
+                    _rebuild_vector_store()
+                    store = index_manager.get(st.session_state.session_id)
+                if store:
+                    st.session_state.snapshot_export = snapshot_bytes(store, float16=half)
+            if st.session_state.get("snapshot_export"):
+                st.download_button(
+                    "Download snapshot",
+                    data=st.session_state.snapshot_export,
+                    file_name="docuchat-knowledge-base.dckb",
+                    mime="application/octet-stream",
+                    use_container_width=True,
+                )
+
+        snapshot_file = st.file_uploader("Import snapshot (.dckb)", type=["dckb"])
+        if snapshot_file and snapshot_file.file_id not in st.session_state.seen_uploads:
+            st.session_state.seen_uploads.add(snapshot_file.file_id)
+            path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}_{snapshot_file.name}")
+            save_and_hash(snapshot_file.getbuffer(), path)
+            previous = st.session_state.snapshot_path
+            st.session_state.snapshot_path = path
+            try:
+                with st.spinner("Loading snapshot…"):
+                    _rebuild_vector_store()
+                if previous and os.path.exists(previous):
+                    os.remove(previous)
+                st.toast(f"✅ Imported {snapshot_file.name}")
+            except ValueError as e:
+                st.session_state.snapshot_path = previous
+                os.remove(path)
+                st.error(str(e))
+
+    # --- Admin: runtime metrics and on-demand profiling of this session ---
+    if ADMIN_MODE:
+        _admin_panel()
 
     st.divider()
 
@@ -150,6 +454,29 @@ with st.sidebar:
         else:
             st.error(msg)
 
+    # --- Opt-in answering modes: extractive lookups, and summary trees for
+    # "summarize" / "compare" questions (these cost LLM calls) ---
+    if st.session_state.files:
+        st.toggle(
+            "Instant answers for simple lookups",
+            key="use_extractive",
+            help="Answer factual questions with the matching sentence from your "
+            "documents when retrieval is confident, without waiting for the LLM",
+        )
+        st.toggle(
+            "Summaries for broad questions",
+            key="use_summaries",
+            help="Summarize each document (chunk → section → document, cached) with "
+            "your key, so questions like 'summarize' or 'compare' see whole documents",
+        )
+        if st.session_state.use_summaries and validate_groq_api_key(st.session_state.api_key)[0]:
+            _refresh_summaries()
+            loaded = _loaded_hashes()
+            ready = len(loaded) - len(st.session_state.summary_index.missing(list(loaded)))
+            st.caption(f"Summaries ready for {ready} of {len(loaded)} documents")
+            if st.session_state.summary_index.error:
+                st.caption(f"⚠️ {st.session_state.summary_index.error}")
+
     st.markdown(
         "Don't have a key? Get one free at [console.groq.com](https://console.groq.com/keys)"
     )
@@ -158,6 +485,9 @@ with st.sidebar:
     st.divider()
     if st.button("🗑 Clear Chat", use_container_width=True):
         st.session_state.conversation = []
+        st.session_state.memory = ConversationMemory()
+        st.session_state.history_pages = 0
+        st.session_state.history_markdown = {}
         st.rerun()
 
 
@@ -168,7 +498,7 @@ st.title("🤖 DocuChat")
 st.caption("Ask questions about your documents — answers are retrieved from your exact content")
 
 # Setup hints when not ready
-if not st.session_state.files or not (
+if not _has_knowledge() or not (
     st.session_state.api_key and validate_groq_api_key(st.session_state.api_key)[0]
 ):
     col1, col2 = st.columns(2)
@@ -177,10 +507,8 @@ if not st.session_state.files or not (
     with col2:
         st.info("🔑 **Step 2** — Enter your GROQ API key in the sidebar")
 
-# Render conversation history
-for msg in st.session_state.conversation:
-    with st.chat_message("user" if msg["role"] == "user" else "assistant"):
-        st.markdown(msg["content"])
+# Render conversation history (latest page live, older pages on demand)
+_chat_history()
 
 
 # ---------------------------------------------------------------------------
@@ -190,7 +518,7 @@ def handle_user_message(user_message: str) -> None:
     if not user_message:
         return
 
-    if not st.session_state.files:
+    if not _has_knowledge():
         st.warning("⚠️ Please upload at least one document first.")
         return
 
@@ -201,10 +529,12 @@ def handle_user_message(user_message: str) -> None:
         return
 
     # Lazily rebuild vector store if needed
-    if not st.session_state.vector_store:
+    vector_store = index_manager.get(st.session_state.session_id)
+    if not vector_store:
         with st.spinner("Building knowledge base…"):
             _rebuild_vector_store()
-        if not st.session_state.vector_store:
+        vector_store = index_manager.get(st.session_state.session_id)
+        if not vector_store:
             st.error("Could not build knowledge base from the uploaded documents.")
             return
 
@@ -213,22 +543,72 @@ def handle_user_message(user_message: str) -> None:
         {"role": "user", "content": user_message, "timestamp": datetime.now().isoformat()}
     )
 
-    # Retrieve + generate (pass history for follow-up question support)
+    summaries = (
+        st.session_state.summary_index.trees_for(_loaded_hashes())
+        if st.session_state.get("use_summaries") else None
+    )
+    # Questions across documents (unless summaries answer them) are answered
+    # per document and merged; notes and the final answer show as they arrive
     with st.chat_message("assistant"):
-        with st.spinner("Searching documents…"):
-            answer = get_ai_response(
-                user_message,
-                st.session_state.vector_store,
-                api_key,
-                conversation_history=st.session_state.conversation,
-            )
-        st.markdown(answer)
+        plan, answer = {}, None
+        summarized = (
+            summaries and is_broad_question(user_message)
+            and select_summaries(user_message, summaries)
+        )
+        if not summarized:
+            with st.spinner("Searching documents…"):
+                try:
+                    plan = plan_map_reduce(user_message, vector_store)
+                except Exception as e:  # e.g. the embedding server is down
+                    answer = error_message(e)
+
+        if answer is not None:
+            st.markdown(answer)
+        elif plan:
+            status = st.status(f"Reading {len(plan)} documents…")
+
+            def answer_pieces():
+                for source, text in stream_map_reduce(
+                    user_message,
+                    plan,
+                    api_key,
+                    conversation_history=st.session_state.conversation,
+                    history_summary=st.session_state.memory.summary,
+                    session_id=st.session_state.session_id,
+                ):
+                    if source is None:
+                        yield text
+                    else:
+                        status.markdown(f"**{source}** — {text}")
+                status.update(label=f"Read {len(plan)} documents", state="complete")
+
+            answer = st.write_stream(answer_pieces())
+        else:
+            # Retrieve + generate (pass history for follow-up question support)
+            with st.spinner("Searching documents…"):
+                answer = get_ai_response(
+                    user_message,
+                    vector_store,
+                    api_key,
+                    conversation_history=st.session_state.conversation,
+                    history_summary=st.session_state.memory.summary,
+                    session_id=st.session_state.session_id,
+                    summaries=summaries,
+                    extractive=bool(st.session_state.get("use_extractive")),
+                    plan=plan,
+                )
+            st.markdown(answer)
 
     # Persist assistant message
     st.session_state.conversation.append(
         {"role": "assistant", "content": answer, "timestamp": datetime.now().isoformat()}
     )
 
+    # Fold turns that left the recent window into the rolling summary (runs in
+    # the background) and cap how much raw history the session keeps
+    st.session_state.memory.refresh(st.session_state.conversation, api_key)
+    st.session_state.memory.trim(st.session_state.conversation)
+
 
 # ---------------------------------------------------------------------------
 # Chat input
@@ -0,0 +1,1033 @@
+"""
+DocuChat — Performance Benchmarks
+=================================
+Micro- and macro-benchmarks for the ingestion and retrieval pipeline.
+Like ``evaluate_rag.py`` these need no Groq API key.
+
+Scenarios
+---------
+  docx : streaming ``iterparse`` DOCX extractor vs. the python-docx DOM path
+         on large generated documents (wall time and peak RSS, each run in a
+         fresh interpreter)
+  embed: embedding throughput (chunks/sec) in-process vs. an EmbeddingPool
+         with 1..N worker processes
+  quant: index memory, search latency and recall@k of the float32 flat
+         index vs. float16 / int8 scalar-quantized codes, with and without
+         exact re-scoring of the top fetch_k candidates
+  onnx : PyTorch MiniLM vs. ONNX Runtime (fp32 and int8-quantized):
+         embedding throughput, cosine agreement with the PyTorch vectors,
+         and hit rate / MRR on the evaluate_rag.py QA set (needs the
+         ``onnx`` extra and the model download)
+  coldstart: first-request latency (index a document, retrieve for a
+         question) in a fresh process, with and without the start-up
+         warm-up of ``docuchat.core.warmup``, plus the warm-up cost itself
+  scale: index build time, memory and end-to-end retrieval latency as the
+         corpus grows, with the offline hashing embedder so the numbers
+         show pipeline overhead rather than model cost (no download needed)
+  metrics: cost of recording a counter / histogram sample on the hot path,
+         single-threaded and with concurrent recording threads
+  mapreduce: wall time of per-document map-reduce answering as the number
+         of documents grows, vs. a single answer call, with simulated LLM
+         latency (no API key; the per-key rate limit is lifted so the
+         numbers show the pipeline's own concurrency)
+  shards: queries per second and median latency of scatter-gather search
+         over a sharded knowledge base as the shard count grows, with
+         concurrent clients (synthetic vectors, no model needed)
+  embedserver: several app replicas on one host, each loading its own
+         embedding model vs. all sharing one ``docuchat embed-server``:
+         model load time per replica, total resident memory, queries per
+         second and texts per model call (``--backend hash`` runs offline)
+  rerun: server-side time of one Streamlit rerun of the chat UI as the
+         conversation and the document list grow (Streamlit's AppTest, no
+         browser or API key)
+  boilerplate: characters and chunks indexed with and without per-document
+         running header, footer and page-number stripping, on
+         generated reports or on real PDFs passed with ``--files``
+
+Run
+---
+    python tests/benchmark.py docx                  # default sizes
+    python tests/benchmark.py docx --pages 500      # ~500-page export
+    python tests/benchmark.py docx --json           # also write results/benchmark_report.json
+    python tests/benchmark.py embed --workers 1 2 4 --chunks 4000
+    python tests/benchmark.py quant --vectors 200000  # synthetic clustered vectors
+    python tests/benchmark.py quant --model           # MiniLM vectors of fixture chunks
+    python tests/benchmark.py onnx --chunks 2000
+    python tests/benchmark.py coldstart --repeat 3
+    python tests/benchmark.py scale --chunks 10000 100000 1000000
+    python tests/benchmark.py metrics --threads 1 4
+    python tests/benchmark.py mapreduce --docs 2 4 8 16
+    python tests/benchmark.py shards --shards 1 2 4 8 --vectors 1000000
+    python tests/benchmark.py embedserver --replicas 4 --max-delay-ms 0 5 20
+    python tests/benchmark.py rerun --turns 10 500 2000 --docs 5 200
+    python tests/benchmark.py boilerplate --pages 200 --docs 5
+    python tests/benchmark.py boilerplate --files ~/reports/*.pdf
+    python tests/benchmark.py embed --compare         # regression gate vs. the stored report
+
+``--compare [BASELINE]`` runs the scenario ``--warmup`` times untimed, then
+``--trials`` times, takes the median of every metric and exits non-zero if
+latency, throughput, peak memory or recall regressed beyond the noise-aware
+tolerances of ``regression.py`` (``--latency-tol``, ``--memory-tol``, …).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Allow running from the repo root without installing the package
+REPO_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import regression
+
+RESULTS_PATH = REPO_ROOT / "results" / "benchmark_report.json"
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+RESET = "\033[0m"
+BOLD  = "\033[1m"
+CYAN  = "\033[96m"
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+def _run_isolated(code: str) -> dict:
+    """Run ``code`` in a fresh interpreter; it must print one JSON object."""
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        check=True,
+        capture_output=True,
+        text=True,
+        cwd=REPO_ROOT,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _print_table(title: str, header: list[str], rows: list[list]) -> None:
+    sep = "─" * 72
+    print(f"\n{BOLD}{CYAN}  {title}{RESET}")
+    print(f"  {sep}")
+    print("  " + "  ".join(f"{h:>14}" for h in header))
+    print(f"  {sep}")
+    for row in rows:
+        print("  " + "  ".join(f"{c:>14}" for c in row))
+    print()
+
+
+# ---------------------------------------------------------------------------
+# Scenario: DOCX extraction
+# ---------------------------------------------------------------------------
+def _make_docx(path: Path, pages: int) -> None:
+    """Generate a Word export of roughly ``pages`` pages with tables in-line."""
+    import docx
+
+    doc = docx.Document()
+    for page in range(pages):
+        doc.add_heading(f"Section {page + 1}", level=2)
+        for i in range(8):
+            doc.add_paragraph(
+                f"Paragraph {i} of section {page + 1}. The Helios X1 inverter "
+                "delivers 5,000 W of rated AC output with a peak efficiency of "
+                "97.8% across the full operating range. " * 2
+            )
+        if page % 2 == 0:
+            table = doc.add_table(rows=6, cols=4)
+            for r, row in enumerate(table.rows):
+                for c, cell in enumerate(row.cells):
+                    cell.text = f"r{r}c{c} value {page}"
+            table.cell(1, 0).merge(table.cell(1, 1))
+    doc.save(str(path))
+
+
+_DOCX_PROBE = """
+import json, resource, sys, time
+sys.path.insert(0, ".")
+from docuchat.core.document import {func}
+t0 = time.perf_counter()
+text = {func}({path!r})
+elapsed = time.perf_counter() - t0
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({{"seconds": elapsed, "peak_rss_mb": rss, "chars": len(text)}}))
+"""
+
+
+def bench_docx(args: argparse.Namespace) -> dict:
+    results = {}
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in args.pages:
+            path = Path(tmp) / f"export_{pages}.docx"
+            print(f"📝  Generating {pages}-page DOCX …", end="", flush=True)
+            _make_docx(path, pages)
+            print(f" done ({path.stat().st_size / 1e6:.1f} MB)")
+            for label, func in [("dom", "_extract_docx_dom"), ("streaming", "_extract_docx")]:
+                runs = [
+                    _run_isolated(_DOCX_PROBE.format(func=func, path=str(path)))
+                    for _ in range(args.repeat)
+                ]
+                best = min(runs, key=lambda r: r["seconds"])
+                results[f"{label}_{pages}p"] = best
+                rows.append([
+                    f"{pages}p", label, f"{best['seconds'] * 1000:.0f} ms",
+                    f"{best['peak_rss_mb']:.0f} MB", best["chars"],
+                ])
+    _print_table("DOCX EXTRACTION", ["Size", "Extractor", "Time", "Peak RSS", "Chars"], rows)
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Scenario: embedding throughput
+# ---------------------------------------------------------------------------
+def _fixture_chunks(n: int) -> list[str]:
+    """``n`` realistic chunks, cycling through the fixture documents."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    from docuchat.core.document import extract_text_from_file
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    base = []
+    for path in sorted(FIXTURES_DIR.glob("*.txt")):
+        base.extend(splitter.split_text(extract_text_from_file(str(path), path.name)))
+    # Vary each copy slightly so nothing downstream can dedupe the work
+    return [f"{base[i % len(base)]} [{i}]" for i in range(n)]
+
+
+def bench_embed(args: argparse.Namespace) -> dict:
+    from docuchat.core.embeddings import EmbeddingPool, make_hf_embeddings
+
+    chunks = _fixture_chunks(args.chunks)
+    results = {}
+    rows = []
+    for workers in [0, *args.workers]:
+        backend = EmbeddingPool(workers) if workers else make_hf_embeddings()
+        try:
+            backend.embed_documents(chunks[: max(8, workers * 8)])  # load models, warm kernels
+            t0 = time.perf_counter()
+            backend.embed_documents(chunks)
+            elapsed = time.perf_counter() - t0
+        finally:
+            if workers:
+                backend.close()
+        rate = len(chunks) / elapsed
+        label = f"pool-{workers}" if workers else "in-process"
+        results[label] = {"chunks_per_sec": rate, "seconds": elapsed}
+        base = results.get("pool-1", {}).get("chunks_per_sec")
+        speedup = f"{rate / base:.2f}x" if base and workers else "-"
+        rows.append([label, len(chunks), f"{elapsed:.1f} s", f"{rate:.0f}", speedup])
+    _print_table(
+        f"EMBEDDING THROUGHPUT ({os.cpu_count()} cores)",
+        ["Backend", "Chunks", "Time", "Chunks/s", "vs pool-1"],
+        rows,
+    )
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Scenario: reduced-precision vector storage
+# ---------------------------------------------------------------------------
+def _clustered_vectors(n: int, dim: int, seed: int = 0):
+    """Unit vectors in topical clusters, roughly like sentence embeddings."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 100), dim)).astype("float32")
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.6 * rng.standard_normal((n, dim)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def bench_quant(args: argparse.Namespace) -> dict:
+    import faiss
+    import numpy as np
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    from docuchat.core.quantization import PRECISIONS, quantize_store
+
+    if args.model:
+        from docuchat.core.embeddings import make_hf_embeddings
+
+        model = make_hf_embeddings()
+        chunks = _fixture_chunks(args.vectors)
+        vectors = np.asarray(model.embed_documents(chunks), dtype="float32")
+        queries = np.asarray(
+            model.embed_documents([c[: len(c) // 3] for c in chunks[: args.queries]]), dtype="float32"
+        )
+    else:
+        data = _clustered_vectors(args.vectors + args.queries, args.dim)
+        vectors, queries = data[: args.vectors], data[args.vectors:]
+    print(f"🔢  {len(vectors):,} vectors × {vectors.shape[1]} dims, {len(queries)} queries")
+
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    _, truth = flat.search(queries, args.top_k)
+    store = FAISS(DeterministicFakeEmbedding(size=vectors.shape[1]), flat, InMemoryDocstore(), {})
+
+    def recall(found) -> float:
+        return float(np.mean([len(set(f[: args.top_k]) & set(t)) / args.top_k for f, t in zip(found, truth)]))
+
+    def timed(search) -> tuple[list, float]:
+        t0 = time.perf_counter()
+        found = [search(q[None, :]) for q in queries]
+        return found, (time.perf_counter() - t0) * 1000 / len(queries)
+
+    results = {}
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for precision in PRECISIONS:
+            quantized = quantize_store(store, precision, tmp)
+            index_mb = faiss.serialize_index(quantized.index).nbytes / 1e6
+            found, ms = timed(lambda q: quantized.index.search(q, args.top_k)[1][0])
+            row = {"index_mb": index_mb, "recall": recall(found), "ms_per_query": ms}
+            if precision != "float32":
+                found, ms = timed(lambda q: quantized.rescored_search(q, args.fetch_k)[1][0])
+                row.update(rescored_recall=recall(found), rescored_ms_per_query=ms)
+            results[precision] = row
+            rows.append([
+                precision, f"{index_mb:.1f} MB", f"{row['recall']:.3f}", f"{row['ms_per_query']:.2f} ms",
+                f"{row.get('rescored_recall', row['recall']):.3f}",
+                f"{row.get('rescored_ms_per_query', row['ms_per_query']):.2f} ms",
+            ])
+    _print_table(
+        f"VECTOR PRECISION (recall@{args.top_k}, re-scoring top {args.fetch_k})",
+        ["Precision", "Index", "Recall", "Query", "Rescored", "Rescored q"],
+        rows,
+    )
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Scenario: ONNX Runtime backends, parity and throughput
+# ---------------------------------------------------------------------------
+def bench_onnx(args: argparse.Namespace) -> dict:
+    import numpy as np
+    from langchain_community.vectorstores import FAISS
+
+    import evaluate_rag
+    from docuchat.core.config import RAGConfig
+    from docuchat.core.embeddings import make_hf_embeddings, make_onnx_embeddings
+    from docuchat.core.rag import split_documents
+
+    chunks = _fixture_chunks(args.chunks)
+    config = RAGConfig()
+    qa_docs = split_documents(
+        [{"original_name": name, "text_content": text} for name, text in evaluate_rag.load_fixture_docs().items()],
+        config,
+    )
+    backends = {
+        "torch": make_hf_embeddings,
+        "onnx": make_onnx_embeddings,
+        "onnx-int8": lambda: make_onnx_embeddings(quantize=True),
+    }
+    reference = None
+    results = {}
+    rows = []
+    for name, factory in backends.items():
+        model = factory()
+        model.embed_documents(chunks[:32])  # load the model, warm kernels
+        t0 = time.perf_counter()
+        vectors = np.asarray(model.embed_documents(chunks), dtype="float32")
+        elapsed = time.perf_counter() - t0
+        if reference is None:
+            reference = vectors
+        cosines = (vectors * reference).sum(axis=1)  # both sides are L2-normalized
+        quality = evaluate_rag.score_retrieval(FAISS.from_documents(qa_docs, model), config)
+        row = {
+            "chunks_per_sec": len(chunks) / elapsed,
+            "seconds": elapsed,
+            "mean_cosine": float(cosines.mean()),
+            "min_cosine": float(cosines.min()),
+            "hit_rate": quality["hit_rate"],
+            "mrr": quality["mrr"],
+        }
+        results[name] = row
+        speedup = row["chunks_per_sec"] / results["torch"]["chunks_per_sec"]
+        rows.append([
+            name, f"{row['chunks_per_sec']:.0f}", f"{speedup:.2f}x",
+            f"{row['mean_cosine']:.4f}", f"{row['min_cosine']:.4f}",
+            f"{row['hit_rate'] * 100:.1f}%", f"{row['mrr']:.3f}",
+        ])
+    _print_table(
+        f"EMBEDDING BACKENDS ({len(chunks)} chunks, {os.cpu_count()} cores; cosine vs. torch)",
+        ["Backend", "Chunks/s", "Speed-up", "Mean cos", "Min cos", "Hit rate", "MRR"],
+        rows,
+    )
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Scenario: cold vs. warm first request
+# ---------------------------------------------------------------------------
+_FIRST_REQUEST = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+from pathlib import Path
+from docuchat.core import warmup
+from docuchat.core.config import get_rag_config
+from docuchat.core.rag import build_vector_store
+from docuchat.core.retrieval import retrieve
+
+warmup_seconds = 0.0
+if {warm}:
+    t0 = time.perf_counter()
+    report = warmup.warm_up()
+    assert report.ready, report.error
+    warmup_seconds = time.perf_counter() - t0
+
+def request():
+    text = Path({fixture!r}).read_text()
+    store = build_vector_store([{{"original_name": "policy.txt", "text_content": text}}])
+    c = get_rag_config()
+    retrieve(store, "How many days of annual leave do employees get?", c.top_k, c.fetch_k,
+             c.score_threshold, c.lambda_mult, min_k=c.min_k, gap_factor=c.gap_factor)
+
+t0 = time.perf_counter(); request(); first = time.perf_counter() - t0
+t0 = time.perf_counter(); request(); second = time.perf_counter() - t0
+print(json.dumps({{"warmup_seconds": warmup_seconds, "first_ms": first * 1000, "second_ms": second * 1000}}))
+"""
+
+
+def bench_coldstart(args: argparse.Namespace) -> dict:
+    results = {}
+    rows = []
+    fixture = str(FIXTURES_DIR / "company_policy.txt")
+    for label, warm in [("cold", False), ("warm", True)]:
+        code = _FIRST_REQUEST.format(root=str(REPO_ROOT), warm=warm, fixture=fixture)
+        runs = [_run_isolated(code) for _ in range(args.repeat)]
+        row = {key: sorted(r[key] for r in runs)[len(runs) // 2] for key in runs[0]}  # median
+        results[label] = row
+        rows.append([
+            label, f"{row['warmup_seconds']:.2f} s" if warm else "-",
+            f"{row['first_ms']:.0f} ms", f"{row['second_ms']:.0f} ms",
+        ])
+    _print_table(
+        f"FIRST REQUEST AFTER START-UP (median of {args.repeat} fresh processes)",
+        ["Start", "Warm-up", "1st request", "2nd request"],
+        rows,
+    )
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Scenario: index / retrieval scaling without model cost
+# ---------------------------------------------------------------------------
+def bench_scale(args: argparse.Namespace) -> dict:
+    from langchain_community.vectorstores import FAISS
+
+    from docuchat.core.config import RAGConfig
+    from docuchat.core.embeddings import HashingEmbeddings
+    from docuchat.core.index_manager import estimate_store_bytes
+    from docuchat.core.retrieval import retrieve
+
+    config = RAGConfig(top_k=args.top_k, fetch_k=args.fetch_k)
+
+    def ask(store, question: str) -> None:
+        retrieve(
+            store, question,
+            top_k=config.top_k, fetch_k=config.fetch_k,
+            score_threshold=config.score_threshold, lambda_mult=config.lambda_mult,
+            min_k=config.min_k, gap_factor=config.gap_factor,
+        )
+
+    embeddings = HashingEmbeddings(args.dim)
+    base = _fixture_chunks(1000)
+    queries = [" ".join(c.split()[5:15]) for c in base[: args.queries]]
+    results = {}
+    rows = []
+    for n in args.chunks:
+        chunks = [f"{base[i % len(base)]} [{i}]" for i in range(n)]
+        t0 = time.perf_counter()
+        vectors = []
+        for start in range(0, n, 10_000):  # bounded peak memory for lists of floats
+            vectors.extend(embeddings.embed_documents(chunks[start:start + 10_000]))
+        embed_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        store = FAISS.from_embeddings(list(zip(chunks, vectors)), embeddings)
+        build_s = time.perf_counter() - t0
+        del vectors
+        for q in queries[:5]:
+            ask(store, q)  # warm-up
+        t0 = time.perf_counter()
+        for q in queries:
+            ask(store, q)
+        query_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        row = {
+            "embed_chunks_per_sec": n / embed_s,
+            "build_s": build_s,
+            "query_ms": query_ms,
+            "index_bytes": estimate_store_bytes(store),
+        }
+        results[f"chunks-{n}"] = row
+        rows.append([
+            f"{n:,}", f"{row['embed_chunks_per_sec']:,.0f}", f"{build_s:.2f} s",
+            f"{row['index_bytes'] / 1e6:,.0f} MB", f"{query_ms:.2f} ms",
+        ])
+        del store, chunks
+    _print_table(
+        f"INDEX / RETRIEVAL SCALING (hashing embedder, {args.dim} dims, top {args.top_k} of {args.fetch_k})",
+        ["Chunks", "Embed/s", "Build", "Index", "Query"],
+        rows,
+    )
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Scenario: metrics recording overhead
+# ---------------------------------------------------------------------------
+def bench_metrics(args: argparse.Namespace) -> dict:
+    from concurrent.futures import ThreadPoolExecutor
+
+    from docuchat.core.metrics import MetricsRegistry
+
+    registry = MetricsRegistry()
+    counter = registry.counter("bench_total", "bench")
+    histogram = registry.histogram("bench_seconds", "bench")
+    labeled = registry.histogram("bench_labeled_seconds", "bench", ("format",))
+    operations = {
+        "counter": counter.inc,
+        "histogram": lambda: histogram.observe(0.042),
+        "labeled_histogram": lambda: labeled.labels("pdf").observe(0.042),
+    }
+
+    def loop(op, n: int) -> None:
+        for _ in range(n):
+            op()
+
+    results = {}
+    rows = []
+    for threads in args.threads:
+        row = {}
+        for name, op in operations.items():
+            per_thread = args.ops // threads
+            with ThreadPoolExecutor(threads) as pool:
+                t0 = time.perf_counter()
+                list(pool.map(lambda _: loop(op, per_thread), range(threads)))
+                elapsed = time.perf_counter() - t0
+            row[f"{name}_per_sec"] = per_thread * threads / elapsed
+        results[f"threads-{threads}"] = row
+        rows.append([threads] + [f"{1e9 / row[f'{name}_per_sec']:.0f} ns" for name in operations])
+    _print_table(
+        f"METRICS RECORDING COST ({args.ops:,} ops, wall time per op)",
+        ["Threads", "Counter", "Histogram", "Labeled hist."],
+        rows,
+    )
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Scenario: per-document map-reduce answering
+# ---------------------------------------------------------------------------
+def bench_mapreduce(args: argparse.Namespace) -> dict:
+    from langchain_community.vectorstores import FAISS
+
+    import docuchat.core.rag as rag
+    from docuchat.core.config import RAGConfig
+    from docuchat.core.embeddings import HashingEmbeddings
+    from docuchat.core.scheduler import LLMScheduler
+
+    def fake_generate(llm, messages, on_token=None):
+        time.sleep(args.map_latency if llm.model_name == rag._MAP_MODEL else args.answer_latency)
+        if on_token:
+            on_token("answer")
+        return "notes"
+
+    scheduler = LLMScheduler(rate_per_minute=60_000, burst=1_000)
+    rag._generate = fake_generate
+    rag.get_scheduler = lambda api_key: scheduler
+    config = RAGConfig(score_threshold=-1.0)  # every document counts as relevant
+    question = "Compare the warranty terms across all documents"
+    base = _fixture_chunks(200)
+
+    results = {}
+    rows = []
+    for n in args.docs:
+        texts = base[: 10 * n]
+        store = FAISS.from_texts(
+            texts, HashingEmbeddings(), metadatas=[{"source": f"doc_{i % n}"} for i in range(len(texts))]
+        )
+        t0 = time.perf_counter()
+        plan = rag.plan_map_reduce(question, store, config)
+        first = None
+        for source, _ in rag.stream_map_reduce(question, plan, "gsk_bench"):
+            if first is None:
+                first = time.perf_counter() - t0
+        total = time.perf_counter() - t0
+        results[f"docs-{n}"] = {"first_partial_seconds": first, "total_seconds": total}
+        rows.append([
+            n, len(plan), f"{first:.2f} s", f"{total:.2f} s",
+            f"{n * args.map_latency + args.answer_latency:.2f} s",
+        ])
+    _print_table(
+        f"MAP-REDUCE ANSWERING (map call {args.map_latency}s, answer call {args.answer_latency}s, "
+        f"{rag._MAP_CONCURRENCY} in flight)",
+        ["Documents", "Mapped", "First note", "Total", "Sequential"],
+        rows,
+    )
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Scenario: sharded scatter-gather query throughput
+# ---------------------------------------------------------------------------
+def bench_shards(args: argparse.Namespace) -> dict:
+    import statistics
+    from concurrent.futures import ThreadPoolExecutor
+
+    from langchain_community.vectorstores import FAISS
+
+    from docuchat.core.embeddings import HashingEmbeddings
+    from docuchat.core.sharding import ShardedIndex, shard_directory
+
+    vectors = _clustered_vectors(args.vectors + args.queries, args.dim)
+    corpus, queries = vectors[: args.vectors], vectors[args.vectors:]
+    embeddings = HashingEmbeddings(args.dim)  # never called: queries arrive embedded
+
+    def run(index: ShardedIndex) -> tuple[float, list[float]]:
+        def one(q) -> float:
+            t0 = time.perf_counter()
+            index.retrieve_vector(q[None, :], args.top_k, args.fetch_k, -1.0, 0.7)
+            return (time.perf_counter() - t0) * 1000
+
+        with ThreadPoolExecutor(max_workers=args.clients) as clients:
+            list(clients.map(one, queries[: args.clients * 2]))  # warm-up
+            t0 = time.perf_counter()
+            latencies = list(clients.map(one, queries))
+        return len(queries) / (time.perf_counter() - t0), latencies
+
+    results = {}
+    rows = []
+    for shards in args.shards:
+        with tempfile.TemporaryDirectory() as kb_dir:
+            for shard in range(shards):
+                rows_of_shard = range(shard, args.vectors, shards)
+                store = FAISS.from_embeddings(
+                    [(f"chunk {i}", corpus[i]) for i in rows_of_shard], embeddings,
+                    metadatas=[{"source": f"doc_{i // 50}"} for i in rows_of_shard],
+                )
+                store.save_local(os.path.join(shard_directory(kb_dir, shard, shards), "index"))
+                del store
+            index = ShardedIndex(kb_dir, embeddings)
+            try:
+                qps, latencies = run(index)
+            finally:
+                index.close()
+        p50 = statistics.median(latencies)
+        results[f"shards-{shards}"] = {"queries_per_sec": qps, "p50_ms": p50}
+        base = results[f"shards-{args.shards[0]}"]["queries_per_sec"]
+        rows.append([shards, f"{qps:,.0f}", f"{p50:.1f} ms", f"{qps / base:.2f}x"])
+    _print_table(
+        f"SHARDED SEARCH THROUGHPUT ({args.vectors:,} vectors, {args.clients} clients, "
+        f"{os.cpu_count()} cores)",
+        ["Shards", "Queries/s", "p50", f"vs {args.shards[0]} shard"],
+        rows,
+    )
+    if max(args.shards) > (os.cpu_count() or 1):
+        print(
+            f"  Note: {max(args.shards)} shards on {os.cpu_count()} cores share CPUs, so these "
+            "numbers cannot show scaling; run on at least as many cores as shards."
+        )
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Scenario: per-replica models vs. one shared embedding server
+# ---------------------------------------------------------------------------
+_REPLICA = """
+import json, sys, threading, time
+sys.path.insert(0, {root!r})
+from docuchat.core.embeddings import create_embeddings
+from docuchat.core.metrics import process_rss_bytes
+
+t0 = time.perf_counter()
+embeddings = create_embeddings()
+embeddings.embed_query("warm-up")
+load = time.perf_counter() - t0
+
+lock = threading.Lock()
+questions = iter(range({queries}))
+
+def client():
+    while True:
+        with lock:
+            i = next(questions, None)
+        if i is None:
+            return
+        embeddings.embed_query(f"How many days of leave does policy {{i}} grant?")
+
+time.sleep(max(0.0, {start_at} - time.time()))  # all replicas start querying together
+threads = [threading.Thread(target=client) for _ in range({clients})]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+print(json.dumps({{"load_seconds": load, "finished_at": time.time(), "rss": process_rss_bytes()}}))
+"""
+
+
+def _run_replicas(args: argparse.Namespace, env: dict) -> tuple[list[dict], float]:
+    """Start ``--replicas`` processes together; returns their reports and queries/sec."""
+    start_at = time.time() + args.startup
+    code = _REPLICA.format(
+        root=str(REPO_ROOT), queries=args.queries, clients=args.clients, start_at=start_at
+    )
+    procs = [
+        subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, text=True,
+                         cwd=REPO_ROOT, env=env)
+        for _ in range(args.replicas)
+    ]
+    reports = []
+    for proc in procs:
+        out, _ = proc.communicate()
+        if proc.returncode:
+            raise RuntimeError("replica failed (is --startup long enough for the model load?)")
+        reports.append(json.loads(out.strip().splitlines()[-1]))
+    if max(r["load_seconds"] for r in reports) > args.startup:
+        print("  ⚠️   a replica loaded after the common start; raise --startup")
+    elapsed = max(r["finished_at"] for r in reports) - start_at
+    return reports, args.replicas * args.queries / elapsed
+
+
+def _server_metric(address: str, name: str) -> float:
+    from docuchat.core.embed_server import RemoteEmbeddings
+
+    text = RemoteEmbeddings(address)._request("GET", "/metrics")[0].decode()
+    return next(float(line.split()[-1]) for line in text.splitlines() if line.startswith(name + " "))
+
+
+def bench_embedserver(args: argparse.Namespace) -> dict:
+    env = dict(os.environ)
+    if args.backend:
+        env["DOCUCHAT_EMBEDDINGS"] = args.backend
+    env.pop("DOCUCHAT_EMBED_SERVER", None)
+
+    results = {}
+    rows = []
+    reports, qps = _run_replicas(args, env)
+    load = max(r["load_seconds"] for r in reports)
+    rss = sum(r["rss"] for r in reports)
+    results["per-replica"] = {"load_seconds": load, "rss_mb": rss / 2**20, "queries_per_sec": qps}
+    rows.append(["per-replica", f"{load:.2f} s", f"{rss / 2**20:,.0f} MB", f"{qps:,.0f}", "1.0"])
+
+    for delay in args.max_delay_ms:
+        with tempfile.TemporaryDirectory() as tmp:
+            address = f"unix:{tmp}/embed.sock"
+            server = subprocess.Popen(
+                [sys.executable, "-m", "docuchat.cli", "embed-server", "--socket", address[5:],
+                 "--max-delay-ms", str(delay)],
+                stdout=subprocess.DEVNULL, cwd=REPO_ROOT, env=env,
+            )
+            try:
+                replica_env = {**env, "DOCUCHAT_EMBED_SERVER": address}
+                # The client retries until the server has loaded its model and bound the socket
+                calls_before = _server_metric(address, "docuchat_embed_server_batch_texts_count")
+                texts_before = _server_metric(address, "docuchat_embed_server_batch_texts_sum")
+                reports, qps = _run_replicas(args, replica_env)
+                calls = _server_metric(address, "docuchat_embed_server_batch_texts_count") - calls_before
+                texts = _server_metric(address, "docuchat_embed_server_batch_texts_sum") - texts_before
+                rss = sum(r["rss"] for r in reports)
+                rss += _server_metric(address, "docuchat_process_resident_bytes")
+            finally:
+                server.terminate()
+                server.wait()
+        load = max(r["load_seconds"] for r in reports)
+        per_call = texts / max(calls, 1)
+        results[f"shared-{delay:g}ms"] = {
+            "load_seconds": load, "rss_mb": rss / 2**20,
+            "queries_per_sec": qps, "texts_per_call": per_call,
+        }
+        rows.append([
+            f"shared {delay:g} ms", f"{load:.2f} s", f"{rss / 2**20:,.0f} MB",
+            f"{qps:,.0f}", f"{per_call:.1f}",
+        ])
+    _print_table(
+        f"EMBEDDING: {args.replicas} REPLICAS × {args.clients} CLIENTS "
+        f"({env.get('DOCUCHAT_EMBEDDINGS', 'minilm')}, {os.cpu_count()} cores)",
+        ["Model", "Replica load", "Total RSS", "Queries/s", "Texts/call"],
+        rows,
+    )
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Scenario: UI rerun cost vs. session size
+# ---------------------------------------------------------------------------
+def bench_rerun(args: argparse.Namespace) -> dict:
+    import logging
+
+    from streamlit.testing.v1 import AppTest
+
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    app = str(REPO_ROOT / "docuchat" / "ui" / "app.py")
+    results = {}
+    rows = []
+    for turns in args.turns:
+        for docs in args.docs:
+            at = AppTest.from_file(app, default_timeout=120)
+            at.session_state.files = [
+                {
+                    "id": f"f{i}", "original_name": f"document_{i}.pdf", "path": "",
+                    "size": 250_000, "sha256": f"h{i}", "uploaded_at": "",
+                }
+                for i in range(docs)
+            ]
+            at.session_state.known_files = {f"h{i}" for i in range(docs)}
+            at.session_state.api_key = "gsk_" + "x" * 40
+            at.session_state.conversation = [
+                {
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "content": f"Message {i}: **answer** with a [Source 1] citation. " * 15,
+                    "timestamp": "",
+                }
+                for i in range(turns)
+            ]
+            at.run()  # first run pays imports and model warm-up
+            times = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                at.run()
+                times.append(time.perf_counter() - t0)
+            times.sort()
+            rerun_ms = times[len(times) // 2] * 1000
+            results[f"turns-{turns}-docs-{docs}"] = {"rerun_ms": rerun_ms}
+            rows.append([turns, docs, f"{rerun_ms:.0f} ms", len(at.chat_message)])
+    _print_table("UI RERUN (median server-side time)", ["Turns", "Documents", "Rerun", "Bubbles"], rows)
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Scenario: header / footer boilerplate stripping
+# ---------------------------------------------------------------------------
+def _make_pdf(path: Path, pages: list[list[str]]) -> None:
+    """Write a minimal PDF with one Helvetica text line per entry on each page."""
+    n = len(pages)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>"
+        % (b" ".join(b"%d 0 R" % (4 + 2 * i) for i in range(n)), n),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, lines in enumerate(pages):
+        ops = ["BT /F1 10 Tf 12 TL 50 780 Td"]
+        for line in lines:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            ops.append(f"({escaped}) Tj T*")
+        stream = "\n".join(ops + ["ET"]).encode("latin-1", "replace")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (5 + 2 * i)
+        )
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(out))
+
+
+def _make_report(path: Path, title: str, pages: int, body: list[str], width: int = 95) -> None:
+    """A corporate-report style PDF: running header, legal notice, numbered footer."""
+    import textwrap
+
+    lines = [l for chunk in body for l in textwrap.wrap(chunk, width)]
+    per_page = 45
+    _make_pdf(path, [
+        [
+            f"ACME Corporation  |  {title}",
+            "CONFIDENTIAL - for internal use only",
+            *lines[(p * per_page) % len(lines):][:per_page],
+            "(c) 2025 ACME Corporation. All rights reserved. Do not distribute.",
+            f"Page {p + 1} of {pages}",
+        ]
+        for p in range(pages)
+    ])
+
+
+def bench_boilerplate(args: argparse.Namespace) -> dict:
+    from docuchat.core.document import _extract_pdf
+    from docuchat.core.rag import split_documents
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [Path(f) for f in args.files]
+        if not paths:
+            body = _fixture_chunks(400)
+            for d in range(args.docs):
+                path = Path(tmp) / f"report_{d + 1}.pdf"
+                _make_report(path, f"Annual Report {2020 + d}", args.pages, body, width=95 - 3 * d)
+                paths.append(path)
+            print(f"📝  Generated {args.docs} × {args.pages}-page reports")
+
+        stats = {}
+        for label, strip in [("raw", False), ("stripped", True)]:
+            t0 = time.perf_counter()
+            files = [
+                {"original_name": p.name, "text_content": _extract_pdf(str(p), boilerplate=strip)}
+                for p in paths
+            ]
+            extract_s = time.perf_counter() - t0
+            chunks = split_documents(files)
+            stats[label] = {
+                "extract_seconds": extract_s,
+                "chars": sum(len(f["text_content"]) for f in files),
+                "chunks": len(chunks),
+            }
+
+    raw, stripped = stats["raw"], stats["stripped"]
+    results = {
+        **{f"{label}_{k}": v for label, row in stats.items() for k, v in row.items()},
+        "char_reduction_pct": 100 * (1 - stripped["chars"] / raw["chars"]),
+        "chunk_reduction_pct": 100 * (1 - stripped["chunks"] / raw["chunks"]),
+    }
+    _print_table(
+        f"BOILERPLATE STRIPPING ({len(paths)} PDFs)",
+        ["Text", "Chars", "Chunks", "Extract"],
+        [
+            [label, f"{row['chars']:,}", f"{row['chunks']:,}", f"{row['extract_seconds'] * 1000:.0f} ms"]
+            for label, row in stats.items()
+        ] + [[
+            "reduction", f"{results['char_reduction_pct']:.1f}%",
+            f"{results['chunk_reduction_pct']:.1f}%", "",
+        ]],
+    )
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Entry point
+# ---------------------------------------------------------------------------
+def main(argv: list[str] | None = None) -> int:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--json", action="store_true", help=f"merge results into {RESULTS_PATH}")
+    regression.add_arguments(common)
+    parser = argparse.ArgumentParser(description="DocuChat performance benchmarks")
+    sub = parser.add_subparsers(dest="scenario", required=True)
+
+    p = sub.add_parser("docx", parents=[common], help="streaming vs. DOM DOCX extraction")
+    p.add_argument("--pages", type=int, nargs="+", default=[50, 500])
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_docx)
+
+    p = sub.add_parser("embed", parents=[common], help="embedding pool throughput")
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    p.add_argument("--chunks", type=int, default=2000)
+    p.set_defaults(func=bench_embed)
+
+    p = sub.add_parser("quant", parents=[common], help="float32 vs. float16/int8 vector storage")
+    p.add_argument("--vectors", type=int, default=100_000)
+    p.add_argument("--dim", type=int, default=384)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--top-k", type=int, default=6)
+    p.add_argument("--fetch-k", type=int, default=20)
+    p.add_argument("--model", action="store_true", help="embed fixture chunks with MiniLM instead")
+    p.set_defaults(func=bench_quant)
+
+    p = sub.add_parser("onnx", parents=[common], help="PyTorch vs. ONNX Runtime embeddings")
+    p.add_argument("--chunks", type=int, default=2000)
+    p.set_defaults(func=bench_onnx)
+
+    p = sub.add_parser("coldstart", parents=[common], help="first-request latency, cold vs. warmed up")
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_coldstart)
+
+    p = sub.add_parser("scale", parents=[common], help="index/retrieval scaling, no model needed")
+    p.add_argument("--chunks", type=int, nargs="+", default=[10_000, 100_000])
+    p.add_argument("--dim", type=int, default=384)
+    p.add_argument("--queries", type=int, default=100)
+    p.add_argument("--top-k", type=int, default=6)
+    p.add_argument("--fetch-k", type=int, default=20)
+    p.set_defaults(func=bench_scale)
+
+    p = sub.add_parser("metrics", parents=[common], help="metrics recording overhead")
+    p.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    p.add_argument("--ops", type=int, default=1_000_000)
+    p.set_defaults(func=bench_metrics)
+
+    p = sub.add_parser("mapreduce", parents=[common], help="per-document map-reduce latency")
+    p.add_argument("--docs", type=int, nargs="+", default=[2, 4, 8])
+    p.add_argument("--map-latency", type=float, default=0.8, help="simulated per-document call (s)")
+    p.add_argument("--answer-latency", type=float, default=2.0, help="simulated final call (s)")
+    p.set_defaults(func=bench_mapreduce)
+
+    p = sub.add_parser("shards", parents=[common], help="sharded scatter-gather query throughput")
+    p.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    p.add_argument("--vectors", type=int, default=400_000)
+    p.add_argument("--dim", type=int, default=384)
+    p.add_argument("--queries", type=int, default=400)
+    p.add_argument("--clients", type=int, default=8, help="concurrent querying threads")
+    p.add_argument("--top-k", type=int, default=6)
+    p.add_argument("--fetch-k", type=int, default=20)
+    p.set_defaults(func=bench_shards)
+
+    p = sub.add_parser("embedserver", parents=[common], help="per-replica models vs. a shared server")
+    p.add_argument("--replicas", type=int, default=4)
+    p.add_argument("--clients", type=int, default=4, help="concurrent querying threads per replica")
+    p.add_argument("--queries", type=int, default=200, help="queries per replica")
+    p.add_argument("--max-delay-ms", type=float, nargs="+", default=[0.0, 5.0])
+    p.add_argument("--backend", help="DOCUCHAT_EMBEDDINGS for this run (default: as configured)")
+    p.add_argument("--startup", type=float, default=30.0, help="seconds allowed for replica start-up")
+    p.set_defaults(func=bench_embedserver)
+
+    p = sub.add_parser("rerun", parents=[common], help="Streamlit rerun time vs. session size")
+    p.add_argument("--turns", type=int, nargs="+", default=[10, 500])
+    p.add_argument("--docs", type=int, nargs="+", default=[5, 200])
+    p.add_argument("--repeat", type=int, default=7)
+    p.set_defaults(func=bench_rerun)
+
+    p = sub.add_parser("boilerplate", parents=[common], help="header/footer stripping reduction")
+    p.add_argument("--files", nargs="*", default=[], help="real PDFs (default: generated reports)")
+    p.add_argument("--docs", type=int, default=5)
+    p.add_argument("--pages", type=int, default=100)
+    p.set_defaults(func=bench_boilerplate)
+
+    args = parser.parse_args(argv)
+    comparing = args.compare is not None
+    baseline_path = Path(args.compare) if args.compare else RESULTS_PATH
+    baseline = None
+    if comparing:
+        stored = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+        baseline = stored.get(args.scenario)
+        if baseline is None:
+            print(f"No '{args.scenario}' results in {baseline_path}; run with --json first.")
+            return 2
+        for i in range(args.warmup):
+            print(f"🔥  Warm-up run {i + 1}/{args.warmup}")
+            args.func(args)
+        runs = []
+        for i in range(args.trials):
+            print(f"⏱️   Trial {i + 1}/{args.trials}")
+            runs.append(args.func(args))
+        results = regression.median_of_trials(runs)
+    else:
+        results = args.func(args)
+
+    ok = True
+    if comparing:
+        findings = regression.compare(baseline, results, regression.tolerances_from(args))
+        ok = regression.print_comparison(
+            findings, f"REGRESSION CHECK: {args.scenario} vs. {baseline_path}"
+        )
+
+    if args.json:
+        report = json.loads(RESULTS_PATH.read_text()) if RESULTS_PATH.exists() else {}
+        report[args.scenario] = results
+        RESULTS_PATH.parent.mkdir(exist_ok=True)
+        RESULTS_PATH.write_text(json.dumps(report, indent=2))
+        print(f"  📄  JSON report saved to {RESULTS_PATH}\n")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,17 +10,34 @@ Metrics computed
   MRR           : Mean Reciprocal Rank — rewards correct answers ranked higher
   Precision @6  : Fraction of top-6 retrieved chunks that are truly relevant
   Avg Latency   : Mean retrieval time per query in milliseconds
+  Adaptive k    : Chunks / context tokens sent, retrieval latency and answer
+                  hit rate (a sent chunk holds a gold keyword) for the
+                  previous fixed top-6 pipeline vs. adaptive retrieval
+                  policies — use this table to tune ``min_k``/``gap_factor``
+  Fast path     : Share of questions the extractive answerer would answer
+                  without the LLM, and how often that sentence is right
+                  (holds a gold keyword, from the right document), per
+                  confidence threshold — use it to tune
+                  ``extractive_confidence``
 
 Run
 ---
     python tests/evaluate_rag.py           # pretty-print report
     python tests/evaluate_rag.py --json    # also write results/eval_report.json
+    python tests/evaluate_rag.py --compare # regression gate vs. results/eval_report.json
+    python tests/evaluate_rag.py --compare old.json --trials 10 --latency-tol 0.2
+
+``--compare`` warms up, times every query ``--trials`` times, and exits
+non-zero if accuracy drops or latency regresses beyond its noise-aware
+tolerance (see ``regression.py``).
 """
 
 from __future__ import annotations
 
+import argparse
 import json
 import os
+import statistics
 import sys
 import time
 from dataclasses import dataclass, field, asdict
@@ -31,7 +48,13 @@ from typing import Optional
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from docuchat.core.document import extract_text_from_file
+from docuchat.core.extractive import _MIN_MARGIN, best_sentence, is_lookup_question
+from docuchat.core.config import RAGConfig
+from docuchat.core.history import estimate_tokens
 from docuchat.core.rag import build_vector_store
+from docuchat.core.retrieval import retrieve
+
+import regression
 
 # ---------------------------------------------------------------------------
 # QA Dataset — 30 questions across 3 documents, each tagged with at least one
@@ -272,7 +295,12 @@ class QueryResult:
     reciprocal_rank: float = 0.0
     precision_at_6: float = 0.0
     latency_ms: float = 0.0
+    latency_samples_ms: list[float] = field(default_factory=list)  # one per trial
     top_sources: list[str] = field(default_factory=list)
+    # Per retrieval policy: {"chunks", "tokens", "hit", "ms", "mmr"}
+    policies: dict[str, dict] = field(default_factory=dict)
+    # Best extractive answer: {"sentence", "confidence", "margin", "eligible", "correct"}
+    extractive: dict = field(default_factory=dict)
 
 
 def _chunk_contains_any(chunk_text: str, keywords: list[str]) -> bool:
@@ -292,41 +320,206 @@ def _build_stores(all_docs: dict[str, str]) -> dict[str, object]:
     return stores
 
 
-def _build_combined_store(all_docs: dict[str, str]) -> object:
+def _build_combined_store(all_docs: dict[str, str], config: RAGConfig | None = None) -> object:
     """Build a single FAISS store from all documents combined."""
     file_list = [
         {"original_name": name, "text_content": text}
         for name, text in all_docs.items()
     ]
-    return build_vector_store(file_list)
+    return build_vector_store(file_list, config)
+
+
+def load_fixture_docs() -> dict[str, str]:
+    """Extracted text of the three fixture documents, keyed by filename."""
+    all_docs: dict[str, str] = {}
+    for filename in ["company_policy.txt", "product_spec.txt", "research_paper.txt"]:
+        path = str(FIXTURES_DIR / filename)
+        all_docs[filename] = extract_text_from_file(path, filename)
+    return all_docs
+
+
+def build_store(all_docs: dict[str, str], config: RAGConfig) -> tuple[object, dict]:
+    """Build the combined store with ``config``'s chunking; return it with size/time stats."""
+    from docuchat.core.index_manager import estimate_store_bytes
+
+    t0 = time.perf_counter()
+    store = _build_combined_store(all_docs, config)
+    build_s = time.perf_counter() - t0
+    return store, {
+        "chunks": store.index.ntotal,
+        "index_bytes": estimate_store_bytes(store),
+        "build_s": round(build_s, 3),
+    }
+
+
+def score_retrieval(store, config: RAGConfig) -> dict:
+    """
+    Hit rate, MRR, context size and latency of the chunks ``config`` would
+    send to the LLM, over the whole QA dataset.
+    """
+    hits, rr, tokens, latency = 0, 0.0, 0, 0.0
+    for qa in QA_DATASET:
+        t0 = time.perf_counter()
+        docs = _retrieve(store, qa["question"], config).docs
+        latency += (time.perf_counter() - t0) * 1000
+        ranks = [i for i, d in enumerate(docs, 1) if _chunk_contains_any(d.page_content, qa["gold_keywords"])]
+        hits += bool(ranks)
+        rr += 1.0 / ranks[0] if ranks else 0.0
+        tokens += estimate_tokens("\n\n".join(d.page_content for d in docs))
+    n = len(QA_DATASET)
+    return {
+        "hit_rate": round(hits / n, 4),
+        "mrr": round(rr / n, 4),
+        "avg_tokens": round(tokens / n, 1),
+        "latency_ms": round(latency / n, 3),
+    }
+
+
+# Adaptive retrieval policies compared against the fixed pipeline; the first
+# one matches the defaults used by get_ai_response.
+ADAPTIVE_POLICIES: dict[str, dict] = {
+    "adaptive (min 2, gap x3)": {"min_k": 2, "gap_factor": 3.0},
+    "adaptive (min 1, gap x3)": {"min_k": 1, "gap_factor": 3.0},
+    "adaptive (min 1, gap x2)": {"min_k": 1, "gap_factor": 2.0},
+    "adaptive (min 2, gap x5)": {"min_k": 2, "gap_factor": 5.0},
+}
+FIXED_POLICY = "fixed top-6 (previous)"
+
+
+def _fixed_retrieval(store, question: str, config: RAGConfig) -> tuple[list, bool]:
+    """The pre-adaptive pipeline: MMR retriever plus a score-filtered top-k."""
+    retriever = store.as_retriever(
+        search_type="mmr",
+        search_kwargs={"k": config.top_k, "fetch_k": config.fetch_k, "lambda_mult": config.lambda_mult},
+    )
+    mmr_docs = retriever.invoke(question)
+    scored = store.similarity_search_with_relevance_scores(question, k=config.top_k)
+    good_docs = [doc for doc, score in scored if score >= config.score_threshold]
+    return (good_docs or mmr_docs), True
+
+
+def _policy_outcome(docs: list, keywords: list[str], elapsed_ms: float, mmr: bool) -> dict:
+    context = "\n\n".join(doc.page_content for doc in docs)
+    return {
+        "chunks": len(docs),
+        "tokens": estimate_tokens(context),
+        "hit": any(_chunk_contains_any(doc.page_content, keywords) for doc in docs),
+        "ms": elapsed_ms,
+        "mmr": mmr,
+    }
+
+
+def _retrieve(store, question: str, config: RAGConfig):
+    return retrieve(
+        store,
+        question,
+        top_k=config.top_k,
+        fetch_k=config.fetch_k,
+        score_threshold=config.score_threshold,
+        lambda_mult=config.lambda_mult,
+        min_k=config.min_k,
+        gap_factor=config.gap_factor,
+    )
+
+
+EXTRACTIVE_THRESHOLDS = (0.5, 0.6, 0.7, 0.8)
+
+
+def _extractive_outcome(store, qa: dict, config: RAGConfig) -> dict:
+    """The sentence the extractive fast path would return, at any threshold."""
+    answer = best_sentence(qa["question"], _retrieve(store, qa["question"], config), store.embeddings)
+    if answer is None:
+        return {"sentence": "", "confidence": 0.0, "margin": 0.0, "eligible": False, "correct": False}
+    return {
+        "sentence": answer.sentence,
+        "confidence": round(answer.confidence, 4),
+        "margin": round(answer.margin, 4),
+        "eligible": is_lookup_question(qa["question"]) and answer.margin >= _MIN_MARGIN,
+        "correct": answer.source == qa["doc"]
+        and _chunk_contains_any(answer.sentence, qa["gold_keywords"]),
+    }
+
+
+def _summarize_extractive(results: list[QueryResult]) -> dict[str, dict]:
+    """Fast-path rate and accuracy of the answered questions, per threshold."""
+    summary = {}
+    for threshold in EXTRACTIVE_THRESHOLDS:
+        answered = [
+            r.extractive for r in results
+            if r.extractive["eligible"] and r.extractive["confidence"] >= threshold
+        ]
+        summary[f"{threshold:.2f}"] = {
+            "fast_path_rate": round(len(answered) / len(results), 4),
+            "fast_path_accuracy": (
+                round(sum(o["correct"] for o in answered) / len(answered), 4) if answered else None
+            ),
+        }
+    return summary
+
+
+def _timed(fn, trials: int) -> tuple[object, list[float]]:
+    """Call ``fn`` ``trials`` times; return its last result and each run's ms."""
+    samples = []
+    for _ in range(trials):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return result, samples
+
+
+def _compare_policies(store, qa: dict, config: RAGConfig, trials: int = 1) -> dict[str, dict]:
+    outcomes = {}
+    (docs, mmr), samples = _timed(lambda: _fixed_retrieval(store, qa["question"], config), trials)
+    outcomes[FIXED_POLICY] = _policy_outcome(docs, qa["gold_keywords"], statistics.median(samples), mmr)
+    outcomes[FIXED_POLICY]["ms_samples"] = samples
+    for label, params in ADAPTIVE_POLICIES.items():
+        policy = config.replace(**params)
+        result, samples = _timed(lambda: _retrieve(store, qa["question"], policy), trials)
+        outcomes[label] = _policy_outcome(
+            result.docs, qa["gold_keywords"], statistics.median(samples), result.mmr
+        )
+        outcomes[label]["ms_samples"] = samples
+    return outcomes
 
 
 # ---------------------------------------------------------------------------
 # Core evaluation logic
 # ---------------------------------------------------------------------------
-def evaluate(k_values: tuple[int, ...] = (1, 3, 6)) -> list[QueryResult]:
-    """Run retrieval evaluation on all QA pairs. Returns a list of QueryResult."""
+def evaluate(
+    k_values: tuple[int, ...] = (1, 3, 6),
+    config: RAGConfig | None = None,
+    trials: int = 1,
+    warmup: int = 0,
+) -> list[QueryResult]:
+    """
+    Run retrieval evaluation on all QA pairs. Returns a list of QueryResult.
+
+    ``warmup`` untimed passes over the dataset run first; each query is then
+    timed ``trials`` times and its latency is the median.
+    """
+    config = config or RAGConfig.from_env()
     print("\n📂  Loading test fixtures …", end="", flush=True)
-    all_docs: dict[str, str] = {}
-    for filename in ["company_policy.txt", "product_spec.txt", "research_paper.txt"]:
-        path = str(FIXTURES_DIR / filename)
-        text = extract_text_from_file(path, filename)
-        all_docs[filename] = text
+    all_docs = load_fixture_docs()
     print(" done ✓")
 
     print("🔨  Building FAISS vector store …", end="", flush=True)
-    combined_store = _build_combined_store(all_docs)
+    combined_store = _build_combined_store(all_docs, config)
     print(" done ✓\n")
 
     results: list[QueryResult] = []
     K_MAX = max(k_values)
 
+    for _ in range(warmup):
+        for qa in QA_DATASET:
+            combined_store.similarity_search_with_relevance_scores(qa["question"], k=K_MAX)
+            _compare_policies(combined_store, qa, config)
+
     for qa in QA_DATASET:
-        t0 = time.perf_counter()
-        docs_with_scores = combined_store.similarity_search_with_relevance_scores(
-            qa["question"], k=K_MAX
+        docs_with_scores, samples = _timed(
+            lambda: combined_store.similarity_search_with_relevance_scores(qa["question"], k=K_MAX),
+            trials,
         )
-        elapsed_ms = (time.perf_counter() - t0) * 1000
+        elapsed_ms = statistics.median(samples)
 
         # Check each rank position for relevance
         hit_rank: Optional[int] = None
@@ -355,7 +548,10 @@ def evaluate(k_values: tuple[int, ...] = (1, 3, 6)) -> list[QueryResult]:
             reciprocal_rank=rr,
             precision_at_6=precision_at_6,
             latency_ms=elapsed_ms,
+            latency_samples_ms=samples,
             top_sources=top_sources,
+            policies=_compare_policies(combined_store, qa, config, trials),
+            extractive=_extractive_outcome(combined_store, qa, config),
         )
         results.append(result)
 
@@ -378,7 +574,8 @@ def _pct(val: float) -> str:
     return f"{val * 100:.1f}%"
 
 
-def print_report(results: list[QueryResult]) -> dict:
+def print_report(results: list[QueryResult], config: RAGConfig | None = None) -> dict:
+    config = config or RAGConfig.from_env()
     total = len(results)
     hit_1 = sum(r.hit_at_1 for r in results)
     hit_3 = sum(r.hit_at_3 for r in results)
@@ -454,6 +651,42 @@ def print_report(results: list[QueryResult]) -> dict:
         print(f"  {r.id:<7}  {cat:<24}  {h1:>4}  {h3:>4}  {h6:>4}  {rr:>5}  {ms:>6}")
     print()
 
+    # Adaptive retrieval vs. the fixed pipeline
+    policy_summary = _summarize_policies(results)
+    base_tokens = policy_summary[FIXED_POLICY]["avg_tokens"]
+    print(f"\n{BOLD}  ADAPTIVE RETRIEVAL (context sent to the LLM){RESET}")
+    print(f"  {sep}")
+    print(f"  {'Policy':<28}  {'Chunks':>6}  {'Tokens':>6}  {'Saved':>6}  {'Hit':>6}  {'ms':>6}  {'MMR':>5}")
+    print(f"  {sep}")
+    for label, row in policy_summary.items():
+        saved = 1 - row["avg_tokens"] / base_tokens if base_tokens else 0.0
+        color = GREEN if row["hit_rate"] >= policy_summary[FIXED_POLICY]["hit_rate"] else RED
+        print(
+            f"  {label:<28}  {row['avg_chunks']:>6.2f}  {row['avg_tokens']:>6.0f}  "
+            f"{_pct(saved):>6}  {color}{_pct(row['hit_rate']):>6}{RESET}  "
+            f"{row['avg_latency_ms']:>6.1f}  {_pct(row['mmr_rate']):>5}"
+        )
+    print(f"  {GREY}Hit = a sent chunk contains a gold keyword; MMR = share of queries re-ranked{RESET}")
+    print()
+
+    # Extractive fast path
+    fast_path = _summarize_extractive(results)
+    print(f"\n{BOLD}  EXTRACTIVE FAST PATH (answers without an LLM call){RESET}")
+    print(f"  {sep}")
+    print(f"  {'Confidence threshold':<28}  {'Answered':>8}  {'Accuracy':>8}")
+    print(f"  {sep}")
+    for threshold, row in fast_path.items():
+        accuracy = row["fast_path_accuracy"]
+        shown = "—" if accuracy is None else _pct(accuracy)
+        color = GREY if accuracy is None else (GREEN if accuracy >= 0.95 else RED)
+        marker = "  (configured)" if float(threshold) == config.extractive_confidence else ""
+        print(
+            f"  {threshold + marker:<28}  {_pct(row['fast_path_rate']):>8}  "
+            f"{color}{shown:>8}{RESET}"
+        )
+    print(f"  {GREY}Accuracy = the returned sentence holds a gold keyword, from the right document{RESET}")
+    print()
+
     # Failures
     failures = [r for r in results if not r.hit_at_6]
     if failures:
@@ -465,7 +698,7 @@ def print_report(results: list[QueryResult]) -> dict:
 
     print(f"\n{CYAN}{'='*72}{RESET}\n")
 
-    return {
+    report = {
         "total_questions": total,
         "hit_rate_at_1": round(hit_1 / total, 4),
         "hit_rate_at_3": round(hit_3 / total, 4),
@@ -482,22 +715,75 @@ def print_report(results: list[QueryResult]) -> dict:
             }
             for docname, rs in docs.items()
         },
+        "retrieval_policies": policy_summary,
+        "extractive_fast_path": fast_path,
         "per_question": [asdict(r) for r in results],
     }
+    trial_means = _trial_means([r.latency_samples_ms for r in results])
+    if trial_means:
+        report["avg_latency_ms_trials"] = trial_means
+    return report
+
+
+def _trial_means(samples: list[list[float]]) -> list[float] | None:
+    """Per-trial averages across queries (``None`` for a single trial)."""
+    if not samples or len(samples[0]) < 2:
+        return None
+    return [round(sum(s[t] for s in samples) / len(samples), 3) for t in range(len(samples[0]))]
+
+
+def _summarize_policies(results: list[QueryResult]) -> dict[str, dict]:
+    summary = {}
+    for label in results[0].policies:
+        outcomes = [r.policies[label] for r in results]
+        n = len(outcomes)
+        summary[label] = {
+            "avg_chunks": round(sum(o["chunks"] for o in outcomes) / n, 3),
+            "avg_tokens": round(sum(o["tokens"] for o in outcomes) / n, 1),
+            "hit_rate": round(sum(o["hit"] for o in outcomes) / n, 4),
+            "avg_latency_ms": round(sum(o["ms"] for o in outcomes) / n, 2),
+            "mmr_rate": round(sum(o["mmr"] for o in outcomes) / n, 4),
+        }
+        trial_means = _trial_means([o["ms_samples"] for o in outcomes])
+        if trial_means:
+            summary[label]["avg_latency_ms_trials"] = trial_means
+    return summary
 
 
 # ---------------------------------------------------------------------------
 # Entry point
 # ---------------------------------------------------------------------------
-if __name__ == "__main__":
-    write_json = "--json" in sys.argv
-    results = evaluate()
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="DocuChat retrieval accuracy evaluation")
+    parser.add_argument("--json", action="store_true", help="also write results/eval_report.json")
+    regression.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    out_path = Path(__file__).parent.parent / "results" / "eval_report.json"
+    comparing = args.compare is not None
+    baseline_path = Path(args.compare) if args.compare else out_path
+    if comparing and not baseline_path.exists():
+        print(f"No baseline report at {baseline_path}; run with --json first.")
+        return 2
+
+    results = evaluate(
+        trials=args.trials if comparing else 1, warmup=args.warmup if comparing else 0
+    )
     metrics = print_report(results)
 
-    if write_json:
-        out_dir = Path(__file__).parent.parent / "results"
-        out_dir.mkdir(exist_ok=True)
-        out_path = out_dir / "eval_report.json"
+    ok = True
+    if comparing:
+        baseline = json.loads(baseline_path.read_text())
+        findings = regression.compare(baseline, metrics, regression.tolerances_from(args))
+        ok = regression.print_comparison(findings, f"REGRESSION CHECK vs. {baseline_path}")
+
+    if args.json:
+        out_path.parent.mkdir(exist_ok=True)
         with open(out_path, "w") as f:
             json.dump(metrics, f, indent=2)
         print(f"  📄  JSON report saved to {out_path}\n")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""
+DocuChat — Performance / Accuracy Regression Gate
+=================================================
+Shared by ``evaluate_rag.py --compare`` and ``benchmark.py --compare``:
+compares a fresh report against a stored baseline report and lists every
+metric that got worse by more than its tolerance.
+
+Metrics are recognised by name:
+
+  latency  (lower is better)  : *seconds*, *_ms*, *latency*, build_s
+  memory   (lower is better)  : *rss*, *_mb, *_bytes
+  throughput (higher is better): *per_sec*
+  accuracy (higher is better) : *hit_rate*, *mrr*, *recall*, *precision*
+
+Other numbers (counts, sizes of inputs) are informational and never fail.
+Timing tolerances are noise-aware: when repeated trials are available
+(``<metric>_trials`` lists next to the median), the allowed change is the
+larger of the relative tolerance and ``noise_sigmas`` standard deviations.
+"""
+
+from __future__ import annotations
+
+import re
+import statistics
+from dataclasses import dataclass
+
+_KINDS = [
+    ("accuracy", "higher", re.compile(r"hit_rate|mrr|recall|precision")),
+    ("throughput", "higher", re.compile(r"per_sec")),
+    ("memory", "lower", re.compile(r"rss|_mb$|_bytes$")),
+    ("latency", "lower", re.compile(r"seconds|(^|_)ms(_|$)|latency|^build_s$")),
+]
+
+RESET  = "\033[0m"
+BOLD   = "\033[1m"
+GREEN  = "\033[92m"
+RED    = "\033[91m"
+GREY   = "\033[90m"
+
+
+@dataclass
+class Tolerances:
+    latency: float = 0.15      # relative slow-down allowed
+    throughput: float = 0.15   # relative drop allowed
+    memory: float = 0.10       # relative growth allowed
+    accuracy: float = 0.0      # absolute drop allowed (retrieval is deterministic)
+    noise_sigmas: float = 3.0  # timing noise allowance, in standard deviations
+
+
+@dataclass
+class Finding:
+    path: str
+    kind: str
+    baseline: float
+    current: float
+    allowed: float    # largest acceptable worsening, in the metric's units
+    regressed: bool
+
+    @property
+    def change(self) -> float:
+        return (self.current - self.baseline) / self.baseline if self.baseline else 0.0
+
+
+def classify(name: str) -> tuple[str, str] | None:
+    """``(kind, better)`` for a metric name, or ``None`` if it is informational."""
+    for kind, better, pattern in _KINDS:
+        if pattern.search(name):
+            return kind, better
+    return None
+
+
+def median_of_trials(trials: list[dict]) -> dict:
+    """
+    Merge repeated runs of a nested metrics dict: every numeric leaf becomes
+    the median of the runs and the raw samples are kept as ``<leaf>_trials``.
+    """
+    first = trials[0]
+    merged: dict = {}
+    for key, value in first.items():
+        if isinstance(value, dict):
+            merged[key] = median_of_trials([t[key] for t in trials])
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            samples = [t[key] for t in trials]
+            merged[key] = statistics.median(samples)
+            if len(samples) > 1:
+                merged[f"{key}_trials"] = samples
+        else:
+            merged[key] = value
+    return merged
+
+
+def _leaves(report: dict, prefix: tuple = ()):
+    for key, value in report.items():
+        path = (*prefix, key)
+        if isinstance(value, dict):
+            yield from _leaves(value, path)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value, report.get(f"{key}_trials")
+
+
+def _lookup(report: dict, path: tuple):
+    node = parent = report
+    for part in path:
+        if not isinstance(node, dict) or part not in node:
+            return None, None
+        parent, node = node, node[part]
+    return node, parent.get(f"{path[-1]}_trials")
+
+
+def compare(baseline: dict, current: dict, tol: Tolerances | None = None) -> list[Finding]:
+    """Check every classified metric present in both reports."""
+    tol = tol or Tolerances()
+    findings = []
+    for path, base, base_trials in _leaves(baseline):
+        kind_better = classify(path[-1])
+        if kind_better is None:
+            continue
+        kind, better = kind_better
+        value, trials = _lookup(current, path)
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            continue
+
+        if kind == "accuracy":
+            allowed = tol.accuracy
+        else:
+            allowed = getattr(tol, kind) * abs(base)
+            samples = [s for s in (base_trials, trials) if s and len(s) > 1]
+            if kind in ("latency", "throughput") and samples:
+                noise = max(statistics.stdev(s) for s in samples)
+                allowed = max(allowed, tol.noise_sigmas * noise)
+        worsening = (value - base) if better == "lower" else (base - value)
+        findings.append(
+            Finding("/".join(path), kind, base, value, allowed, worsening > allowed + 1e-12)
+        )
+    return findings
+
+
+def print_comparison(findings: list[Finding], title: str) -> bool:
+    """Print a diff table; return True if nothing regressed."""
+    sep = "─" * 96
+    regressions = [f for f in findings if f.regressed]
+    print(f"\n{BOLD}  {title}{RESET}")
+    print(f"  {sep}")
+    print(f"  {'Metric':<46}  {'Baseline':>10}  {'Current':>10}  {'Change':>8}  {'Allowed':>9}  Status")
+    print(f"  {sep}")
+    for f in findings:
+        status = f"{RED}✗ REGRESSED{RESET}" if f.regressed else f"{GREEN}✓{RESET}"
+        print(
+            f"  {f.path[:46]:<46}  {f.baseline:>10.4g}  {f.current:>10.4g}  "
+            f"{f.change * 100:>+7.1f}%  {f.allowed:>9.3g}  {status}"
+        )
+    print(f"  {sep}")
+    if regressions:
+        print(f"  {RED}{BOLD}{len(regressions)} regression(s) against the baseline:{RESET}")
+        for f in regressions:
+            print(
+                f"  {RED}✗{RESET} {f.kind:<10} {f.path}: {f.baseline:.4g} → {f.current:.4g} "
+                f"({f.change * 100:+.1f}%, allowed ±{f.allowed:.3g})"
+            )
+    else:
+        print(f"  {GREEN}{BOLD}✅  No regressions ({len(findings)} metrics checked){RESET}")
+    print()
+    return not regressions
+
+
+def add_arguments(parser) -> None:
+    """Add ``--compare`` and the tolerance flags to an argparse parser."""
+    default = Tolerances()
+    parser.add_argument("--compare", nargs="?", const="", metavar="BASELINE",
+                        help="compare against a baseline report (default: the stored report)")
+    parser.add_argument("--trials", type=int, default=5, help="timed repetitions when comparing")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed warm-up runs when comparing")
+    parser.add_argument("--latency-tol", type=float, default=default.latency)
+    parser.add_argument("--throughput-tol", type=float, default=default.throughput)
+    parser.add_argument("--memory-tol", type=float, default=default.memory)
+    parser.add_argument("--accuracy-tol", type=float, default=default.accuracy)
+    parser.add_argument("--noise-sigmas", type=float, default=default.noise_sigmas)
+
+
+def tolerances_from(args) -> Tolerances:
+    return Tolerances(
+        latency=args.latency_tol,
+        throughput=args.throughput_tol,
+        memory=args.memory_tol,
+        accuracy=args.accuracy_tol,
+        noise_sigmas=args.noise_sigmas,
+    )
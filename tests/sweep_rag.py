@@ -0,0 +1,203 @@
+"""
+DocuChat — Chunking / Retrieval Parameter Sweep
+===============================================
+Evaluates a grid of ``RAGConfig`` settings on the ``evaluate_rag.py`` QA
+dataset and reports the Pareto frontier, so defaults can be chosen from data.
+Like ``evaluate_rag.py`` this needs no Groq API key.
+
+Each chunking setting (chunk_size × chunk_overlap) is built once, in its own
+worker process, and every retrieval setting (top_k × fetch_k ×
+score_threshold × lambda_mult) is scored against that index.
+
+Recorded per combination
+------------------------
+  hit_rate    : % of questions where a chunk sent to the LLM holds a gold keyword
+  mrr         : reciprocal rank of the first such chunk among those sent
+  avg_tokens  : context tokens sent per question
+  latency_ms  : retrieval time per question
+  index_bytes : estimated resident index size;  build_s: index build time
+
+Run
+---
+    python tests/sweep_rag.py                                   # default grid
+    python tests/sweep_rag.py --chunk-size 500 1000 --top-k 4 6 --workers 2
+    python tests/sweep_rag.py --objectives hit_rate avg_tokens  # frontier axes
+    python tests/sweep_rag.py --json                            # also write results/sweep_report.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict
+from pathlib import Path
+
+# Allow running from the repo root without installing the package
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from docuchat.core.config import RAGConfig
+
+RESULTS_PATH = Path(__file__).parent.parent / "results" / "sweep_report.json"
+
+# Direction of each metric that can be used as a frontier objective
+OBJECTIVES = {
+    "hit_rate": "max",
+    "mrr": "max",
+    "avg_tokens": "min",
+    "latency_ms": "min",
+    "index_bytes": "min",
+    "build_s": "min",
+}
+
+RESET = "\033[0m"
+BOLD  = "\033[1m"
+CYAN  = "\033[96m"
+GREEN = "\033[92m"
+GREY  = "\033[90m"
+
+
+# ---------------------------------------------------------------------------
+# Worker: one chunking setting, all retrieval settings
+# ---------------------------------------------------------------------------
+def _init_worker(threads: int) -> None:
+    try:
+        import torch
+
+        torch.set_num_threads(threads)  # split cores between workers
+    except ImportError:
+        pass
+    from docuchat.core.rag import _get_embeddings
+
+    _get_embeddings().embed_query("warm-up")  # keep model loading out of build_s
+
+
+def _sweep_chunking(chunking: dict, retrieval_grid: list[dict]) -> list[dict]:
+    from evaluate_rag import build_store, load_fixture_docs, score_retrieval
+
+    store, build_stats = build_store(load_fixture_docs(), RAGConfig(**chunking))
+    rows = []
+    for params in retrieval_grid:
+        try:
+            config = RAGConfig(**chunking, **params)
+        except ValueError:
+            continue  # e.g. top_k > fetch_k
+        score_retrieval(store, config)  # warm-up: first queries pay one-off costs
+        rows.append({"config": asdict(config), **build_stats, **score_retrieval(store, config)})
+    return rows
+
+
+# ---------------------------------------------------------------------------
+# Pareto frontier
+# ---------------------------------------------------------------------------
+def _dominates(a: dict, b: dict, objectives: dict[str, str]) -> bool:
+    """True if ``a`` is at least as good as ``b`` everywhere and better somewhere."""
+    better = False
+    for metric, direction in objectives.items():
+        x, y = (a[metric], b[metric]) if direction == "max" else (b[metric], a[metric])
+        if x < y:
+            return False
+        better |= x > y
+    return better
+
+
+def pareto_frontier(rows: list[dict], objectives: dict[str, str]) -> list[dict]:
+    """Rows not dominated by any other row on ``objectives``."""
+    return [r for r in rows if not any(_dominates(o, r, objectives) for o in rows if o is not r)]
+
+
+# ---------------------------------------------------------------------------
+# Report
+# ---------------------------------------------------------------------------
+def _print_rows(title: str, rows: list[dict], frontier_ids: set[int]) -> None:
+    sep = "─" * 100
+    print(f"\n{BOLD}{CYAN}  {title}{RESET}")
+    print(f"  {sep}")
+    print(
+        f"  {'':1} {'chunk':>5} {'ovl':>4} {'k':>2} {'fetch':>5} {'thr':>5} {'λ':>4}  "
+        f"{'hit':>6} {'mrr':>6} {'tokens':>7} {'ms':>6} {'index KB':>9} {'build s':>8}"
+    )
+    print(f"  {sep}")
+    for r in rows:
+        c = r["config"]
+        star = f"{GREEN}★{RESET}" if id(r) in frontier_ids else " "
+        print(
+            f"  {star} {c['chunk_size']:>5} {c['chunk_overlap']:>4} {c['top_k']:>2} {c['fetch_k']:>5} "
+            f"{c['score_threshold']:>5.2f} {c['lambda_mult']:>4.1f}  "
+            f"{r['hit_rate'] * 100:>5.1f}% {r['mrr']:>6.3f} {r['avg_tokens']:>7.0f} "
+            f"{r['latency_ms']:>6.2f} {r['index_bytes'] / 1024:>9.0f} {r['build_s']:>8.2f}"
+        )
+    print()
+
+
+def main(argv: list[str] | None = None) -> int:
+    default = RAGConfig()
+    parser = argparse.ArgumentParser(description="Sweep DocuChat chunking/retrieval parameters")
+    parser.add_argument("--chunk-size", type=int, nargs="+", default=[500, 1000, 1500])
+    parser.add_argument("--chunk-overlap", type=int, nargs="+", default=[100, 200])
+    parser.add_argument("--top-k", type=int, nargs="+", default=[4, 6, 8])
+    parser.add_argument("--fetch-k", type=int, nargs="+", default=[default.fetch_k])
+    parser.add_argument("--score-threshold", type=float, nargs="+", default=[0.2, 0.25, 0.3])
+    parser.add_argument("--lambda-mult", type=float, nargs="+", default=[0.5, default.lambda_mult])
+    parser.add_argument(
+        "--objectives", nargs="+", choices=list(OBJECTIVES),
+        default=["hit_rate", "mrr", "latency_ms", "index_bytes"],
+        help="metrics that define the Pareto frontier",
+    )
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: one per chunking setting, up to CPU count)")
+    parser.add_argument("--json", action="store_true", help=f"also write {RESULTS_PATH}")
+    args = parser.parse_args(argv)
+
+    chunkings = [
+        {"chunk_size": size, "chunk_overlap": overlap}
+        for size, overlap in itertools.product(args.chunk_size, args.chunk_overlap)
+        if overlap < size
+    ]
+    retrieval_grid = [
+        {"top_k": k, "fetch_k": fetch, "score_threshold": thr, "lambda_mult": lam}
+        for k, fetch, thr, lam in itertools.product(
+            args.top_k, args.fetch_k, args.score_threshold, args.lambda_mult
+        )
+    ]
+    workers = args.workers or min(len(chunkings), os.cpu_count() or 1)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"\n🔬  {len(chunkings)} chunking × {len(retrieval_grid)} retrieval settings on {workers} workers …")
+
+    rows: list[dict] = []
+    # spawn: each worker loads its own embedding model, never a forked copy
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(threads,)) as pool:
+        futures = [pool.submit(_sweep_chunking, c, retrieval_grid) for c in chunkings]
+        for future in as_completed(futures):
+            rows.extend(future.result())
+            print(f"  … {len(rows)} combinations scored", flush=True)
+
+    objectives = {m: OBJECTIVES[m] for m in args.objectives}
+    frontier = pareto_frontier(rows, objectives)
+    frontier.sort(key=lambda r: (-r["hit_rate"], -r["mrr"], r["latency_ms"]))
+    rows.sort(key=lambda r: (-r["hit_rate"], -r["mrr"], r["latency_ms"]))
+    frontier_ids = {id(r) for r in frontier}
+
+    _print_rows(f"ALL SETTINGS ({len(rows)})", rows, frontier_ids)
+    _print_rows(
+        f"PARETO FRONTIER ({len(frontier)}) on {', '.join(f'{m} {d}' for m, d in objectives.items())}",
+        frontier, frontier_ids,
+    )
+    print(f"  {GREY}Apply a setting with DOCUCHAT_<FIELD> environment variables, e.g. DOCUCHAT_TOP_K=4{RESET}\n")
+
+    if args.json:
+        RESULTS_PATH.parent.mkdir(exist_ok=True)
+        RESULTS_PATH.write_text(
+            json.dumps({"objectives": objectives, "frontier": frontier, "all": rows}, indent=2)
+        )
+        print(f"  📄  JSON report saved to {RESULTS_PATH}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,7 +2,16 @@
 DocuChat — Unit Test Suite
 ==========================
 Tests document extraction, text cleaning, chunking, vector store
-construction, retrieval correctness, and API key validation.
+construction, retrieval correctness, API key validation,
+conversation history compaction, LLM request scheduling, the embedding
+pool, the session index manager, knowledge-base snapshots, bulk ingestion, adaptive retrieval,
+reduced-precision vector storage, RAG configuration, the
+performance regression gate, on-demand request profiling, runtime
+metrics, the offline hashing embedder, ONNX Runtime backend selection,
+start-up warm-up / readiness, header/footer boilerplate stripping,
+hierarchical summaries for broad questions, per-document map-reduce
+answering, extractive fast-path answers, sharded scatter-gather
+search, and the shared micro-batching embedding server.
 
 Run:
     pytest tests/test_unit.py -v
@@ -10,17 +19,73 @@ Run:
 
 from __future__ import annotations
 
+import hashlib
+import io
+import json
 import os
+import pstats
+import re
 import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
+import numpy as np
 import pytest
+from langchain_core.embeddings import Embeddings
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from docuchat.core.document import _clean_text, extract_text_from_file
-from docuchat.core.rag import build_vector_store
+import docuchat.core.cache as cache_module
+import docuchat.core.document as document_module
+import docuchat.core.embeddings as embeddings_module
+from docuchat.core.cache import ExtractionCache
+from docuchat.core.config import RAGConfig
+from docuchat.core.document import (
+    _clean_text,
+    extract_text_from_file,
+    page_offsets,
+    save_and_hash,
+    strip_boilerplate,
+)
+from docuchat.core.embeddings import (
+    EmbeddingPool,
+    HashingEmbeddings,
+    embedding_model_id,
+    make_embeddings,
+    plan_batches,
+)
+from docuchat.core.extractive import (
+    best_sentence,
+    extract_answer,
+    is_lookup_question,
+    split_sentences,
+)
+from docuchat.core.history import ConversationMemory, estimate_tokens, select_recent_turns
+from docuchat.core.ingest import KnowledgeBase, ingest_directory
+from docuchat.core.index_manager import IndexManager, estimate_store_bytes
+import docuchat.core.metrics as metrics_module
+from docuchat.core.metrics import EXTRACTION_CACHE, EXTRACTION_SECONDS, MetricsRegistry
+import docuchat.core.profiling as profiling_module
+from docuchat.core.quantization import QuantizedFAISS, ReadOnlyIndexError, quantize_store
+import docuchat.core.rag as rag_module
+from docuchat.core.rag import build_vector_store, split_documents
+from docuchat.core.retrieval import adaptive_k, retrieve, retrieve_per_source, source_positions
+import docuchat.core.snapshot as snapshot_module
+from docuchat.core.scheduler import LLMScheduler, is_rate_limit_error, retry_after_seconds
+import docuchat.core.summaries as summaries_module
+from docuchat.core.summaries import (
+    SummaryIndex,
+    SummaryTree,
+    build_summary_trees,
+    is_broad_question,
+    select_summaries,
+)
 from docuchat.core.validator import validate_groq_api_key
+import docuchat.core.warmup as warmup_module
+from tests.regression import Tolerances, compare, median_of_trials
 
 FIXTURES_DIR = Path(__file__).parent / "fixtures"
 
@@ -101,6 +166,168 @@ class TestTextExtraction:
         assert "342" in result
 
 
+class TestInMemoryExtraction:
+    def test_save_and_hash_matches_sha256(self, tmp_path):
+        data = os.urandom(3 * 1024 * 1024 + 17)  # spans several write chunks
+        dest = tmp_path / "upload.bin"
+        digest = save_and_hash(memoryview(data), str(dest))
+        assert digest == hashlib.sha256(data).hexdigest()
+        assert dest.read_bytes() == data
+
+    def test_extracts_txt_from_bytes(self):
+        result = extract_text_from_file("Hello\xa0from memory".encode(), "note.txt")
+        assert result == "Hello from memory"
+
+    def test_extracts_docx_from_memoryview(self):
+        import docx
+
+        buf = io.BytesIO()
+        document = docx.Document()
+        document.add_paragraph("In-memory DOCX paragraph")
+        document.save(buf)
+        result = extract_text_from_file(buf.getbuffer(), "doc.docx")
+        assert "In-memory DOCX paragraph" in result
+
+    def test_path_and_buffer_give_same_text(self):
+        path = FIXTURES_DIR / "product_spec.txt"
+        from_path = extract_text_from_file(str(path), "product_spec.txt")
+        from_bytes = extract_text_from_file(memoryview(path.read_bytes()), "product_spec.txt")
+        assert from_path == from_bytes
+
+    def test_invalid_pdf_bytes_return_error(self):
+        result = extract_text_from_file(b"not a pdf", "broken.pdf")
+        assert result.startswith("Error reading PDF")
+
+
+class TestDocxExtraction:
+    @staticmethod
+    def _docx_bytes(build) -> bytes:
+        import docx
+
+        document = docx.Document()
+        build(document)
+        buf = io.BytesIO()
+        document.save(buf)
+        return buf.getvalue()
+
+    def test_tables_stay_in_body_order(self):
+        def build(d):
+            d.add_paragraph("Before the table")
+            table = d.add_table(rows=1, cols=2)
+            table.cell(0, 0).text, table.cell(0, 1).text = "Voltage", "230 V"
+            d.add_paragraph("After the table")
+
+        lines = extract_text_from_file(self._docx_bytes(build), "t.docx").splitlines()
+        assert lines == ["Before the table", "Voltage | 230 V", "After the table"]
+
+    def test_merged_cells_are_not_repeated(self):
+        def build(d):
+            table = d.add_table(rows=1, cols=3)
+            table.cell(0, 0).merge(table.cell(0, 1)).text = "Merged"
+            table.cell(0, 2).text = "Other"
+
+        assert extract_text_from_file(self._docx_bytes(build), "m.docx") == "Merged | Other"
+
+    def test_nested_table_text_stays_in_outer_cell(self):
+        def build(d):
+            outer = d.add_table(rows=1, cols=2)
+            outer.cell(0, 0).text = "Outer"
+            inner = outer.cell(0, 1).add_table(rows=1, cols=1)
+            inner.cell(0, 0).text = "Inner"
+            d.add_paragraph("Tail")
+
+        result = extract_text_from_file(self._docx_bytes(build), "n.docx")
+        assert result.splitlines()[-1] == "Tail"
+        assert "Outer" in result and "Inner" in result
+
+    def test_table_in_text_box_fallback_is_skipped(self):
+        w = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+        mc = 'xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006"'
+        box = "<w:txbxContent><w:p><w:r><w:t>Box</w:t></w:r></w:p></w:txbxContent>"
+        fallback_table = (
+            "<w:txbxContent><w:tbl><w:tr><w:tc><w:p><w:r><w:t>Box</w:t></w:r></w:p>"
+            "</w:tc></w:tr></w:tbl></w:txbxContent>"
+        )
+        xml = (
+            f"<w:document {w} {mc}><w:body>"
+            "<w:p><w:r><w:t>Before</w:t></w:r></w:p>"
+            f"<w:p><w:r><mc:AlternateContent><mc:Choice>{box}</mc:Choice>"
+            f"<mc:Fallback>{fallback_table}</mc:Fallback></mc:AlternateContent></w:r></w:p>"
+            "<w:p><w:r><w:t>After paragraph</w:t></w:r></w:p>"
+            "</w:body></w:document>"
+        ).encode()
+        blocks = list(document_module._iter_docx_blocks(io.BytesIO(xml)))
+        assert blocks == ["Before", "Box", "After paragraph"]
+
+    def test_corrupt_docx_returns_error(self):
+        assert extract_text_from_file(b"PK junk", "bad.docx").startswith("Error reading DOCX")
+
+
+class TestExtractionCache:
+    def test_roundtrip(self, tmp_path):
+        cache = ExtractionCache(str(tmp_path), max_bytes=10_000_000)
+        cache.put("abc.txt-v1", "hello", [0])
+        assert cache.get("abc.txt-v1") == {"text": "hello", "pages": [0]}
+
+    def test_miss_and_corrupt_entries_return_none(self, tmp_path):
+        cache = ExtractionCache(str(tmp_path), max_bytes=10_000_000)
+        assert cache.get("missing-v1") is None
+        cache.put("bad.txt-v1", "x", [])
+        Path(cache._path("bad.txt-v1")).write_bytes(b"not gzip")
+        assert cache.get("bad.txt-v1") is None
+
+    def test_truncated_entry_is_a_miss(self, tmp_path):
+        cache = ExtractionCache(str(tmp_path), max_bytes=10_000_000)
+        cache.put("cut.txt-v1", "hello " * 1000, [0])
+        path = Path(cache._path("cut.txt-v1"))
+        path.write_bytes(path.read_bytes()[:-20])
+        assert cache.get("cut.txt-v1") is None
+
+    def test_unwritable_cache_dir_disables_caching(self, tmp_path, monkeypatch):
+        (tmp_path / "file").write_text("not a directory")
+        monkeypatch.setenv("DOCUCHAT_CACHE_DIR", str(tmp_path / "file" / "cache"))
+        monkeypatch.setattr(cache_module, "_cache", None)
+        assert cache_module.get_extraction_cache() is None
+        assert extract_text_from_file(b"plain text", "a.txt", content_hash="h") == "plain text"
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        cache = ExtractionCache(str(tmp_path), max_bytes=2_500)
+        for i in range(3):
+            cache.put(f"k{i}-v1", os.urandom(600).hex(), [])
+            os.utime(cache._path(f"k{i}-v1"), (i, i))
+        cache.get("k0-v1")  # touch the oldest so it survives
+        cache.put("k3-v1", os.urandom(600).hex(), [])
+        assert cache.get("k0-v1") is not None
+        assert cache.get("k1-v1") is None
+
+    def test_repeat_extraction_skips_parsing(self, tmp_path, monkeypatch):
+        cache = ExtractionCache(str(tmp_path), max_bytes=10_000_000)
+        monkeypatch.setattr(document_module, "get_extraction_cache", lambda: cache)
+        data = (FIXTURES_DIR / "company_policy.txt").read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        first = extract_text_from_file(data, "policy.txt", content_hash=digest)
+        # A cache hit never touches the source, so garbage bytes still yield the text
+        second = extract_text_from_file(b"\x00", "policy.txt", content_hash=digest)
+        assert first == second
+
+    def test_version_bump_invalidates(self, tmp_path, monkeypatch):
+        cache = ExtractionCache(str(tmp_path), max_bytes=10_000_000)
+        monkeypatch.setattr(document_module, "get_extraction_cache", lambda: cache)
+        extract_text_from_file(b"old text", "a.txt", content_hash="h")
+        monkeypatch.setattr(document_module, "_EXTRACTOR_VERSION", 999)
+        assert extract_text_from_file(b"new text", "a.txt", content_hash="h") == "new text"
+
+    def test_errors_are_not_cached(self, tmp_path, monkeypatch):
+        cache = ExtractionCache(str(tmp_path), max_bytes=10_000_000)
+        monkeypatch.setattr(document_module, "get_extraction_cache", lambda: cache)
+        extract_text_from_file(b"not a pdf", "x.pdf", content_hash="h")
+        assert cache.get(ExtractionCache.make_key("h", ".pdf", 1)) is None
+
+    def test_page_offsets(self):
+        text = "[Page 1]\nfirst\n\n[Page 2]\nsecond"
+        assert page_offsets(text) == [0, text.index("[Page 2]")]
+
+
 # =============================================================================
 # 3. Vector Store Construction
 # =============================================================================
@@ -292,3 +519,1912 @@ class TestApiKeyValidation:
     def test_strips_whitespace(self):
         valid, _ = validate_groq_api_key("  gsk_" + "A" * 40 + "  ")
         assert valid is True
+
+
+# =============================================================================
+# 6. Conversation History Compaction
+# =============================================================================
+
+
+def _make_conversation(n_turns: int, length: int = 400) -> list[dict]:
+    conversation = []
+    for i in range(n_turns):
+        conversation.append({"role": "user", "content": f"question {i} " + "q" * length})
+        conversation.append({"role": "assistant", "content": f"answer {i} " + "a" * length})
+    return conversation
+
+
+class TestHistoryCompaction:
+    def test_window_respects_token_budget(self):
+        _, turns = select_recent_turns(_make_conversation(50), budget=500)
+        assert sum(estimate_tokens(t["content"]) for t in turns) <= 500
+
+    def test_window_keeps_most_recent_turns(self):
+        conversation = _make_conversation(50)
+        start, turns = select_recent_turns(conversation, budget=500)
+        assert turns[-1]["content"] == conversation[-1]["content"]
+        assert start == len(conversation) - len(turns)
+
+    def test_window_size_constant_as_conversation_grows(self):
+        short = select_recent_turns(_make_conversation(20), budget=800)[1]
+        long = select_recent_turns(_make_conversation(2000), budget=800)[1]
+        assert len(short) == len(long)
+
+    def test_long_turns_are_truncated(self):
+        _, turns = select_recent_turns(_make_conversation(1, length=100_000))
+        assert all(len(t["content"]) < 100_000 for t in turns)
+
+    def test_refresh_summarizes_turns_outside_window(self):
+        seen: list[list[dict]] = []
+
+        def fake_summarizer(previous, turns, api_key):
+            seen.append(turns)
+            return f"{previous}+{len(turns)}"
+
+        memory = ConversationMemory(summarizer=fake_summarizer, budget=500)
+        conversation = _make_conversation(10)
+        memory.refresh(conversation, "gsk_test")
+        memory.wait()
+        start, _ = select_recent_turns(conversation, budget=500)
+        assert len(seen) == 1 and len(seen[0]) == start
+        assert memory.summary == f"+{start}"
+
+    def test_trim_drops_only_summarized_messages(self):
+        memory = ConversationMemory(summarizer=lambda p, t, k: "summary", budget=500)
+        conversation = _make_conversation(600, length=10)
+        memory.trim(conversation)
+        assert len(conversation) == 1200  # nothing summarized yet
+        memory.refresh(conversation, "gsk_test")
+        memory.wait()
+        memory.trim(conversation)
+        assert len(conversation) == 1000 and memory.dropped == 200
+
+    def test_history_pages_follow_trimmed_messages(self, monkeypatch):
+        from streamlit.testing.v1 import AppTest
+
+        monkeypatch.setenv("DOCUCHAT_EMBEDDINGS", "hash")
+        monkeypatch.setattr(warmup_module, "_thread", threading.Thread())  # no warm-up
+        # AppTest runs the script as __main__; spawned workers of later tests would re-run it
+        monkeypatch.setitem(sys.modules, "__main__", sys.modules["__main__"])
+        memory = ConversationMemory(summarizer=lambda p, t, k: "summary", budget=500)
+        conversation = [
+            {"role": ("user", "assistant")[i % 2], "content": f"Message {i}"} for i in range(1000)
+        ]
+        memory.refresh(conversation, "gsk_test")
+        memory.wait()
+        app = AppTest.from_file(
+            str(Path(__file__).parent.parent / "docuchat" / "ui" / "app.py"), default_timeout=120
+        )
+
+        def shown() -> list[int]:
+            app.session_state.conversation, app.session_state.memory = conversation, memory
+            app.session_state.history_pages = 100  # every page
+            app.run()
+            pages = [m.value for m in app.markdown if re.match(r"\*\*(You|DocuChat):\*\*", m.value)]
+            bubbles = [c.markdown[0].value for c in app.chat_message]
+            return [int(n) for text in pages + bubbles for n in re.findall(r"Message (\d+)", text)]
+
+        assert shown() == list(range(1000))
+        conversation.extend(
+            {"role": ("user", "assistant")[i % 2], "content": f"Message {i}"} for i in range(1000, 1015)
+        )
+        memory.trim(conversation)
+        assert memory.dropped == 15
+        assert shown() == list(range(15, 1015))  # cached pages neither shifted nor stale
+        assert not app.exception
+
+
+# =============================================================================
+# 7. LLM Request Scheduling
+# =============================================================================
+
+
+class _RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after: str | None = None):
+        super().__init__("Error code: 429 - rate limit exceeded")
+        self.response = type("R", (), {"headers": {"retry-after": retry_after} if retry_after else {}})()
+
+
+class _FakeGroqHandler(BaseHTTPRequestHandler):
+    """Local OpenAI-compatible endpoint: 429 for the first N calls, then answers."""
+
+    failures_left = 0
+    calls = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        cls = type(self)
+        cls.calls += 1
+        if cls.failures_left > 0:
+            cls.failures_left -= 1
+            body = json.dumps({"error": {"message": "Rate limit reached", "type": "tokens"}})
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+        else:
+            body = json.dumps({
+                "id": "chatcmpl-1", "object": "chat.completion", "created": 0,
+                "model": "fake", "choices": [{"index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "fake answer"}}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            })
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class TestLLMScheduler:
+    def test_detects_rate_limit_errors(self):
+        assert is_rate_limit_error(_RateLimited())
+        assert not is_rate_limit_error(ValueError("boom"))
+        assert is_rate_limit_error(RuntimeError("Error code: 429 - {'error': 'slow down'}"))
+        assert is_rate_limit_error(RuntimeError("Rate limit reached for model"))
+        assert is_rate_limit_error(RuntimeError("HTTP 429 Too Many Requests"))
+        for unrelated in (
+            "request req_4291 failed", "prompt is 1429 tokens too long",
+            "SyntaxError at line 429", "Error code: 500 - after 429 ms",
+        ):
+            assert not is_rate_limit_error(RuntimeError(unrelated))
+
+    def test_reads_retry_after_header(self):
+        assert retry_after_seconds(_RateLimited("2")) == 2.0
+        assert retry_after_seconds(_RateLimited()) is None
+
+    def test_retries_rate_limited_calls(self):
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise _RateLimited()
+            return "ok"
+
+        scheduler = LLMScheduler(rate_per_minute=6000, burst=10, sleep=lambda s: None)
+        assert scheduler.call(flaky) == "ok"
+        assert len(attempts) == 3
+
+    def test_non_rate_limit_errors_are_not_retried(self):
+        attempts = []
+
+        def broken():
+            attempts.append(1)
+            raise ValueError("401 unauthorized")
+
+        scheduler = LLMScheduler(sleep=lambda s: None)
+        with pytest.raises(ValueError):
+            scheduler.call(broken)
+        assert len(attempts) == 1
+
+    def test_coalesces_identical_inflight_requests(self):
+        calls = []
+        release = threading.Event()
+
+        def slow():
+            calls.append(1)
+            release.wait(5)
+            return "shared"
+
+        scheduler = LLMScheduler(rate_per_minute=6000, burst=10)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(scheduler.call(slow, key="same")))
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        time.sleep(0.2)
+        release.set()
+        for t in threads:
+            t.join(5)
+        assert results == ["shared"] * 5
+        assert len(calls) == 1
+
+    def test_sessions_are_served_round_robin(self):
+        order = []
+        gate = threading.Event()
+        scheduler = LLMScheduler(rate_per_minute=6000, burst=100, max_concurrency=1)
+
+        def job(session):
+            def run():
+                gate.wait(5)
+                order.append(session)
+            return run
+
+        # Occupy the single slot, then queue a heavy session ahead of a light one
+        blocker = threading.Thread(target=lambda: scheduler.call(job("blocker"), "blocker"))
+        blocker.start()
+        time.sleep(0.1)
+        threads = []
+        for session in ["heavy"] * 4 + ["light"]:
+            t = threading.Thread(target=lambda s=session: scheduler.call(job(s), s))
+            t.start()
+            threads.append(t)
+            time.sleep(0.05)
+        gate.set()
+        for t in [blocker, *threads]:
+            t.join(5)
+        assert order.index("light") <= 2
+
+    def test_recovers_from_429_on_fake_endpoint(self):
+        from langchain_groq import ChatGroq
+
+        _FakeGroqHandler.failures_left, _FakeGroqHandler.calls = 2, 0
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeGroqHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            llm = ChatGroq(
+                api_key="gsk_" + "A" * 40,
+                model_name="fake",
+                base_url=f"http://127.0.0.1:{server.server_port}",
+                max_retries=0,
+            )
+            scheduler = LLMScheduler(rate_per_minute=6000, burst=10)
+            answer = scheduler.call(lambda: llm.invoke("hi").content)
+        finally:
+            server.shutdown()
+        assert answer == "fake answer"
+        assert _FakeGroqHandler.calls == 3
+
+
+# =============================================================================
+# 8. Embedding Worker Pool
+# =============================================================================
+
+
+class TestEmbeddingPool:
+    def test_batches_cover_every_text_once(self):
+        texts = ["x" * (i * 37 % 900) for i in range(500)]
+        batches = plan_batches(texts, max_tokens=2048, max_size=64)
+        assert sorted(i for b in batches for i in b) == list(range(500))
+        assert all(len(b) <= 64 for b in batches)
+
+    def test_batches_group_similar_lengths(self):
+        texts = ["short"] * 50 + ["long " * 300] * 50
+        batches = plan_batches(texts, max_tokens=4096)
+        for batch in batches:
+            assert len({len(texts[i]) for i in batch}) == 1
+
+    def test_pool_returns_vectors_in_input_order(self):
+        from functools import partial
+
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+
+        factory = partial(DeterministicFakeEmbedding, size=8)
+        texts = [f"chunk {i} " + "word " * (i % 40) for i in range(200)]
+        pool = EmbeddingPool(workers=2, factory=factory)
+        try:
+            vectors = pool.embed_documents(texts)
+            query = pool.embed_query("chunk 3")
+        finally:
+            pool.close()
+        assert vectors == factory().embed_documents(texts)
+        assert query == factory().embed_query("chunk 3")
+
+
+# =============================================================================
+# 9. Session Index Manager
+# =============================================================================
+
+
+def _fake_store(tag: str, n: int = 20):
+    """Small FAISS store over a deterministic fake embedding (no model download)."""
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    texts = [f"{tag} chunk {i} " + "lorem ipsum " * 20 for i in range(n)]
+    return FAISS.from_texts(
+        texts, DeterministicFakeEmbedding(size=32), metadatas=[{"source": tag}] * n
+    )
+
+
+class TestIndexManager:
+    def test_estimate_counts_vectors_and_text(self):
+        store = _fake_store("a", n=10)
+        assert estimate_store_bytes(store) > 10 * 32 * 4
+
+    def test_evicts_least_recently_used_over_budget(self, tmp_path):
+        size = estimate_store_bytes(_fake_store("x"))
+        manager = IndexManager(budget_bytes=int(size * 2.5), spill_dir=str(tmp_path))
+        for session in ["s1", "s2", "s3"]:
+            manager.put(session, _fake_store(session))
+        stats = manager.stats()
+        assert stats["evictions"] == 1
+        assert stats["resident_bytes"] <= manager.budget_bytes
+        assert (tmp_path / "s1").exists()
+
+    def test_reload_returns_equivalent_store(self, tmp_path):
+        size = estimate_store_bytes(_fake_store("x"))
+        manager = IndexManager(budget_bytes=int(size * 1.5), spill_dir=str(tmp_path))
+        original = _fake_store("s1")
+        expected = original.similarity_search("s1 chunk 3", k=3)
+        manager.put("s1", original)
+        manager.put("s2", _fake_store("s2"))  # pushes s1 out
+        reloaded = manager.get("s1")
+        assert manager.stats()["reloads"] == 1
+        assert reloaded.similarity_search("s1 chunk 3", k=3) == expected
+
+    def test_drop_removes_spilled_index(self, tmp_path):
+        manager = IndexManager(budget_bytes=1, spill_dir=str(tmp_path))
+        manager.put("s1", _fake_store("s1"))
+        manager.put("s2", _fake_store("s2"))
+        manager.drop("s1")
+        assert manager.get("s1") is None
+        assert not (tmp_path / "s1").exists()
+
+    def test_idle_sessions_are_dropped_with_their_spill_files(self, tmp_path, monkeypatch):
+        clock = [1000.0]
+        monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+        manager = IndexManager(budget_bytes=1, spill_dir=str(tmp_path), idle_seconds=60)
+        manager.put("s1", _fake_store("s1"))
+        manager.put("s2", _fake_store("s2"))  # spills s1
+        assert (tmp_path / "s1").exists()
+        clock[0] += 45
+        manager.get("s2")
+        clock[0] += 30  # s1 idle for 75 s, s2 for 30 s
+        assert manager.expire_idle() == 1
+        assert manager.get("s1") is None and manager.get("s2") is not None
+        assert not (tmp_path / "s1").exists()
+        assert manager.stats()["expired"] == 1
+
+    def test_state_totals_aggregate_sessions(self, tmp_path):
+        manager = IndexManager(budget_bytes=1, spill_dir=str(tmp_path))
+        for session in ["s1", "s2", "s3"]:
+            manager.put(session, _fake_store(session))
+        totals = manager.state_totals()
+        assert totals[("resident",)][0] == 1 and totals[("spilled",)][0] == 2
+        assert totals[("resident",)][1] + totals[("spilled",)][1] == sum(
+            manager.session_bytes().values()
+        )
+
+    def test_put_none_forgets_session(self, tmp_path):
+        manager = IndexManager(budget_bytes=10**9, spill_dir=str(tmp_path))
+        manager.put("s1", _fake_store("s1"))
+        manager.put("s1", None)
+        assert manager.get("s1") is None
+        assert manager.stats()["resident_bytes"] == 0
+
+
+# =============================================================================
+# 10. Knowledge-Base Snapshots
+# =============================================================================
+
+
+class TestSnapshot:
+    def test_roundtrip_preserves_search_results(self):
+        store = _fake_store("kb", n=30)
+        restored = snapshot_module.import_snapshot(
+            snapshot_module.snapshot_bytes(store), store.embedding_function
+        )
+        query = "kb chunk 7"
+        original = store.similarity_search_with_score(query, k=5)
+        reloaded = restored.similarity_search_with_score(query, k=5)
+        assert [d.page_content for d, _ in original] == [d.page_content for d, _ in reloaded]
+        assert [d.metadata for d, _ in original] == [d.metadata for d, _ in reloaded]
+
+    def test_float16_halves_vector_bytes(self):
+        store = _fake_store("kb", n=200)
+        full = snapshot_module.snapshot_bytes(store)
+        half = snapshot_module.snapshot_bytes(store, float16=True)
+        assert len(full) - len(half) == 200 * 32 * 2
+        restored = snapshot_module.import_snapshot(half, store.embedding_function)
+        assert restored.index.ntotal == 200
+
+    def test_export_to_path(self, tmp_path):
+        store = _fake_store("kb")
+        path = tmp_path / "kb.dckb"
+        snapshot_module.export_snapshot(store, str(path))
+        header = snapshot_module.read_snapshot_header(path.read_bytes())
+        assert header["count"] == 20 and header["dim"] == 32
+
+    def test_rejects_other_embedding_model(self, monkeypatch):
+        data = snapshot_module.snapshot_bytes(_fake_store("kb"))
+        monkeypatch.setattr(snapshot_module, "embedding_model_id", lambda: "other-model")
+        with pytest.raises(ValueError, match="embedding model"):
+            snapshot_module.import_snapshot(data, None)
+
+    def test_rejects_corrupt_snapshot(self):
+        data = bytearray(snapshot_module.snapshot_bytes(_fake_store("kb")))
+        data[100] ^= 0xFF
+        with pytest.raises(ValueError, match="checksum"):
+            snapshot_module.import_snapshot(bytes(data), None)
+
+    @staticmethod
+    def _resealed(data: bytes, header: dict | None = None, chunks: list | None = None) -> bytes:
+        """Rewrite a snapshot's header or chunks, with a valid checksum."""
+        preamble = snapshot_module._PREAMBLE
+        old = snapshot_module.read_snapshot_header(data)
+        start = preamble.size + preamble.unpack_from(data)[3]
+        vectors = data[start:start + old["count"] * old["dim"] * 4]
+        packed = zlib.compress(json.dumps(chunks).encode()) if chunks is not None else (
+            data[start + len(vectors):-32]
+        )
+        header = dict(old, chunks_bytes=len(packed)) if header is None else header
+        raw = json.dumps(header).encode()
+        body = preamble.pack(b"DCKB", 1, 0, len(raw)) + raw + vectors + packed
+        return body + hashlib.sha256(body).digest()
+
+    def test_rejects_chunk_count_mismatch(self):
+        data = snapshot_module.snapshot_bytes(_fake_store("kb", n=5))
+        short = self._resealed(data, chunks=[["only one", {}]])
+        with pytest.raises(ValueError, match="5 vectors but 1 chunks"):
+            snapshot_module.import_snapshot(short, None)
+
+    def test_rejects_malformed_header(self):
+        data = snapshot_module.snapshot_bytes(_fake_store("kb", n=5))
+        header = snapshot_module.read_snapshot_header(data)
+        for broken in (
+            {k: v for k, v in header.items() if k != "dim"},
+            dict(header, dtype="int4"),
+            dict(header, count=6),
+            [header],
+        ):
+            with pytest.raises(ValueError, match="Malformed snapshot"):
+                snapshot_module.import_snapshot(self._resealed(data, header=broken), None)
+
+    def test_rejects_foreign_file(self):
+        with pytest.raises(ValueError, match="Not a DocuChat snapshot"):
+            snapshot_module.import_snapshot(b"PK\x03\x04" + b"\x00" * 64, None)
+
+
+# =============================================================================
+# 11. Bulk Ingestion
+# =============================================================================
+
+
+class TestBulkIngest:
+    @pytest.fixture
+    def embeddings(self):
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+
+        return DeterministicFakeEmbedding(size=32)
+
+    @pytest.fixture
+    def tree(self, tmp_path):
+        root = tmp_path / "share"
+        (root / "hr").mkdir(parents=True)
+        for name in ["company_policy.txt", "product_spec.txt"]:
+            (root / "hr" / name).write_bytes((FIXTURES_DIR / name).read_bytes())
+        (root / "research_paper.txt").write_bytes((FIXTURES_DIR / "research_paper.txt").read_bytes())
+        (root / "notes.md").write_text("ignored")
+        return root
+
+    def _ingest(self, root, kb_dir, embeddings):
+        return ingest_directory(str(root), str(kb_dir), embeddings, workers=1, batch_files=2, progress=False)
+
+    def test_initial_ingest_indexes_every_file(self, tree, tmp_path, embeddings):
+        stats = self._ingest(tree, tmp_path / "kb", embeddings)
+        assert (stats.added, stats.failed) == (3, 0)
+        kb = KnowledgeBase(str(tmp_path / "kb"), embeddings)
+        assert set(kb.records) == {"hr/company_policy.txt", "hr/product_spec.txt", "research_paper.txt"}
+        assert kb.store.index.ntotal == stats.chunks
+
+    def test_rerun_is_incremental(self, tree, tmp_path, embeddings):
+        first = self._ingest(tree, tmp_path / "kb", embeddings)
+        assert self._ingest(tree, tmp_path / "kb", embeddings).unchanged == 3
+
+        (tree / "research_paper.txt").unlink()
+        (tree / "hr" / "product_spec.txt").write_text("Replaced spec: the Helios X2 weighs 12 kg.")
+        (tree / "new.txt").write_text("A brand new document about onboarding.")
+        stats = self._ingest(tree, tmp_path / "kb", embeddings)
+        assert (stats.added, stats.changed, stats.deleted, stats.unchanged) == (1, 1, 1, 1)
+
+        kb = KnowledgeBase(str(tmp_path / "kb"), embeddings)
+        sources = {d.metadata["source"] for d in kb.store.docstore._dict.values()}
+        assert sources == {"hr/company_policy.txt", "hr/product_spec.txt", "new.txt"}
+        assert kb.store.index.ntotal < first.chunks
+
+    def test_recovery_drops_uncommitted_chunks(self, tree, tmp_path, embeddings):
+        self._ingest(tree, tmp_path / "kb", embeddings)
+        kb = KnowledgeBase(str(tmp_path / "kb"), embeddings)
+        committed = kb.store.index.ntotal
+        # Simulate a crash after saving the index but before journaling
+        kb.store.add_texts(["orphan chunk"])
+        kb._save_index()
+        with open(tmp_path / "kb" / "journal.jsonl", "a") as f:
+            f.write('{"op": "put", "path": "torn')
+        recovered = KnowledgeBase(str(tmp_path / "kb"), embeddings)
+        assert recovered.store.index.ntotal == committed
+        assert len(recovered.records) == 3
+
+    def test_unreadable_file_is_reported_not_raised(self, tmp_path):
+        from docuchat.core.ingest import _extract_job
+
+        record, text = _extract_job(str(tmp_path), "vanished.pdf")
+        assert text is None
+        assert record.error.startswith("Error reading vanished.pdf")
+
+    def test_index_is_saved_at_geometric_checkpoints(self, tmp_path, embeddings, monkeypatch):
+        import docuchat.core.ingest as ingest_module
+        from docuchat.core.ingest import FileRecord
+
+        monkeypatch.setattr(ingest_module, "_MIN_CHECKPOINT_CHUNKS", 4)
+        kb = KnowledgeBase(str(tmp_path / "kb"), embeddings)
+        saves = []
+        save = kb._save_index
+        monkeypatch.setattr(kb, "_save_index", lambda: (saves.append(kb.store.index.ntotal), save()))
+        for i in range(40):
+            chunks = split_documents([{"original_name": f"f{i}.txt", "text_content": f"File {i} text."}])
+            kb.commit([], [(FileRecord(f"f{i}.txt", str(i), 1, 1.0), chunks)])
+        assert saves == [4, 8, 12, 18, 27]  # each after half the saved size again
+        assert not (tmp_path / "kb" / "journal.jsonl").read_text().count("f39.txt")
+        kb.compact()
+        reopened = KnowledgeBase(str(tmp_path / "kb"), embeddings)
+        assert len(reopened.records) == 40 and reopened.store.index.ntotal == 40
+
+
+# =============================================================================
+# 12. Adaptive Retrieval
+# =============================================================================
+
+
+class _TableEmbeddings(Embeddings):
+    """Embeddings with hand-picked (normalized) vectors, keyed by text."""
+
+    def __init__(self, table: dict[str, list[float]]):
+        self.table = {k: (np.asarray(v) / np.linalg.norm(v)).tolist() for k, v in table.items()}
+
+    def embed_documents(self, texts):
+        return [self.table[t] for t in texts]
+
+    def embed_query(self, text):
+        return self.table[text]
+
+
+class TestAdaptiveRetrieval:
+    _RETRIEVE = dict(top_k=6, fetch_k=20, score_threshold=0.25, lambda_mult=0.7)
+
+    def _store(self, table: dict[str, list[float]]):
+        from langchain_community.vectorstores import FAISS
+
+        embeddings = _TableEmbeddings(table)
+        docs = [t for t in table if t != "query"]
+        return FAISS.from_texts(docs, embeddings)
+
+    def test_cuts_at_a_clear_score_gap(self):
+        scores = [0.90, 0.52, 0.50, 0.49, 0.47, 0.46, 0.45, 0.44]
+        assert adaptive_k(scores, max_k=6, min_k=1) == 1
+        # With a floor of two the big drop is out of reach; no later drop stands out
+        assert adaptive_k(scores, max_k=6, min_k=2) == 6
+
+    def test_flat_scores_keep_max_k(self):
+        scores = [0.60 - 0.01 * i for i in range(20)]
+        assert adaptive_k(scores, max_k=6, min_k=1) == 6
+
+    def test_never_exceeds_bounds(self):
+        assert adaptive_k([0.9], max_k=6) == 1
+        assert adaptive_k([0.9, 0.1, 0.05], max_k=2, min_k=2) == 2
+
+    def test_sends_fewer_chunks_than_fixed_policy(self):
+        table = {
+            "query": [1, 0, 0],
+            "answer": [0.97, 0.2, 0.1],
+            **{f"filler {i}": [0.55, 0.6 + 0.02 * i, 0.55] for i in range(8)},
+        }
+        store = self._store(table)
+        fixed = retrieve(store, "query", adaptive=False, **self._RETRIEVE)
+        adaptive = retrieve(store, "query", min_k=1, **self._RETRIEVE)
+        assert len(fixed.docs) == 6
+        assert [d.page_content for d in adaptive.docs] == ["answer"]
+        assert not adaptive.mmr
+
+    def test_mmr_only_for_redundant_candidates(self):
+        diverse = self._store({"query": [1, 0, 0], "a": [0.95, 0.31, 0], "b": [0.9, -0.31, 0.3]})
+        result = retrieve(diverse, "query", **self._RETRIEVE)
+        assert [d.page_content for d in result.docs] == ["a", "b"] and not result.mmr
+
+        redundant = self._store(
+            {"query": [1, 0, 0], "a": [0.95, 0.31, 0], "a copy": [0.95, 0.31, 0.001], "b": [0.9, -0.31, 0.3]}
+        )
+        result = retrieve(redundant, "query", **{**self._RETRIEVE, "top_k": 2})
+        assert result.mmr
+        assert [d.page_content for d in result.docs] == ["a", "b"]
+
+
+# =============================================================================
+# 13. Reduced-Precision Vector Storage
+# =============================================================================
+
+
+def _chunk_text(store, position: int) -> str:
+    return store.docstore.search(store.index_to_docstore_id[position]).page_content
+
+
+class TestQuantizedStore:
+    @pytest.fixture(params=["float16", "int8"])
+    def stores(self, request, tmp_path):
+        flat = _fake_store("q", 200)
+        return flat, quantize_store(flat, request.param, str(tmp_path))
+
+    def test_rescored_results_match_flat_index(self, stores):
+        flat, quantized = stores
+        assert isinstance(quantized, QuantizedFAISS)
+        assert quantized.index.code_size < flat.index.d * 4
+        for query in [_chunk_text(flat, 3), _chunk_text(flat, 150), "unrelated"]:
+            expected = flat.similarity_search_with_score(query, k=6)
+            actual = quantized.similarity_search_with_score(query, k=6)
+            assert [d.page_content for d, _ in actual] == [d.page_content for d, _ in expected]
+            assert np.allclose([s for _, s in actual], [s for _, s in expected], rtol=1e-5)
+
+    def test_save_and_reload_keep_exact_vectors(self, stores, tmp_path):
+        _, quantized = stores
+        quantized.save_local(str(tmp_path / "saved"))
+        loaded = QuantizedFAISS.load_local(
+            str(tmp_path / "saved"), quantized.embedding_function, allow_dangerous_deserialization=True
+        )
+        assert np.array_equal(np.asarray(loaded.exact.array), np.asarray(quantized.exact.array))
+        text = _chunk_text(quantized, 7)
+        assert loaded.similarity_search(text, k=1)[0].page_content == text
+
+    def test_read_only(self, stores):
+        _, quantized = stores
+        with pytest.raises(ReadOnlyIndexError):
+            quantized.add_texts(["new"])
+
+    def test_snapshot_exports_exact_vectors(self, stores):
+        flat, quantized = stores
+        restored = snapshot_module.import_snapshot(
+            snapshot_module.snapshot_bytes(quantized), flat.embedding_function
+        )
+        assert np.array_equal(
+            restored.index.reconstruct_n(0, 200), flat.index.reconstruct_n(0, 200)
+        )
+
+    def test_index_manager_quantizes_and_reloads(self, tmp_path):
+        manager = IndexManager(budget_bytes=1, spill_dir=str(tmp_path), precision="int8")
+        manager.put("a", _fake_store("a"))
+        manager.put("b", _fake_store("b"))  # evicts "a"
+        store = manager.get("a")
+        assert isinstance(store, QuantizedFAISS)
+        text = _chunk_text(store, 3)
+        assert store.similarity_search(text, k=1)[0].page_content == text
+
+    def test_unknown_precision_rejected(self):
+        with pytest.raises(ValueError):
+            quantize_store(_fake_store("x", 5), "int4")
+
+
+# =============================================================================
+# 14. RAG Configuration
+# =============================================================================
+
+
+class TestRAGConfig:
+    def test_env_overrides_defaults(self):
+        config = RAGConfig.from_env({"DOCUCHAT_CHUNK_SIZE": "500", "DOCUCHAT_SCORE_THRESHOLD": "0.3"})
+        assert config.chunk_size == 500
+        assert config.score_threshold == 0.3
+        assert config.top_k == RAGConfig().top_k
+
+    def test_top_k_below_default_min_k(self):
+        config = RAGConfig.from_env({"DOCUCHAT_TOP_K": "1"})
+        assert config.top_k == 1 and config.min_k == RAGConfig().min_k
+        assert adaptive_k([0.9, 0.5, 0.1], config.top_k, config.min_k) == 1
+
+    @pytest.mark.parametrize(
+        "env",
+        [
+            {"DOCUCHAT_TOP_K": "six"},
+            {"DOCUCHAT_CHUNK_OVERLAP": "2000"},
+            {"DOCUCHAT_TOP_K": "30"},
+            {"DOCUCHAT_LAMBDA_MULT": "1.5"},
+            {"DOCUCHAT_MIN_K": "0"},
+        ],
+    )
+    def test_invalid_values_rejected(self, env):
+        with pytest.raises(ValueError):
+            RAGConfig.from_env(env)
+
+    def test_chunking_follows_config(self):
+        files = [{"original_name": "paper.txt", "text_content": (FIXTURES_DIR / "research_paper.txt").read_text()}]
+        small = split_documents(files, RAGConfig(chunk_size=300, chunk_overlap=50))
+        large = split_documents(files, RAGConfig(chunk_size=1500, chunk_overlap=50))
+        assert len(small) > len(large)
+        assert max(len(d.page_content) for d in small) <= 300
+
+
+# =============================================================================
+# 15. Performance Regression Gate
+# =============================================================================
+
+
+class TestRegressionGate:
+    BASELINE = {
+        "hit_rate_at_1": 0.8,
+        "avg_latency_ms": 10.0,
+        "total_questions": 30,
+        "per_document": {"spec.txt": {"mrr": 0.85}},
+        "pool-2": {"chunks_per_sec": 400.0, "peak_rss_mb": 500.0},
+    }
+
+    def _regressed(self, current: dict, tol: Tolerances | None = None) -> set[str]:
+        return {f.path for f in compare(self.BASELINE, current, tol) if f.regressed}
+
+    def test_identical_report_passes(self):
+        findings = compare(self.BASELINE, self.BASELINE)
+        assert not any(f.regressed for f in findings)
+        assert "total_questions" not in {f.path for f in findings}  # informational
+
+    def test_each_kind_of_regression_is_caught(self):
+        current = {
+            "hit_rate_at_1": 0.7667,
+            "avg_latency_ms": 12.0,
+            "total_questions": 10,
+            "per_document": {"spec.txt": {"mrr": 0.9}},
+            "pool-2": {"chunks_per_sec": 300.0, "peak_rss_mb": 600.0},
+        }
+        assert self._regressed(current) == {
+            "hit_rate_at_1", "avg_latency_ms", "pool-2/chunks_per_sec", "pool-2/peak_rss_mb",
+        }
+
+    def test_improvements_and_small_changes_pass(self):
+        current = {
+            "hit_rate_at_1": 0.9,
+            "avg_latency_ms": 11.0,  # within 15%
+            "pool-2": {"chunks_per_sec": 500.0, "peak_rss_mb": 520.0},
+        }
+        assert self._regressed(current) == set()
+
+    def test_noisy_trials_widen_the_latency_tolerance(self):
+        noisy = median_of_trials([{"avg_latency_ms": v} for v in [8.0, 14.0, 12.5, 9.0, 12.0]])
+        assert noisy["avg_latency_ms"] == 12.0 and len(noisy["avg_latency_ms_trials"]) == 5
+        assert self._regressed(noisy) == set()
+        steady = median_of_trials([{"avg_latency_ms": v} for v in [12.0, 12.1, 11.9]])
+        assert self._regressed(steady) == {"avg_latency_ms"}
+
+
+# =============================================================================
+# 16. Request Profiling
+# =============================================================================
+
+
+class TestProfiling:
+    @pytest.fixture
+    def profile_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("DOCUCHAT_PROFILE_DIR", str(tmp_path))
+        yield tmp_path
+        profiling_module.enable_for_context(False)
+
+    def test_disabled_runs_function_without_capturing(self, profile_dir):
+        calls = []
+        traced = profiling_module.profiled("noop")(lambda x: calls.append(x) or x * 2)
+        assert traced(21) == 42 and calls == [21]
+        assert list(profile_dir.iterdir()) == []
+
+    def test_enabled_writes_profile_and_allocation_report(self, profile_dir):
+        @profiling_module.profiled("build")
+        def build():
+            return [bytearray(1024) for _ in range(2000)]
+
+        profiling_module.enable_for_context(True)
+        assert len(build()) == 2000
+        [capture] = profiling_module.list_captures()
+        assert capture.name == "build" and capture.seconds > 0
+        report = Path(capture.report_path).read_text()
+        assert "functions by cumulative time" in report and "test_unit.py" in report
+        assert pstats.Stats(capture.prof_path).total_calls > 0
+
+    def test_nested_calls_are_captured_once(self, profile_dir):
+        inner = profiling_module.profiled("inner")(lambda: 1)
+        outer = profiling_module.profiled("outer")(lambda: inner() + 1)
+        profiling_module.enable_for_context(True)
+        assert outer() == 2
+        assert [c.name for c in profiling_module.list_captures()] == ["outer"]
+
+    def test_overlapping_captures_are_flagged(self, profile_dir):
+        inside, release = threading.Event(), threading.Event()
+
+        @profiling_module.profiled("slow")
+        def slow():
+            inside.set()
+            release.wait(10)
+
+        quick = profiling_module.profiled("quick")(lambda: None)
+
+        def run(fn):
+            profiling_module.enable_for_context(True)
+            fn()
+
+        worker = threading.Thread(target=run, args=(slow,))
+        worker.start()
+        inside.wait(10)
+        run(quick)
+        release.set()
+        worker.join()
+        run(quick)
+        flagged = sorted(
+            (c.name, "another capture overlapped" in Path(c.report_path).read_text())
+            for c in profiling_module.list_captures()
+        )
+        assert flagged == [("quick", False), ("quick", True), ("slow", True)]
+
+    def test_old_captures_are_pruned(self, profile_dir, monkeypatch):
+        monkeypatch.setattr(profiling_module, "_MAX_CAPTURES", 3)
+        noop = profiling_module.profiled("noop")(lambda: None)
+        profiling_module.enable_for_context(True)
+        for _ in range(5):
+            noop()
+        assert len(list(profile_dir.glob("*.prof"))) == 3
+        assert len(list(profile_dir.glob("*.txt"))) == 3
+
+
+# =============================================================================
+# 17. Runtime Metrics
+# =============================================================================
+
+
+class TestMetrics:
+    def test_counter_and_histogram_exposition(self):
+        registry = MetricsRegistry()
+        requests = registry.counter("app_requests_total", "Requests", ("outcome",))
+        latency = registry.histogram("app_seconds", "Latency", buckets=(0.1, 1.0))
+        requests.labels("ok").inc()
+        requests.labels("ok").inc(2)
+        requests.labels('say "hi"').inc()
+        for value in (0.05, 0.5, 0.5, 5.0):
+            latency.observe(value)
+        lines = registry.render().splitlines()
+        assert "# TYPE app_requests_total counter" in lines
+        assert 'app_requests_total{outcome="ok"} 3' in lines
+        assert 'app_requests_total{outcome="say \\"hi\\""} 1' in lines
+        assert 'app_seconds_bucket{le="0.1"} 1' in lines
+        assert 'app_seconds_bucket{le="1"} 3' in lines
+        assert 'app_seconds_bucket{le="+Inf"} 4' in lines
+        assert "app_seconds_sum 6.05" in lines and "app_seconds_count 4" in lines
+
+    def test_histogram_quantiles_interpolate_within_buckets(self):
+        latency = MetricsRegistry().histogram("q_seconds", "q", buckets=(1.0, 2.0, 4.0))
+        for value in [0.5] * 50 + [3.0] * 50:
+            latency.observe(value)
+        summary = latency.summary()
+        assert summary["count"] == 100 and summary["mean"] == pytest.approx(1.75)
+        assert summary["p50"] == pytest.approx(1.0)
+        assert summary["p95"] == pytest.approx(2.0 + 2.0 * 45 / 50)
+
+    def test_label_count_is_checked(self):
+        counter = MetricsRegistry().counter("c_total", "c", ("a", "b"))
+        with pytest.raises(ValueError):
+            counter.labels("only-one")
+
+    def test_gauges_are_collected_at_render_time(self):
+        registry = MetricsRegistry()
+        sizes = {("s1", "resident"): 100}
+        registry.gauge("idx_bytes", "sizes", lambda: sizes, ("session", "state"))
+        registry.gauge("broken", "fails", lambda: 1 / 0)
+        sizes[("s2", "spilled")] = 50
+        text = registry.render()
+        assert 'idx_bytes{session="s2",state="spilled"} 50' in text
+        assert "broken" not in text
+
+    def test_extraction_records_cache_and_timing(self, tmp_path, monkeypatch):
+        cache = ExtractionCache(str(tmp_path), max_bytes=10_000_000)
+        monkeypatch.setattr(document_module, "get_extraction_cache", lambda: cache)
+        hits, misses = EXTRACTION_CACHE.value("hit"), EXTRACTION_CACHE.value("miss")
+        parsed = EXTRACTION_SECONDS.summary("txt")["count"]
+        extract_text_from_file(b"metrics text", "m.txt", content_hash="metrics")
+        extract_text_from_file(b"metrics text", "m.txt", content_hash="metrics")
+        assert EXTRACTION_CACHE.value("miss") == misses + 1
+        assert EXTRACTION_CACHE.value("hit") == hits + 1
+        assert EXTRACTION_SECONDS.summary("txt")["count"] == parsed + 1
+
+    def test_http_endpoint_serves_prometheus_text(self):
+        from urllib.request import urlopen
+
+        from docuchat.core.metrics import start_metrics_server
+
+        server = start_metrics_server(port=0, host="127.0.0.1")
+        with urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics", timeout=5) as resp:
+            body = resp.read().decode()
+            assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert "# TYPE docuchat_extraction_seconds histogram" in body
+        assert "docuchat_process_resident_bytes" in body
+
+
+# =============================================================================
+# 18. Offline Hashing Embeddings
+# =============================================================================
+
+
+class TestHashingEmbeddings:
+    def test_vectors_are_normalized_and_sized(self):
+        vectors = HashingEmbeddings(dim=64).embed_documents(["the quick brown fox", ""])
+        assert len(vectors) == 2 and len(vectors[0]) == 64
+        assert np.linalg.norm(vectors[0]) == pytest.approx(1.0, abs=1e-6)
+        assert not any(vectors[1])  # empty text: zero vector, no NaNs
+
+    def test_identical_in_every_process(self):
+        import subprocess
+
+        code = (
+            "from docuchat.core.embeddings import HashingEmbeddings;"
+            "print(HashingEmbeddings(16).embed_query('Remote work policy'))"
+        )
+        outputs = {
+            subprocess.run(
+                [sys.executable, "-c", code],
+                capture_output=True, text=True, check=True,
+                cwd=Path(__file__).parent.parent, env={**os.environ, "PYTHONHASHSEED": seed},
+            ).stdout.strip().splitlines()[-1]
+            for seed in ("1", "2")
+        }
+        assert len(outputs) == 1
+        assert outputs == {str(HashingEmbeddings(16).embed_query("Remote work policy"))}
+
+    def test_shared_words_score_higher(self):
+        emb = HashingEmbeddings()
+        query = np.array(emb.embed_query("annual leave days for employees"))
+        docs = np.array(emb.embed_documents([
+            "Employees receive 25 days of annual leave per year.",
+            "The API rate limit is 100 requests per minute.",
+        ]))
+        related, unrelated = docs @ query
+        assert related > unrelated + 0.3
+
+    def test_backend_selected_by_environment(self, monkeypatch):
+        monkeypatch.setenv("DOCUCHAT_EMBEDDINGS", "hash")
+        assert isinstance(make_embeddings(), HashingEmbeddings)
+        hashed_id = embedding_model_id()
+        monkeypatch.setenv("DOCUCHAT_EMBEDDINGS", "minilm")
+        assert embedding_model_id() != hashed_id  # snapshots can't be mixed up
+        monkeypatch.setenv("DOCUCHAT_EMBEDDINGS", "word2vec")
+        with pytest.raises(ValueError):
+            make_embeddings()
+
+    def test_pipeline_runs_without_a_model(self, monkeypatch):
+        monkeypatch.setattr(rag_module, "_get_embeddings", HashingEmbeddings)
+        text = extract_text_from_file(str(FIXTURES_DIR / "company_policy.txt"), "company_policy.txt")
+        store = build_vector_store([{"original_name": "company_policy.txt", "text_content": text}])
+        [(doc, _)] = store.similarity_search_with_score("remote work policy", k=1)
+        assert "remote" in doc.page_content.lower()
+
+
+# =============================================================================
+# 19. ONNX Runtime Embedding Backend
+# =============================================================================
+
+
+class TestOnnxBackend:
+    def test_backend_names_route_to_onnx(self, monkeypatch):
+        built = []
+        monkeypatch.setattr(embeddings_module, "make_onnx_embeddings", lambda quantize=False: built.append(quantize))
+        for backend in ("onnx", "onnx-int8"):
+            monkeypatch.setenv("DOCUCHAT_EMBEDDINGS", backend)
+            make_embeddings()
+        assert built == [False, True]
+        assert embedding_model_id() == "sentence-transformers/all-MiniLM-L6-v2:normalized"
+
+    def test_quantization_target_is_a_known_preset(self):
+        assert embeddings_module._quantization_target() in ("arm64", "avx2", "avx512", "avx512_vnni")
+
+    def test_existing_export_is_reused(self, tmp_path, monkeypatch):
+        (tmp_path / "onnx").mkdir()
+        (tmp_path / "onnx" / "model.onnx").write_bytes(b"")
+        (tmp_path / "onnx" / "model_quint8_avx2.onnx").write_bytes(b"")
+        monkeypatch.setattr(embeddings_module, "_quantization_target", lambda: "avx2")
+        export = embeddings_module.export_onnx_model
+        assert export(str(tmp_path)) == (str(tmp_path), "onnx/model.onnx")
+        assert export(str(tmp_path), quantize=True) == (str(tmp_path), "onnx/model_quint8_avx2.onnx")
+
+
+# =============================================================================
+# 20. Start-up Warm-up and Readiness
+# =============================================================================
+
+
+class TestWarmup:
+    @pytest.fixture(autouse=True)
+    def fresh_state(self, monkeypatch):
+        monkeypatch.setattr(warmup_module, "_ready", threading.Event())
+        monkeypatch.setattr(rag_module, "_get_embeddings", HashingEmbeddings)
+
+    def test_warm_up_runs_every_step_and_marks_ready(self):
+        assert not warmup_module.is_ready()
+        report = warmup_module.warm_up()
+        assert report.ready and report.error is None
+        assert list(report.seconds) == ["imports", "load_embeddings", "embed", "search"]
+        assert warmup_module.is_ready() and warmup_module.wait_ready(0)
+        assert "docuchat_ready 1" in metrics_module.REGISTRY.render()
+
+    def test_failed_warm_up_stays_not_ready(self, monkeypatch):
+        def broken():
+            raise OSError("model download failed")
+
+        monkeypatch.setattr(rag_module, "_get_embeddings", broken)
+        report = warmup_module.warm_up()
+        assert not report.ready and "model download failed" in report.error
+        assert not warmup_module.is_ready()
+
+    def test_failed_warm_up_is_retried(self, monkeypatch):
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise OSError("model download failed")
+            return HashingEmbeddings()
+
+        monkeypatch.setattr(rag_module, "_get_embeddings", flaky)
+        monkeypatch.setattr(warmup_module, "_RETRY_BACKOFF_BASE", 0.01)
+        monkeypatch.setattr(warmup_module, "_thread", None)
+        warmup_module.start_warmup()
+        assert warmup_module.wait_ready(10)
+        assert len(attempts) == 3 and warmup_module.warmup_report().attempt == 3
+
+    def test_warm_up_loads_every_pool_worker(self, monkeypatch):
+        pool = EmbeddingPool(workers=2, factory=HashingEmbeddings)
+        monkeypatch.setattr(rag_module, "_get_embeddings", lambda: pool)
+        try:
+            assert warmup_module.warm_up().ready
+            assert len(pool._executor._processes) == 2
+        finally:
+            pool.close()
+
+    def test_ready_endpoint_follows_readiness(self, monkeypatch):
+        from urllib.error import HTTPError
+        from urllib.request import urlopen
+
+        server = metrics_module.start_metrics_server(port=0, host="127.0.0.1")
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        monkeypatch.setattr(metrics_module, "_readiness_check", warmup_module.is_ready)
+        with pytest.raises(HTTPError) as excinfo:
+            urlopen(f"{base}/ready", timeout=5)
+        assert excinfo.value.code == 503
+        with urlopen(f"{base}/healthz", timeout=5) as resp:
+            assert resp.status == 200
+        warmup_module.warm_up()
+        with urlopen(f"{base}/ready", timeout=5) as resp:
+            assert resp.status == 200
+
+
+# =============================================================================
+# 21. Boilerplate Stripping
+# =============================================================================
+
+
+def _make_pdf(pages: list[list[str]]) -> bytes:
+    """A minimal valid PDF with one text line per entry on each page."""
+    n = len(pages)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>"
+        % (b" ".join(b"%d 0 R" % (4 + 2 * i) for i in range(n)), n),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, lines in enumerate(pages):
+        ops = ["BT /F1 10 Tf 12 TL 50 780 Td"]
+        for line in lines:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            ops.append(f"({escaped}) Tj T*")
+        stream = "\n".join(ops + ["ET"]).encode("latin-1")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (5 + 2 * i)
+        )
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def _report_page(i: int, total: int) -> list[str]:
+    return [
+        "ACME Corp  -  Confidential",
+        f"Annual Report {2020 + i % 2}",  # alternates: on half the pages each
+        f"Section {i} covers the results of region {i}.",
+        f"Revenue in Q{i % 4 + 1} was {1000 + i} units.",
+        f"Staff count grew by {i * 3} people over the year.",  # near the edge, but long
+        f"Page {i + 1} of {total}",
+    ]
+
+
+class TestBoilerplate:
+    def test_strips_running_header_and_numbered_footer(self):
+        pages = ["\n".join(_report_page(i, 8)) for i in range(8)]
+        stripped = strip_boilerplate(pages)
+        for i, text in enumerate(stripped):
+            assert "Confidential" not in text and "Page " not in text
+            assert f"Section {i} covers the results of region {i}." in text
+
+    def test_numbers_in_body_lines_are_not_wildcarded(self):
+        pages = ["\n".join(_report_page(i, 8)) for i in range(8)]
+        stripped = strip_boilerplate(pages)
+        assert all("Revenue in Q" in text and "Staff count" in text for text in stripped)
+
+    def test_too_few_pages_are_left_alone(self):
+        pages = ["\n".join(_report_page(i, 2)) for i in range(2)]
+        assert strip_boilerplate(pages) == pages
+
+    def test_lines_below_share_are_kept(self):
+        pages = [f"Body text of page {i} goes here.\nrare footer" for i in range(2)]
+        pages += [f"Body text of page {i} goes here." for i in range(2, 6)]
+        assert strip_boilerplate(pages) == pages
+
+    def test_page_labels_survive(self):
+        pages = [f"[Page {i}]\nShared notice\nUnique text {c}" for i, c in enumerate("abcd", 1)]
+        stripped = strip_boilerplate(pages)
+        assert all(p.startswith("[Page ") and "Shared notice" not in p for p in stripped)
+
+    def test_lines_on_two_of_three_pages_are_kept(self):
+        pages = [
+            "Quarter | Revenue | Cost\nQ1 | 10 | 4",
+            "Quarter | Revenue | Cost\nQ2 | 12 | 5",
+            "Closing remarks on the year.",
+        ]
+        assert strip_boilerplate(pages) == pages
+
+    def test_repeated_numbered_headings_are_kept(self):
+        pages = [f"Chapter {1 + i // 3}\nBody text of page {i}.\nMore body {i}." for i in range(9)]
+        stripped = strip_boilerplate(pages)
+        assert all(text.startswith("Chapter ") for text in stripped)
+
+    def test_body_lines_are_never_removed(self):
+        middle = "The warranty covers parts and labour."
+        pages = [f"Intro {i}\nLead {i}\n{middle}\nTail {i}\nEnd {i}" for i in range(6)]
+        assert all(middle in text for text in strip_boilerplate(pages))
+
+    def test_pdf_extraction_strips_headers_and_keeps_page_labels(self):
+        pdf = _make_pdf([_report_page(i, 6) for i in range(6)])
+        text = extract_text_from_file(pdf, "report.pdf")
+        assert "Confidential" not in text and "of 6" not in text
+        assert len(page_offsets(text)) == 6 and text.startswith("[Page 1]\n")
+        assert "Section 5 covers the results of region 5." in text
+
+    def test_form_feed_pages_in_text_files(self):
+        raw = "\f".join("\n".join(_report_page(i, 5)) for i in range(5))
+        text = extract_text_from_file(raw.encode(), "export.txt")
+        assert "Confidential" not in text and "Section 4 covers" in text
+
+    def test_split_documents_does_not_depend_on_file_grouping(self):
+        notice = "This document is proprietary to ACME Corp."
+        files = [
+            {"original_name": f"{name}.txt", "text_content": f"{notice}\nAll about {name}."}
+            for name in ("alpha", "beta", "gamma")
+        ]
+        together = [c.page_content for c in split_documents(files)]
+        alone = [c.page_content for f in files for c in split_documents([f])]
+        assert together == alone and all(notice in text for text in together)
+
+    def test_split_documents_keeps_shared_body_of_similar_files(self):
+        body = "\n".join(f"Clause {i}: the supplier shall deliver on time." for i in range(10))
+        files = [
+            {"original_name": f"contract_v{v}.txt", "text_content": f"Version {v}\n{body}\nSigned {v}"}
+            for v in range(1, 4)
+        ]
+        text = " ".join(c.page_content for c in split_documents(files))
+        assert text.count("Clause 5:") == 3
+
+
+# =============================================================================
+# 22. Hierarchical Summaries
+# =============================================================================
+
+
+class _FakeSummarizer:
+    """Records calls; the summary of a text is its first few words."""
+
+    model = "fake-summarizer"
+
+    def __init__(self, delay: float = 0.0):
+        self.calls: list[tuple[str, str]] = []
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, instruction: str, text: str) -> str:
+        with self._lock:
+            self.calls.append((instruction, text))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        return "summary: " + " ".join(text.split()[:12])
+
+
+def _long_text(paragraphs: int, tag: str = "") -> str:
+    return "\n\n".join(
+        f"Paragraph {i}{tag}. " + f"Sentence about topic {i} with supporting detail. " * 12
+        for i in range(paragraphs)
+    )
+
+
+class TestSummaryTree:
+    def test_levels_reduce_to_one_document_summary(self, tmp_path):
+        summarize = _FakeSummarizer()
+        text = _long_text(200)  # ~130k chars -> ~22 leaves -> 4 sections -> 1
+        tree = build_summary_trees(
+            {"big.txt": text}, summarize, ExtractionCache(str(tmp_path), 1 << 26)
+        )["big.txt"]
+        leaves = len(tree.levels[0])
+        assert leaves > summaries_module._FANOUT
+        assert [len(level) for level in tree.levels[1:]][-1] == 1
+        assert len(tree.levels[1]) == -(-leaves // summaries_module._FANOUT)
+        assert tree.level_name(0) == "chunk summary"
+        assert tree.level_name(1) == "section summary"
+        assert tree.level_name(len(tree.levels) - 1) == "document summary"
+
+    def test_short_document_is_a_single_summary(self, tmp_path):
+        tree = build_summary_trees(
+            {"a.txt": "Just one short paragraph.", "empty.txt": "  "},
+            _FakeSummarizer(),
+            ExtractionCache(str(tmp_path), 1 << 26),
+        )
+        assert list(tree) == ["a.txt"]
+        assert tree["a.txt"].levels == [["summary: Just one short paragraph."]]
+
+    def test_cached_by_content_not_name(self, tmp_path):
+        cache = ExtractionCache(str(tmp_path), 1 << 26)
+        text = _long_text(30)
+        first = _FakeSummarizer()
+        build_summary_trees({"report.txt": text}, first, cache)
+        again = _FakeSummarizer()
+        tree = build_summary_trees({"renamed.txt": text}, again, cache)["renamed.txt"]
+        assert first.calls and not again.calls
+        assert tree.summary.startswith("summary:")
+
+    def test_level_calls_run_in_parallel(self, tmp_path):
+        summarize = _FakeSummarizer(delay=0.05)
+        build_summary_trees(
+            {f"d{i}.txt": _long_text(20, tag=f"-{i}") for i in range(3)},
+            summarize,
+            ExtractionCache(str(tmp_path), 1 << 26),
+            max_workers=4,
+        )
+        assert summarize.max_active > 1
+
+    def test_broad_question_detection(self):
+        for q in [
+            "Summarize this document",
+            "What are the main themes?",
+            "Give me an overview of the report",
+            "Compare the policy and the spec",
+            "What is this paper about?",
+        ]:
+            assert is_broad_question(q), q
+        for q in ["How many days of annual leave?", "What is the maximum throughput?"]:
+            assert not is_broad_question(q), q
+
+    def test_select_deepest_level_within_budget(self):
+        tree = SummaryTree("spec.pdf", [["x " * 400] * 12, ["y " * 400] * 2, ["z " * 400]])
+        assert {lvl for _, lvl, _ in select_summaries("summarize", [tree], budget=300)} == {
+            "document summary"
+        }
+        assert {lvl for _, lvl, _ in select_summaries("summarize", [tree], budget=600)} == {
+            "section summary"
+        }
+        assert len(select_summaries("summarize", [tree], budget=10_000)) == 12
+
+    def test_named_document_is_targeted_and_budget_holds(self):
+        trees = [
+            SummaryTree(name, [["word " * 2000]])
+            for name in ("company_policy.txt", "product_spec.txt", "research_paper.txt")
+        ]
+        selected = select_summaries("Summarize the product_spec", trees, budget=900)
+        assert [source for source, _, _ in selected] == ["product_spec.txt"]
+        everything = select_summaries("Compare all documents", trees, budget=900)
+        assert len(everything) == 3
+        assert sum(len(text) for _, _, text in everything) // 4 <= 900 + 3
+
+    def test_unready_targets_fall_back_to_retrieval(self):
+        ready = SummaryTree("report_a.txt", [["Report A covers sales."]])
+        building = SummaryTree("report_b.txt", [])
+        assert select_summaries("Summarize my documents", [ready, building]) == []
+        assert select_summaries("Summarize report_b", [ready, building]) == []
+        assert [s for s, _, _ in select_summaries("Summarize report_a", [ready, building])] == [
+            "report_a.txt"
+        ]
+
+    def test_summary_index_builds_in_background(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(
+            summaries_module, "get_summary_cache", lambda: ExtractionCache(str(tmp_path), 1 << 26)
+        )
+        summarize = _FakeSummarizer()
+        index = SummaryIndex(lambda api_key: summarize)
+        index.refresh({"h1": ("a.txt", "Alpha text."), "h2": ("b.txt", "Beta text.")}, "gsk_x")
+        index.wait(10)
+        assert index.missing(["h1", "h2", "h3"]) == ["h3"]
+        trees = index.trees_for({"h1": "renamed.txt", "h3": "pending.txt"})
+        assert [(t.source, t.ready) for t in trees] == [("renamed.txt", True), ("pending.txt", False)]
+        calls = len(summarize.calls)
+        index.refresh({"h1": ("a.txt", "Alpha text.")}, "gsk_x")  # nothing new to build
+        index.wait(10)
+        assert len(summarize.calls) == calls
+
+    def test_broad_question_answered_from_summaries(self, monkeypatch):
+        sent = []
+
+        def fake_generate(llm, messages):
+            sent.append(messages[-1].content)
+            return "answer"
+
+        class _NoSearch:
+            def __getattr__(self, name):
+                raise AssertionError("retrieval must be skipped")
+
+        monkeypatch.setattr(rag_module, "_generate", fake_generate)
+        tree = SummaryTree("policy.txt", [["Leave is 25 days.", "Remote work allowed."], ["Policy."]])
+        answer = rag_module.get_ai_response(
+            "Summarize the main points", _NoSearch(), "gsk_" + "a" * 40, summaries=[tree]
+        )
+        assert answer == "answer"
+        assert "[Source 1: policy.txt · chunk summary]" in sent[0]
+        assert "Remote work allowed." in sent[0]
+
+
+# =============================================================================
+# 23. Per-document Map-Reduce Answering
+# =============================================================================
+
+
+def _spec_store(specs: int = 4, chunks: int = 6):
+    """One "spec" per source, each with a warranty chunk among filler chunks."""
+    from langchain_community.vectorstores import FAISS
+
+    texts, metadatas = [], []
+    for s in range(specs):
+        for c in range(chunks):
+            texts.append(
+                f"Warranty terms of product {s}: {s + 1} years parts and labour."
+                if c == 0 else f"Spec {s} section {c}: dimensions, weight and colour options."
+            )
+            metadatas.append({"source": f"spec_{s}.pdf"})
+    return FAISS.from_texts(texts, HashingEmbeddings(), metadatas=metadatas)
+
+
+_MAP_CONFIG = RAGConfig(score_threshold=-1.0, top_k=2, fetch_k=4, min_k=1)  # every chunk counts
+
+
+class TestMapReduce:
+    def test_retrieves_within_each_source(self):
+        store = _spec_store()
+        per_source = retrieve_per_source(
+            store, "warranty terms", top_k=2, fetch_k=4, score_threshold=0.0, lambda_mult=0.7, min_k=1
+        )
+        assert sorted(per_source) == [f"spec_{s}.pdf" for s in range(4)]
+        for source, result in per_source.items():
+            assert result.docs and all(d.metadata["source"] == source for d in result.docs)
+            assert result.docs[0].page_content.startswith("Warranty terms")
+
+    def test_source_positions_follow_index_changes(self):
+        store = _spec_store(specs=2)
+        assert {k: len(v) for k, v in source_positions(store).items()} == {
+            "spec_0.pdf": 6, "spec_1.pdf": 6,
+        }
+        store.add_texts(["New warranty notes."], metadatas=[{"source": "extra.txt"}])
+        assert len(source_positions(store)["extra.txt"]) == 1
+
+    def test_plan_only_for_cross_document_questions(self):
+        store = _spec_store()
+        plan = rag_module.plan_map_reduce(
+            "Compare the warranty terms across all specs", store, _MAP_CONFIG
+        )
+        assert len(plan) == 4
+        assert rag_module.plan_map_reduce("What is the warranty of product 2?", store, _MAP_CONFIG) == {}
+        assert rag_module.plan_map_reduce("How long is the warranty each year?", store, _MAP_CONFIG) == {}
+
+    def test_plan_needs_two_documents(self):
+        store = _spec_store(specs=1)
+        assert rag_module.plan_map_reduce("Compare warranty in each spec", store, _MAP_CONFIG) == {}
+
+    def test_maps_run_concurrently_and_stream(self, monkeypatch):
+        delay = 0.3
+
+        def fake_generate(llm, messages, on_token=None):
+            time.sleep(delay)
+            if llm.model_name == rag_module._MAP_MODEL:
+                return "notes: " + messages[-1].content.split("\n")[0]
+            for piece in ["Merged ", "answer."]:
+                on_token(piece)
+            return "Merged answer."
+
+        monkeypatch.setattr(rag_module, "_generate", fake_generate)
+        plan = rag_module.plan_map_reduce("Compare warranty in each spec", _spec_store(), _MAP_CONFIG)
+        t0 = time.perf_counter()
+        events = list(rag_module.stream_map_reduce(
+            "Compare warranty in each spec", plan, "gsk_" + hashlib.sha256(b"mr").hexdigest()[:40]
+        ))
+        elapsed = time.perf_counter() - t0
+        partial = [e for e in events if e[0] is not None]
+        assert sorted(source for source, _ in partial) == sorted(plan)
+        assert events[len(partial):] == [(None, "Merged "), (None, "answer.")]
+        assert elapsed < 4 * delay  # four maps in parallel + one merge, not five calls in a row
+
+    def test_precomputed_plan_is_not_searched_again(self, monkeypatch):
+        def no_second_plan(*args, **kwargs):
+            raise AssertionError("plan_map_reduce ran twice")
+
+        monkeypatch.setattr(rag_module, "plan_map_reduce", no_second_plan)
+        monkeypatch.setattr(rag_module, "_generate", lambda llm, messages, on_token=None: "Two years.")
+        answer = rag_module.get_ai_response(
+            "What is the warranty of product 1?", _spec_store(), "gsk_" + "c" * 40,
+            config=_MAP_CONFIG, plan={},
+        )
+        assert answer == "Two years."
+
+    def test_auth_failure_ends_stream_with_message(self, monkeypatch):
+        def failing_generate(llm, messages, on_token=None):
+            raise RuntimeError("Error code: 401 - invalid api key")
+
+        monkeypatch.setattr(rag_module, "_generate", failing_generate)
+        plan = {"a.pdf": [], "b.pdf": []}
+        events = list(rag_module.stream_map_reduce("Compare a and b", plan, "gsk_" + "b" * 40))
+        assert events[-1] == (None, "Authentication failed. Please check your API key.")
+
+
+# =============================================================================
+# 24. Extractive Fast Path
+# =============================================================================
+
+
+_POLICY_TEXT = """2.3 Sick Leave
+Employees receive 10 sick days per calendar year, non-accruing. A doctor's
+note is required for absences longer than three consecutive days.
+
+2.4 Parental Leave
+Primary caregivers receive 16 weeks of fully paid parental leave.
+"""
+
+
+def _policy_store():
+    from langchain_community.vectorstores import FAISS
+
+    texts = [_POLICY_TEXT, "Remote work is allowed two days per week with manager approval."]
+    metadatas = [{"source": "policy.txt"}, {"source": "remote.txt"}]
+    return FAISS.from_texts(texts, HashingEmbeddings(), metadatas=metadatas)
+
+
+_FAST_CONFIG = RAGConfig(score_threshold=-1.0, min_k=1, extractive_confidence=0.5)
+
+
+def _fast_retrieval(store, question: str):
+    return retrieve(store, question, top_k=2, fetch_k=2, score_threshold=-1.0, lambda_mult=0.7, min_k=1)
+
+
+class TestExtractive:
+    def test_split_sentences_rejoins_wrapped_prose(self):
+        text = (
+            "[Page 1]\n1.2 Overview\nThe inverter has a peak\nefficiency of 97.8%. It is quiet.\n"
+            "=====\n  Weight            : 21 kg\n  - Wall bracket included\n"
+        )
+        assert split_sentences(text) == [
+            "The inverter has a peak efficiency of 97.8%.",
+            "It is quiet.",
+            "Weight            : 21 kg",
+            "Wall bracket included",
+        ]
+
+    def test_lookup_questions(self):
+        assert is_lookup_question("How many sick days do employees receive?")
+        assert not is_lookup_question("Why do employees receive sick days?")
+        assert not is_lookup_question("Compare sick leave and parental leave")
+        assert is_lookup_question("How long is it?")
+        assert not is_lookup_question("How long is it?", follow_up=True)
+
+    def test_retrieval_keeps_query_embedding(self):
+        store = _policy_store()
+        result = _fast_retrieval(store, "sick days")
+        assert np.allclose(result.query, HashingEmbeddings().embed_query("sick days"))
+
+    def test_extracts_answer_sentence_with_source(self):
+        store = _policy_store()
+        question = "How many sick days do employees receive per year?"
+        answer = extract_answer(question, _fast_retrieval(store, question), store.embeddings, 0.5)
+        assert answer is not None
+        assert answer.sentence == "Employees receive 10 sick days per calendar year, non-accruing."
+        assert answer.source == "policy.txt"
+        assert "[Source: policy.txt]" in answer.render()
+
+    def test_falls_back_below_threshold_or_for_reasoning(self):
+        store = _policy_store()
+        question = "How many sick days do employees receive per year?"
+        retrieval = _fast_retrieval(store, question)
+        assert extract_answer(question, retrieval, store.embeddings, 0.99) is None
+        why = "Why do employees receive sick days per year?"
+        assert extract_answer(why, _fast_retrieval(store, why), store.embeddings, 0.1) is None
+
+    def test_overlap_duplicates_do_not_hide_the_answer(self):
+        from langchain_core.documents import Document
+
+        from docuchat.core.retrieval import Retrieval
+
+        sentence = "Employees receive 10 sick days per calendar year."
+        docs = [
+            Document(page_content=f"Leave rules. {sentence}", metadata={"source": "a.txt"}),
+            Document(page_content=f"{sentence} Unused days lapse.", metadata={"source": "a.txt"}),
+        ]
+        retrieval = Retrieval(docs, [1.0, 0.9], 2, False)
+        answer = best_sentence("How many sick days per calendar year?", retrieval, HashingEmbeddings())
+        assert answer.sentence == sentence
+        assert answer.margin > 0
+
+    def test_get_ai_response_skips_llm_for_confident_lookup(self, monkeypatch):
+        calls = []
+
+        def fake_generate(llm, messages):
+            calls.append(messages)
+            return "llm answer"
+
+        monkeypatch.setattr(rag_module, "_generate", fake_generate)
+        store = _policy_store()
+        key = "gsk_" + "e" * 40
+        question = "How many sick days do employees receive per year?"
+        before = metrics_module.EXTRACTIVE_ANSWERS.value()
+        answer = rag_module.get_ai_response(question, store, key, config=_FAST_CONFIG, extractive=True)
+        assert answer.startswith("Employees receive 10 sick days")
+        assert not calls
+        assert metrics_module.EXTRACTIVE_ANSWERS.value() == before + 1
+
+        assert rag_module.get_ai_response(question, store, key, config=_FAST_CONFIG) == "llm answer"
+        assert len(calls) == 1
+
+    def test_config_validates_threshold(self):
+        with pytest.raises(ValueError):
+            RAGConfig(extractive_confidence=0.0)
+        assert RAGConfig.from_env({"DOCUCHAT_EXTRACTIVE_CONFIDENCE": "0.8"}).extractive_confidence == 0.8
+
+
+# =============================================================================
+# 25. Sharded Knowledge Base
+# =============================================================================
+
+
+def _write_topic_files(root: Path, count: int) -> None:
+    root.mkdir(parents=True, exist_ok=True)
+    for i in range(count):
+        (root / f"topic_{i}.txt").write_text(
+            f"Topic {i} handbook. The warranty for model {i} lasts {i + 1} years. "
+            f"Model {i} ships in colour code C{i}."
+        )
+
+
+class TestSharding:
+    @pytest.fixture(scope="class")
+    def sharded(self, tmp_path_factory):
+        from docuchat.core.sharding import ShardedIndex, shard_directory
+
+        base = tmp_path_factory.mktemp("sharded")
+        _write_topic_files(base / "docs", 8)
+        for shard in range(2):
+            ingest_directory(
+                str(base / "docs"), shard_directory(str(base / "kb"), shard, 2),
+                HashingEmbeddings(), workers=1, progress=False, shard=(shard, 2),
+            )
+        index = ShardedIndex(str(base / "kb"), HashingEmbeddings(), timeout=10.0)
+        yield base, index
+        index.close()
+
+    def _ask(self, index, question: str, top_k: int = 3):
+        return index.retrieve(
+            question, top_k=top_k, fetch_k=8, score_threshold=-1.0, lambda_mult=0.7, min_k=1
+        )
+
+    def test_shard_of_is_stable_and_balanced(self):
+        from docuchat.core.sharding import shard_of
+
+        paths = [f"dir/file_{i}.pdf" for i in range(1000)]
+        counts = [0] * 4
+        for path in paths:
+            counts[shard_of(path, 4)] += 1
+        assert all(180 < c < 320 for c in counts)
+        assert [shard_of(p, 4) for p in paths] == [shard_of(p, 4) for p in paths]
+
+    def test_ingest_splits_files_across_shards(self, sharded):
+        from docuchat.core.sharding import shard_directory, shard_of
+
+        base, index = sharded
+        records = [
+            set(KnowledgeBase(shard_directory(str(base / "kb"), s, 2), HashingEmbeddings()).records)
+            for s in range(2)
+        ]
+        assert not records[0] & records[1]
+        assert records[0] | records[1] == {f"topic_{i}.txt" for i in range(8)}
+        assert all(shard_of(path, 2) == s for s in range(2) for path in records[s])
+        assert index.sizes == [len(r) for r in records]
+
+    def test_scatter_gather_merges_all_shards(self, sharded):
+        from docuchat.core.sharding import shard_of
+
+        _, index = sharded
+        result = self._ask(index, "Topic 5 handbook warranty for model 5", top_k=4)
+        assert result.missing == []
+        assert result.docs[0].metadata["source"] == "topic_5.txt"
+
+        pool, missing = index.search(result.query[None, :], fetch_k=8)
+        assert missing == [] and len(pool) == 8
+        assert {shard_of(doc.metadata["source"], 2) for _, doc, _ in pool} == {0, 1}
+        assert [score for score, _, _ in pool] == sorted((s for s, _, _ in pool), reverse=True)
+
+    def test_query_survives_a_shard_timeout(self, sharded):
+        from concurrent.futures import Future
+
+        from docuchat.core.sharding import shard_of
+
+        class _Stuck:
+            def submit(self, *args):
+                return Future()  # never completes
+
+        _, index = sharded
+        healthy, index._executors[1] = index._executors[1], _Stuck()
+        index.timeout = 0.2
+        try:
+            t0 = time.perf_counter()
+            result = self._ask(index, "warranty for model")
+            assert time.perf_counter() - t0 < 2
+        finally:
+            index._executors[1], index.timeout = healthy, 10.0
+        assert result.missing == [1]
+        assert result.docs and all(shard_of(d.metadata["source"], 2) == 0 for d in result.docs)
+
+    def test_overrunning_search_does_not_queue_later_queries(self, sharded):
+        from concurrent.futures import Future
+
+        class _Busy:
+            def __init__(self):
+                self.submitted: list[Future] = []
+
+            def submit(self, *args):
+                future = Future()
+                future.set_running_or_notify_cancel()  # the worker is inside the search
+                self.submitted.append(future)
+                return future
+
+        _, index = sharded
+        busy = _Busy()
+        healthy, index._executors[1] = index._executors[1], busy
+        index.timeout = 0.2
+        try:
+            assert self._ask(index, "warranty for model").missing == [1]
+            t0 = time.perf_counter()
+            assert self._ask(index, "warranty for model").missing == [1]
+            assert time.perf_counter() - t0 < 0.2  # skipped, not waited for
+            assert len(busy.submitted) == 1
+            busy.submitted[0].set_result([])
+            self._ask(index, "warranty for model")
+            assert len(busy.submitted) == 2  # searched again once the worker was free
+        finally:
+            index._executors[1], index.timeout = healthy, 10.0
+            index._stalled.clear()
+
+    def test_failed_restarts_back_off(self, sharded, monkeypatch):
+        from concurrent.futures.process import BrokenProcessPool
+
+        class _Broken:
+            def submit(self, *args):
+                raise BrokenProcessPool("worker died")
+
+        attempts = []
+
+        def failing_replace(shard, terminate=False):
+            attempts.append(shard)
+            raise RuntimeError("index does not load")
+
+        _, index = sharded
+        monkeypatch.setattr(index, "_replace", failing_replace)
+        healthy, index._executors[1] = index._executors[1], _Broken()
+        try:
+            for _ in range(5):
+                assert self._ask(index, "warranty for model").missing == [1]
+                deadline = time.monotonic() + 5
+                while 1 in index._reloading and time.monotonic() < deadline:
+                    time.sleep(0.01)
+            assert attempts == [1]
+            assert index._restart_failures == {1: 1}
+            assert index._retry_at[1] > time.monotonic()
+        finally:
+            index._executors[1] = healthy
+            index._restart_failures.clear()
+            index._retry_at.clear()
+
+    def test_reload_serves_a_rebuilt_shard(self, sharded):
+        from docuchat.core.sharding import shard_directory, shard_of
+
+        base, index = sharded
+        name = next(f"extra_{i}.txt" for i in range(100) if shard_of(f"extra_{i}.txt", 2) == 0)
+        (base / "docs" / name).write_text("Zephyr onboarding checklist for new starters.")
+        ingest_directory(
+            str(base / "docs"), shard_directory(str(base / "kb"), 0, 2),
+            HashingEmbeddings(), workers=1, progress=False, shard=(0, 2),
+        )
+        assert "Zephyr" not in self._ask(index, "Zephyr onboarding checklist").docs[0].page_content
+        index.reload(0)
+        assert self._ask(index, "Zephyr onboarding checklist").docs[0].metadata["source"] == name
+
+    def test_get_ai_response_retrieves_from_shards(self, sharded, monkeypatch):
+        sent = []
+
+        def fake_generate(llm, messages):
+            sent.append(messages[-1].content)
+            return "answer"
+
+        monkeypatch.setattr(rag_module, "_generate", fake_generate)
+        _, index = sharded
+        config = RAGConfig(score_threshold=-1.0, min_k=1)
+        answer = rag_module.get_ai_response(
+            "How long is the warranty for model 3?", index, "gsk_" + "s" * 40, config=config
+        )
+        assert answer == "answer"
+        assert "topic_3.txt" in sent[0]
+
+    def test_mixed_shard_layouts_are_rejected(self, tmp_path):
+        from docuchat.core.sharding import shard_count, shard_directory
+
+        os.makedirs(shard_directory(str(tmp_path), 0, 2))
+        assert shard_count(str(tmp_path)) == 2
+        os.makedirs(shard_directory(str(tmp_path), 0, 3))
+        with pytest.raises(ValueError):
+            shard_count(str(tmp_path))
+
+
+# =============================================================================
+# 26. Shared Embedding Server
+# =============================================================================
+
+
+class _CountingEmbeddings(HashingEmbeddings):
+    """Hashing embedder that records the size of every model call."""
+
+    def __init__(self, delay: float = 0.0):
+        super().__init__()
+        self.calls: list[int] = []
+        self.delay = delay
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls.append(len(texts))
+        time.sleep(self.delay)
+        return super().embed_documents(texts)
+
+
+class TestEmbedServer:
+    @pytest.fixture
+    def server(self, tmp_path):
+        from docuchat.core.embed_server import EmbeddingServer
+
+        server = EmbeddingServer(f"unix:{tmp_path}/embed.sock", HashingEmbeddings()).start()
+        yield server
+        server.shutdown()
+
+    def test_parse_address(self):
+        from docuchat.core.embed_server import parse_address
+
+        assert parse_address("unix:/run/embed.sock") == ("unix", "/run/embed.sock")
+        assert parse_address("/run/embed.sock") == ("unix", "/run/embed.sock")
+        assert parse_address("127.0.0.1:8765") == ("tcp", ("127.0.0.1", 8765))
+        assert parse_address("http://localhost:8765/") == ("tcp", ("localhost", 8765))
+        with pytest.raises(ValueError):
+            parse_address("localhost")
+
+    def test_batcher_merges_concurrent_requests(self):
+        from docuchat.core.embed_server import MicroBatcher
+
+        model = _CountingEmbeddings()
+        batcher = MicroBatcher(model.embed_documents, max_delay=0.5, max_batch=64)
+        results = {}
+        threads = [
+            threading.Thread(target=lambda i=i: results.__setitem__(i, batcher.embed([f"query {i}"])))
+            for i in range(6)
+        ]
+        try:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            batcher.close()
+        assert model.calls == [6]
+        for i, vectors in results.items():
+            assert np.allclose(vectors[0], HashingEmbeddings().embed_query(f"query {i}"))
+
+    def test_zero_delay_still_batches_queued_requests(self):
+        from docuchat.core.embed_server import MicroBatcher
+
+        model = _CountingEmbeddings(delay=0.2)
+        batcher = MicroBatcher(model.embed_documents, max_delay=0.0, max_batch=64)
+        first = threading.Thread(target=batcher.embed, args=(["busy"],))
+        first.start()
+        time.sleep(0.05)  # the model is now busy with the first request
+        waiting = [threading.Thread(target=batcher.embed, args=([f"q{i}"],)) for i in range(4)]
+        for t in waiting:
+            t.start()
+        for t in [first, *waiting]:
+            t.join()
+        batcher.close()
+        assert model.calls == [1, 4]
+
+    def test_batcher_propagates_model_errors(self):
+        from docuchat.core.embed_server import MicroBatcher
+
+        def broken(texts):
+            raise RuntimeError("model crashed")
+
+        batcher = MicroBatcher(broken, max_delay=0.0)
+        with pytest.raises(RuntimeError, match="model crashed"):
+            batcher.embed(["text"])
+        batcher.close()
+
+    @pytest.mark.parametrize("transport", ["unix", "tcp"])
+    def test_remote_vectors_match_local(self, transport, tmp_path):
+        from docuchat.core.embed_server import EmbeddingServer, RemoteEmbeddings
+
+        address = f"unix:{tmp_path}/embed.sock" if transport == "unix" else "127.0.0.1:0"
+        server = EmbeddingServer(address, HashingEmbeddings()).start()
+        try:
+            remote = RemoteEmbeddings(server.address)
+            texts = ["Annual leave is 25 days.", "Sick days: 10 per year.", ""]
+            assert np.allclose(remote.embed_documents(texts), HashingEmbeddings().embed_documents(texts))
+            assert np.allclose(remote.embed_query("leave"), HashingEmbeddings().embed_query("leave"))
+            assert remote.embed_documents([]) == []
+        finally:
+            server.shutdown()
+
+    def test_create_embeddings_uses_the_server(self, tmp_path, monkeypatch):
+        from docuchat.core.embed_server import EmbeddingServer, RemoteEmbeddings
+
+        monkeypatch.setenv("DOCUCHAT_EMBEDDINGS", "hash")
+        server = EmbeddingServer(f"unix:{tmp_path}/embed.sock", HashingEmbeddings()).start()
+        monkeypatch.setenv("DOCUCHAT_EMBED_SERVER", server.address)
+        embeddings = embeddings_module.create_embeddings()
+        assert isinstance(embeddings, RemoteEmbeddings)
+        assert not isinstance(embeddings_module.create_embeddings(remote=False), RemoteEmbeddings)
+
+        monkeypatch.setattr(rag_module, "_get_embeddings", lambda: embeddings)
+        store = build_vector_store(
+            [{"original_name": "policy.txt", "text_content": "Employees receive 25 days of annual leave."}]
+        )
+        docs = store.similarity_search("annual leave", k=1)
+        server.shutdown()
+        assert docs[0].metadata["source"] == "policy.txt"
+
+    def test_model_mismatch_is_rejected(self, server):
+        from docuchat.core.embed_server import RemoteEmbeddings
+
+        server._server.model_id = "some/other-model:normalized"
+        with pytest.raises(ValueError, match="other-model"):
+            RemoteEmbeddings(server.address).embed_query("leave")
+
+    def test_client_waits_for_a_starting_server(self, tmp_path):
+        from docuchat.core.embed_server import EmbeddingServer, RemoteEmbeddings
+
+        address = f"unix:{tmp_path}/embed.sock"
+        started = []
+        timer = threading.Timer(
+            0.5, lambda: started.append(EmbeddingServer(address, HashingEmbeddings()).start())
+        )
+        timer.start()
+        try:
+            vector = RemoteEmbeddings(address, connect_timeout=10).embed_query("leave")
+        finally:
+            timer.join()
+            for server in started:
+                server.shutdown()
+        assert np.allclose(vector, HashingEmbeddings().embed_query("leave"))
+        with pytest.raises(ConnectionError):
+            RemoteEmbeddings(address, connect_timeout=0.3).embed_query("leave")
+
+    def test_client_recovers_after_a_read_timeout(self, tmp_path):
+        from docuchat.core.embed_server import EmbeddingServer, RemoteEmbeddings
+
+        model = _CountingEmbeddings()
+        server = EmbeddingServer(f"unix:{tmp_path}/embed.sock", model).start()
+        try:
+            remote = RemoteEmbeddings(server.address, timeout=0.3)
+            remote.embed_query("warm")
+            model.delay = 1.0
+            with pytest.raises(TimeoutError):
+                remote.embed_query("slow")
+            model.delay = 0.0
+            time.sleep(1.0)  # let the slow batch finish
+            assert np.allclose(remote.embed_query("leave"), HashingEmbeddings().embed_query("leave"))
+        finally:
+            server.shutdown()